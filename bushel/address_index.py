@@ -0,0 +1,330 @@
+"""
+Index of the addresses used by relays, for answering whether an address was
+a Tor relay at a time without scanning consensuses.
+
+Each IPv4 address from a consensus ``r`` line and each IPv6 address from an
+``a`` line is recorded as an interval during which the address was used by a
+relay. The index is kept in two files::
+
+    address-index/intervals.idx   # Sorted (address, fingerprint, start, end)
+    address-index/intervals.log   # Unsorted entries not yet merged
+
+Each entry is a fixed-size record of the address (as 16 bytes, with IPv4
+addresses mapped into IPv6), the relay fingerprint, and the start and end of
+the interval as seconds since the epoch. The end is exclusive.
+
+The archive adds each unflavored consensus to the index as it is stored,
+including those imported with :py:func:`bushel.ingest.import_tarball`.
+Adding a consensus appends an entry for each address covering the period from
+its valid-after to its fresh-until time to the log. Once the log grows beyond
+:py:data:`MERGE_THRESHOLD` entries it is merged into the sorted index, and
+entries for the same address and relay in consecutive consensuses are
+coalesced into a single interval at the same time. Lookups perform a binary
+search of the memory-mapped sorted index and check the (small) log in
+memory. For example::
+
+    for interval in archive.address_index.lookup("198.51.100.7", when):
+        print(interval.fingerprint, interval.start, interval.end)
+"""
+
+import datetime
+import ipaddress
+import logging
+import mmap
+import os
+import os.path
+import struct
+import threading
+import typing
+
+LOG = logging.getLogger('bushel')
+
+MERGE_THRESHOLD = 65536
+
+ENTRY = struct.Struct(">16s20sII")
+
+
+def _address_key(address):
+    address = ipaddress.ip_address(address)
+    if address.version == 4:
+        address = ipaddress.IPv6Address(b"\0" * 10 + b"\xff" * 2 +
+                                        address.packed)
+    return address.packed
+
+
+def _address_str(key):
+    address = ipaddress.IPv6Address(key)
+    return str(address.ipv4_mapped or address)
+
+
+def _epoch(timestamp):
+    return int(timestamp.replace(tzinfo=datetime.timezone.utc).timestamp())
+
+
+def _datetime(epoch):
+    return datetime.datetime.utcfromtimestamp(epoch)
+
+
+def consensus_addresses(consensus):
+    """
+    Lists the addresses of the relays in a consensus.
+
+    :param ~stem.descriptor.networkstatus.NetworkStatusDocumentV3 consensus:
+        An unflavored consensus.
+
+    :returns: A :py:class:`set` of (address, fingerprint) tuples.
+    """
+    addresses = set()
+    for router in consensus.routers.values():
+        addresses.add((router.address, router.fingerprint))
+        for address, _, _ in router.or_addresses:
+            addresses.add((address, router.fingerprint))
+    return addresses
+
+
+def coalesce(entries):
+    """
+    Merges overlapping or adjacent intervals for the same address and relay.
+    For example:
+
+    >>> coalesce([(b"a", b"f", 0, 10), (b"a", b"f", 10, 20),
+    ...           (b"a", b"g", 5, 10), (b"a", b"f", 30, 40)])
+    [(b'a', b'f', 0, 20), (b'a', b'f', 30, 40), (b'a', b'g', 5, 10)]
+
+    :param entries: An iterable of (address, fingerprint, start, end) tuples.
+
+    :returns: A sorted :py:class:`list` of tuples.
+    """
+    merged = []
+    for entry in sorted(entries):
+        if merged and merged[-1][:2] == entry[:2] and \
+                entry[2] <= merged[-1][3]:
+            last = merged[-1]
+            merged[-1] = last[:3] + (max(last[3], entry[3]), )
+        else:
+            merged.append(tuple(entry))
+    return merged
+
+
+class AddressInterval(typing.NamedTuple):
+    """
+    A period during which an address was used by a relay.
+    """
+    address: str
+    """The IPv4 or IPv6 address."""
+    fingerprint: str
+    """The upper-case hex-encoded fingerprint of the relay."""
+    start: datetime.datetime
+    """The valid-after time of the first consensus listing the address."""
+    end: datetime.datetime
+    """The fresh-until time of the last consensus listing the address."""
+
+
+class AddressIndex:
+    """
+    Sorted, memory-mapped index of relay addresses over time.
+
+    All methods perform blocking I/O and are safe to call from multiple
+    threads. Lookups are fast enough to be performed directly from an
+    :py:mod:`asyncio` event loop.
+
+    :param str index_path: Path to the directory containing the index. This
+                           is created when the first consensus is added.
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.sorted_path = os.path.join(index_path, "intervals.idx")
+        self.log_path = os.path.join(index_path, "intervals.log")
+        self._lock = threading.Lock()
+        self._pending = None
+        self._index_file = None
+        self._index_map = None
+
+    def _load_pending(self):
+        if self._pending is None:
+            try:
+                with open(self.log_path, 'rb') as source:
+                    raw_log = source.read()
+            except FileNotFoundError:
+                raw_log = b""
+            # Ignore a partially written entry at the end of the log
+            end = len(raw_log) - len(raw_log) % ENTRY.size
+            self._pending = list(ENTRY.iter_unpack(raw_log[:end]))
+        return self._pending
+
+    def _sorted_index(self):
+        if self._index_map is None:
+            try:
+                self._index_file = open(self.sorted_path, 'rb')
+            except FileNotFoundError:
+                return None
+            if os.fstat(self._index_file.fileno()).st_size == 0:
+                self._index_file.close()
+                self._index_file = None
+                return None
+            self._index_map = mmap.mmap(self._index_file.fileno(), 0,
+                                        access=mmap.ACCESS_READ)
+        return self._index_map
+
+    def _close_sorted(self):
+        if self._index_map is not None:
+            self._index_map.close()
+            self._index_file.close()
+            self._index_map = self._index_file = None
+
+    def _lower_bound(self, index, key):
+        low, high = 0, len(index) // ENTRY.size
+        while low < high:
+            middle = (low + high) // 2
+            offset = middle * ENTRY.size
+            if index[offset:offset + len(key)] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _find(self, first, last):
+        """
+        Finds the entries for addresses between two keys (inclusive).
+        """
+        found = [
+            entry for entry in self._load_pending()
+            if first <= entry[0] <= last
+        ]
+        index = self._sorted_index()
+        if index is not None:
+            position = self._lower_bound(index, first)
+            for offset in range(position * ENTRY.size, len(index),
+                                ENTRY.size):
+                entry = ENTRY.unpack_from(index, offset)
+                if entry[0] > last:
+                    break
+                found.append(entry)
+        return found
+
+    def _merge(self):
+        entries = []
+        index = self._sorted_index()
+        if index is not None:
+            entries.extend(ENTRY.iter_unpack(index))
+        entries.extend(self._load_pending())
+        entries = coalesce(entries)
+        temporary_path = self.sorted_path + ".tmp"
+        with open(temporary_path, 'wb') as output:
+            for entry in entries:
+                output.write(ENTRY.pack(*entry))
+            output.flush()
+            os.fsync(output.fileno())
+        self._close_sorted()
+        os.replace(temporary_path, self.sorted_path)
+        with open(self.log_path, 'wb'):
+            pass
+        self._pending = []
+        LOG.debug("Merged address index with %d intervals", len(entries))
+
+    def add_consensus(self, consensus):
+        """
+        Records the addresses of the relays in a consensus. Adding the same
+        consensus twice has no effect on the results of lookups.
+
+        :param ~stem.descriptor.networkstatus.NetworkStatusDocumentV3 consensus:
+            An unflavored consensus.
+
+        :returns: The number of addresses recorded as an :py:class:`int`.
+        """
+        start = _epoch(consensus.valid_after)
+        end = _epoch(consensus.fresh_until)
+        entries = [(_address_key(address), bytes.fromhex(fingerprint), start,
+                    end)
+                   for address, fingerprint in consensus_addresses(consensus)]
+        with self._lock:
+            os.makedirs(self.index_path, exist_ok=True)
+            pending = self._load_pending()
+            with open(self.log_path, 'ab') as output:
+                output.write(b"".join(ENTRY.pack(*e) for e in entries))
+            pending.extend(entries)
+            if len(pending) >= MERGE_THRESHOLD:
+                self._merge()
+        return len(entries)
+
+    def merge(self):
+        """
+        Merges any entries in the log into the sorted index.
+        """
+        with self._lock:
+            if self._load_pending():
+                self._merge()
+
+    def _query(self, first, last, start, end):
+        with self._lock:
+            found = self._find(first, last)
+        # Intervals are coalesced before filtering so that the whole of an
+        # interval is returned, even if part of it is still in the log.
+        start, end = _epoch(start), _epoch(end)
+        return [
+            AddressInterval(_address_str(address), fingerprint.hex().upper(),
+                            _datetime(entry_start), _datetime(entry_end))
+            for address, fingerprint, entry_start, entry_end in coalesce(found)
+            if entry_start < end and entry_end > start
+        ]
+
+    def lookup(self, address, start, end=None):
+        """
+        Finds the relays that used an address at a time, or at any time
+        during a period.
+
+        :param str address: An IPv4 or IPv6 address.
+        :param ~datetime.datetime start: The time, or the start of the period.
+        :param ~datetime.datetime end: The end of the period. If not set, only
+                                       the time *start* is checked.
+
+        :returns: A :py:class:`list` of :py:class:`AddressInterval`, ordered
+                  by fingerprint and then start time.
+
+        :raises ValueError: If the address is not valid.
+        """
+        key = _address_key(address)
+        end = end or start + datetime.timedelta(seconds=1)
+        return self._query(key, key, start, end)
+
+    def lookup_network(self, network, start, end=None):
+        """
+        Finds the relays that used any address in a network at a time, or at
+        any time during a period.
+
+        :param str network: An IPv4 or IPv6 network, such as
+                            "198.51.100.0/24".
+        :param ~datetime.datetime start: The time, or the start of the period.
+        :param ~datetime.datetime end: The end of the period. If not set, only
+                                       the time *start* is checked.
+
+        :returns: A :py:class:`list` of :py:class:`AddressInterval`, ordered
+                  by address, fingerprint and then start time.
+
+        :raises ValueError: If the network is not valid.
+        """
+        network = ipaddress.ip_network(network, strict=False)
+        end = end or start + datetime.timedelta(seconds=1)
+        return self._query(_address_key(network.network_address),
+                           _address_key(network.broadcast_address), start,
+                           end)
+
+    def clear(self):
+        """
+        Removes all entries, before rebuilding the index.
+        """
+        with self._lock:
+            self._close_sorted()
+            for path in [self.sorted_path, self.log_path]:
+                if os.path.exists(path):
+                    os.remove(path)
+            self._pending = []
+
+    def close(self):
+        """
+        Merges any pending entries into the index and closes open files.
+        """
+        self.merge()
+        with self._lock:
+            self._close_sorted()
@@ -14,11 +14,12 @@ import hashlib
 import logging
 import os
 import os.path
+import threading
+import time
+from collections import Counter
+from collections import defaultdict
 
-import aiofiles
-
-from stem.descriptor import Descriptor
-from stem.descriptor import DocumentHandler
+from stem.descriptor.bandwidth_file import BandwidthFile as StemBandwidthFile
 from stem.descriptor.extrainfo_descriptor import BridgeExtraInfoDescriptor
 from stem.descriptor.extrainfo_descriptor import RelayExtraInfoDescriptor
 from stem.descriptor.microdescriptor import Microdescriptor
@@ -26,8 +27,54 @@ from stem.descriptor.networkstatus import NetworkStatusDocumentV3
 from stem.descriptor.server_descriptor import BridgeDescriptor
 from stem.descriptor.server_descriptor import RelayDescriptor
 
+from bushel.address_index import AddressIndex
+from bushel.bandwidth.file import BandwidthFile
+from bushel.bandwidth.history import BandwidthHistory
+from bushel.bloom import DigestBloomFilter
+from bushel.catalog import ArchiveCatalog
+from bushel.catalog import classify_catalog_path
+from bushel.compression import ArchiveCompression
+from bushel.compression import compression_for_path
+from bushel.compression import find_archived
+from bushel.compression import read_archived
+from bushel.compression import strip_compression_extension
+from bushel.index import BANDWIDTH_FILE
+from bushel.index import BRIDGE_EXTRA_INFO
+from bushel.index import BRIDGE_SERVER_DESCRIPTOR
+from bushel.index import EXTRA_INFO
+from bushel.index import MICRODESCRIPTOR
+from bushel.index import SERVER_DESCRIPTOR
+from bushel.index import INDEXED_DOCTYPES
+from bushel.index import VOTE
+from bushel.index import DigestIndex
+from bushel.index import IndexedDocument
+from bushel.index import VoteIndex
+from bushel.index import parse_vote_filename
+from bushel.lru import LRUCache
+from bushel.parsing import DescriptorParser
+from bushel.parsing import ParseMode
+from bushel.parsing import parse_raw
+from bushel.parsing import read_raw
+from bushel.relay_history import RelayHistory
+from bushel.shard import ArchiveShards
+from bushel.snapshot import CONSENSUS_FLAVORS
+from bushel.snapshot import NetworkSnapshot
+
 LOG = logging.getLogger('bushel')
 
+STORE_BATCH_SIZE = 256
+READ_CHUNK_SIZE = 128
+READ_AHEAD = 8
+MMAP_THRESHOLD = 1024 * 1024
+WRITE_QUEUE_SIZE = 4096
+CONSENSUS_LOOKBACK = 24
+
+DESCRIPTOR_TYPES = {
+    SERVER_DESCRIPTOR: "server-descriptor 1.0",
+    EXTRA_INFO: "extra-info 1.0",
+    MICRODESCRIPTOR: "microdescriptor 1.0",
+}
+
 class CollectorOutSubdirectory(enum.Enum):
     """
     Enumeration of subdirectory names under the "out" directory as specified in
@@ -58,12 +105,14 @@ class CollectorOutRelayDescsMarker(enum.Enum):
     ======================= ===========
     Name                    Description
     ======================= ===========
+    BANDWIDTHS              Bandwidth files
     CONSENSUS               Network status consensuses (§5.3.2)
     EXTRA_INFO              Relay extra-info descriptors (§5.3.2)
     SERVER_DESCRIPTOR       Relay server descriptors (§5.3.2)
     VOTE                    Network status votes (§5.3.2)
     ======================= ===========
     """
+    BANDWIDTHS = 'bandwidths'
     CONSENSUS = 'consensus'
     EXTRA_INFO = 'extra-info'
     MICRODESC = 'microdesc'
@@ -89,11 +138,38 @@ class CollectorOutBridgeDescsMarker(enum.Enum):
     STATUSES = 'statuses'
 
 
-async def parse_file(path, **kwargs):
+async def parse_bytes(raw_content, parsers=None, **kwargs):
     """
-    Parses a descriptor from a file.
+    Parses a descriptor from bytes. The parsing is performed in an executor.
+    The parser is chosen from the ``@type`` annotation, see
+    :py:func:`bushel.parsing.parse_raw`.
+
+    :param raw_content bytes: Bytes to construct the descriptor from
+    :param dict parsers: Parsers to use instead of stem, keyed by type name,
+                         such as :py:data:`bushel.parsing.BUSHEL_PARSERS`.
+    :param kwargs dict: Additional arguments for
+                          :meth:`stem.descriptor.Descriptor.from_str`.
+    :returns: :class:`stem.descriptor.Descriptor` subclass for the given
+              content, or *None* if no descriptor could be parsed.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        None, functools.partial(parse_raw, raw_content, parsers, **kwargs))
+
+
+async def parse_file(path, compression=ArchiveCompression.UNCOMPRESSED,
+                     raw=False, parsers=None, **kwargs):
+    """
+    Parses a descriptor from a file. If the file does not exist, compressed
+    variants of the file will be tried and transparently decompressed.
 
     :param content str/bytes: String to construct the descriptor from
+    :param ArchiveCompression compression: The compressed variant of the file
+                                           to try first.
+    :param bool raw: If *True*, the document is not parsed and a
+                     :py:class:`~bushel.parsing.RawDocument` is returned.
+    :param dict parsers: Parsers to use instead of stem, keyed by type name,
+                         such as :py:data:`bushel.parsing.BUSHEL_PARSERS`.
     :param kwargs dict: Additional arguments for
                           :meth:`stem.descriptor.Descriptor.parse_file`.
     :returns: :class:`stem.descriptor.Descriptor` subclass for the given
@@ -101,22 +177,13 @@ async def parse_file(path, **kwargs):
               provided.
     """
     loop = asyncio.get_running_loop()
-    try:
-        async with aiofiles.open(path, 'rb') as source:
-            raw_content = await source.read()
-            return await loop.run_in_executor(
-                None,
-                functools.partial(
-                    Descriptor.from_str,
-                    raw_content,
-                    document_handler=DocumentHandler.DOCUMENT,  # pylint: disable=no-member
-                    **kwargs))
-    except FileNotFoundError:
-        pass
-    except StopIteration:
-        # TODO: Move the file we tried to open into some area for later
-        # inspection so that we can download this again!
-        pass
+    raw_content = await loop.run_in_executor(None, read_archived, path,
+                                             compression)
+    if raw_content is None:
+        return None
+    if raw:
+        return read_raw(raw_content)
+    return await parse_bytes(raw_content, parsers, **kwargs)
 
 
 async def aglob(pathname, *, recursive=False):
@@ -220,6 +287,31 @@ def collector_434_filename(valid_after):
             "microdesc")
 
 
+def collector_bandwidth_filename(published, digest):
+    """
+    Create a filename for a bandwidth file, using the same format as CollecTor
+    uses for archived bandwidth files. For example:
+
+    >>> published = datetime.datetime(2019, 3, 17, 6, 50, 58)
+    >>> digest = "31a8c8e3c1d7e4ba05e8ec2e3e3f6a13bd7d6c9c1b7fb0ae2e5d3ad1ccd9b2f1"
+    >>> collector_bandwidth_filename(published, digest)  # doctest: +ELLIPSIS
+    '2019-03-17-06-50-58-bandwidth-31A8C8E3...CCD9B2F1'
+
+    These filenames expect *upper-case* hex-encoded SHA-256 digests.
+
+    :param ~datetime.datetime published: The time the bandwidth file was
+                                         created.
+    :param str digest: The hex-encoded SHA-256 digest of the bandwidth file.
+
+    :returns: Filename as a :py:class:`str`.
+    """
+    digest = digest.upper()
+    return (f"{published.year}-{published.month:02d}-"
+            f"{published.day:02d}-{published.hour:02d}-"
+            f"{published.minute:02d}-{published.second:02d}-bandwidth-"
+            f"{digest}")
+
+
 def collector_521_substructure(published, digest):
     """
     Create a path substructure according to §5.2.1 of the
@@ -416,6 +508,116 @@ def prepare_annotated_content(descriptor):
     return str(type_annotation).encode('utf-8') + b"\n" + content
 
 
+def as_bushel_bandwidth_file(bandwidth_file):
+    """
+    Converts a stem bandwidth file to a
+    :py:class:`~bushel.bandwidth.file.BandwidthFile`. If the bandwidth file is
+    already a bushel bandwidth file then it is returned unchanged.
+    """
+    if isinstance(bandwidth_file, BandwidthFile):
+        return bandwidth_file
+    return BandwidthFile(bandwidth_file.get_bytes())
+
+
+def bandwidth_file_published(bandwidth_file):
+    """
+    The creation time of a bandwidth file, used to determine its location in
+    the archive.
+
+    :param bandwidth_file: Either a bushel or stem bandwidth file.
+
+    :returns: A :py:class:`~datetime.datetime`.
+    """
+    return as_bushel_bandwidth_file(bandwidth_file).published
+
+
+def bandwidth_file_digest(bandwidth_file):
+    """
+    The upper-case hex-encoded SHA-256 digest of a bandwidth file.
+
+    :param bandwidth_file: Either a bushel or stem bandwidth file.
+
+    :returns: Digest as a :py:class:`str`.
+    """
+    return as_bushel_bandwidth_file(bandwidth_file).digest()
+
+
+def microdescriptor_hex_digest(digest):
+    """
+    Converts the base64-encoded SHA-256 digest of a microdescriptor, as found
+    in a microdesc-flavored consensus, to the hex-encoded form used in the
+    archive. For example:
+
+    >>> microdescriptor_hex_digest("ANkc+WMh+9U23Qfil6Xht+aWHd0Q+s3XGXFuNRRTFo8")
+    '00d91cf96321fbd536dd07e297a5e1b7e6961ddd10facdd719716e351453168f'
+
+    :param str digest: The base64-encoded digest, with or without padding.
+
+    :returns: Hex-encoded digest as a :py:class:`str`.
+    """
+    digest_bytes = digest.rstrip("=").encode('utf-8')
+    digest_bytes += b'=' * (-len(digest_bytes) % 4)
+    return base64.decodebytes(digest_bytes).hex()
+
+
+def vote_digest(vote):
+    """
+    Calculates the digest of a network-status vote, as used in the filename
+    for the vote in the archive.
+
+    :param ~stem.descriptor.networkstatus.NetworkStatusDocumentV3 vote: The
+        vote.
+
+    :returns: Upper-case hex-encoded SHA-1 digest as a :py:class:`str`.
+    """
+    # TODO: The digest functionality should be appearing in stem.
+    # https://trac.torproject.org/projects/tor/ticket/28398
+    raw_content, ending = str(vote), "\ndirectory-signature "
+    raw_content = raw_content[:raw_content.find(ending) + len(ending)].encode("utf-8")
+    return hashlib.sha1(raw_content).hexdigest().upper()
+
+
+def document_key(descriptor):
+    """
+    Determines the type, digest and published time of a descriptor that is
+    addressed by its digest in the archive.
+
+    :param ~stem.descriptor.Descriptor descriptor: The descriptor.
+
+    :returns: A :py:class:`tuple` of (doctype, digest, published) where the
+              doctype is one of :py:data:`bushel.index.INDEXED_DOCTYPES` and
+              the digest is lower-case and hex-encoded, or *None* if the
+              descriptor is not addressed by digest.
+    """
+    if isinstance(descriptor, BridgeDescriptor):
+        doctype, digest = BRIDGE_SERVER_DESCRIPTOR, descriptor.digest()
+        published = descriptor.published
+    elif isinstance(descriptor, BridgeExtraInfoDescriptor):
+        doctype, digest = BRIDGE_EXTRA_INFO, descriptor.digest()
+        published = descriptor.published
+    elif isinstance(descriptor, RelayDescriptor):
+        doctype, digest = SERVER_DESCRIPTOR, descriptor.digest()
+        published = descriptor.published
+    elif isinstance(descriptor, RelayExtraInfoDescriptor):
+        doctype, digest = EXTRA_INFO, descriptor.digest()
+        published = descriptor.published
+    elif isinstance(descriptor, Microdescriptor):
+        doctype = MICRODESCRIPTOR
+        digest = microdescriptor_hex_digest(descriptor.digest())
+        published = valid_after_now()
+    elif isinstance(descriptor, (BandwidthFile, StemBandwidthFile)):
+        doctype = BANDWIDTH_FILE
+        digest = bandwidth_file_digest(descriptor)
+        published = bandwidth_file_published(descriptor)
+    elif isinstance(descriptor, NetworkStatusDocumentV3) and \
+          descriptor.is_vote:
+        doctype, digest = VOTE, vote_digest(descriptor)
+        published = descriptor.valid_after
+    else:
+        return None
+    return doctype, digest.lower(), published
+
+
 def valid_after_now():
     """
     Takes a good guess at the valid-after time of the latest consensus. There
@@ -429,6 +631,53 @@ def valid_after_now():
     return valid_after.replace(minute=0, second=0)
 
 
+def days_between(start, end):
+    """
+    Generates the start of each day between *start* and *end* inclusive. For
+    example:
+
+    >>> start = datetime.datetime(2018, 11, 29, 15)
+    >>> end = datetime.datetime(2018, 12, 1)
+    >>> [day.isoformat() for day in days_between(start, end)]
+    ['2018-11-29T00:00:00', '2018-11-30T00:00:00', '2018-12-01T00:00:00']
+    """
+    day = datetime.datetime(start.year, start.month, start.day)
+    while day <= end:
+        yield day
+        day += datetime.timedelta(days=1)
+
+
+def filename_timestamp(filename):
+    """
+    Parses the timestamp at the start of a consensus, vote or bandwidth file
+    filename. For example:
+
+    >>> filename_timestamp("2018-11-19-15-00-00-consensus.xz")
+    datetime.datetime(2018, 11, 19, 15, 0)
+
+    :param str filename: The filename, with or without a compression
+                         extension.
+
+    :returns: A :py:class:`~datetime.datetime`, or *None* if the filename does
+              not start with a timestamp.
+    """
+    try:
+        return datetime.datetime.strptime(filename[:19], "%Y-%m-%d-%H-%M-%S")
+    except ValueError:
+        return None
+
+
+def _list_directory(path):
+    try:
+        with os.scandir(path) as entries:
+            # Names starting with "." are temporary files being written
+            return sorted(
+                strip_compression_extension(entry.name) for entry in entries
+                if entry.is_file() and not entry.name.startswith("."))
+    except FileNotFoundError:
+        return []
+
+
 class DirectoryArchive:
     """
     Persistent filesystem-backed archive for Tor directory protocol
@@ -437,18 +686,147 @@ class DirectoryArchive:
     This implements the CollecTor File Structure Protocol as detailed in
     [collector-protocol]_.
 
+    Alongside the CollecTor File Structure Protocol tree, bushel keeps its own
+    state (such as the bandwidth history) in the ``.bushel`` directory at the
+    root of the archive.
+
+    Network status documents and bandwidth files can optionally be compressed
+    at rest, in which case they are stored with a filename extension for the
+    compression algorithm (see :py:mod:`bushel.compression`). Reads will
+    always find compressed variants, whether or not compression is enabled.
+
     :param str archive_path: Either an absolute or relative path to the
                              location of the directory to use for the archive.
                              This location must exist, but may be an empty
-                             directory.
+                             directory. A :py:class:`list` of paths shards the
+                             archive across multiple roots, see
+                             :py:mod:`bushel.shard`. The first root holds
+                             bushel's own state.
+    :param int max_file_concurrency: The maximum number of concurrent file
+                                     operations on each root.
+    :param ~bushel.compression.ArchiveCompression compression: Compression to
+        use for network status documents and bandwidth files. See
+        :py:func:`~bushel.compression.preferred_compression`.
+    :param ~bushel.parsing.ParseMode parse_mode: Where to parse documents read
+                                                 from the archive.
+    :param int parse_workers: The maximum number of worker processes when
+                              parsing in processes.
+    :param dict parsers: Parsers to use instead of stem for some types of
+                         document, keyed by the type name in the ``@type``
+                         annotation, such as
+                         :py:data:`bushel.parsing.BUSHEL_PARSERS`. Other
+                         types are parsed with stem.
+    :param int mmap_threshold: Uncompressed network status documents and
+                               bandwidth files at least this many bytes long
+                               are memory-mapped instead of being read into
+                               memory. *None* disables memory-mapping.
+    :param int byte_cache_size: The maximum total size in bytes of raw
+                                documents to keep in a read-through cache,
+                                or 0 to disable the cache.
+    :param int parsed_cache_size: The maximum total size in bytes (of the raw
+                                  documents) of parsed documents to keep in a
+                                  cache, or 0 to disable the cache.
+
+    Cached documents are keyed by their path and modification time, so a
+    document that is replaced in the archive will be read again.
+
+    Documents are always written to a temporary file that is then renamed
+    into place, so a crash can never leave a truncated document at its final
+    path.
+
+    :param bool write_behind: If *True*, :py:meth:`store` and
+                              :py:meth:`store_many` only queue documents to be
+                              written by a background task. Queued documents
+                              are not visible to readers until they have been
+                              written, use :py:meth:`flush` to wait for this
+                              and to find out whether any writes failed.
+    :param float fsync_interval: If set, files are synced to disk before being
+                                 renamed into place, and the directories
+                                 containing them are synced in batches at
+                                 most this many seconds apart. *None* leaves
+                                 syncing to the operating system.
+    :param bool skip_existing: If *True*, documents that are already archived
+                               with identical content are not written again.
+                               Digest-addressed documents are checked using
+                               the Bloom filters and the index before the
+                               filesystem, other documents are compared with
+                               the archived copy.
+    :param bool hardlink_duplicates: If *True*, a digest-addressed document
+                                     that is archived at a different path
+                                     (such as a microdescriptor referenced by
+                                     consensuses in two months) is hard-linked
+                                     to its new path instead of being written
+                                     again.
     """
 
     def __init__(self,
                  archive_path,
-                 max_file_concurrency=100):
-        self.archive_path = archive_path
-        self.max_file_concurrency_lock = asyncio.BoundedSemaphore(
-            max_file_concurrency)
+                 max_file_concurrency=100,
+                 compression=ArchiveCompression.UNCOMPRESSED,
+                 parse_mode=ParseMode.THREAD,
+                 parse_workers=None,
+                 parsers=None,
+                 mmap_threshold=MMAP_THRESHOLD,
+                 byte_cache_size=0,
+                 parsed_cache_size=0,
+                 write_behind=False,
+                 fsync_interval=None,
+                 skip_existing=True,
+                 hardlink_duplicates=False):
+        if not compression.available:
+            raise ValueError(f"Compression {compression.name} is not "
+                             "available")
+        self.shards = ArchiveShards(archive_path)
+        self.archive_path = self.shards.roots[0]
+        self.compression = compression
+        self.parser = DescriptorParser(parse_mode, parse_workers,
+                                       parsers=parsers)
+        self.mmap_threshold = mmap_threshold
+        self.byte_cache = LRUCache(byte_cache_size) if byte_cache_size else None
+        self.parsed_cache = (LRUCache(parsed_cache_size)
+                             if parsed_cache_size else None)
+        self.write_behind = write_behind
+        self.fsync_interval = fsync_interval
+        self._write_queue = None
+        self._writer = None
+        self._write_errors = []
+        self._unsynced_directories = set()
+        self._unsynced_lock = threading.Lock()
+        self._last_sync = time.monotonic()
+        self.skip_existing = skip_existing
+        self.hardlink_duplicates = hardlink_duplicates
+        self.store_counters = Counter()
+        self.shard_locks = [
+            asyncio.BoundedSemaphore(max_file_concurrency)
+            for _ in self.shards.roots
+        ]
+        self.max_file_concurrency_lock = self.shard_locks[0]
+        self.bandwidth_history = BandwidthHistory(
+            self.state_path("bandwidth-history"))
+        self.index = DigestIndex(self.state_path("index.sqlite"))
+        self.catalog = ArchiveCatalog(self.state_path("catalog.sqlite"))
+        self.relay_history = RelayHistory(
+            self.state_path("relay-history.sqlite"))
+        self.address_index = AddressIndex(self.state_path("address-index"))
+        self.bloom_filters = {}
+        self.vote_index = VoteIndex(
+            lambda day: os.path.dirname(self.relay_vote_path(day, "", "")))
+        self.bloom_filter_counters = defaultdict(Counter)
+        self._known_directories = set()
+
+    def state_path(self, name):
+        """
+        The filesystem path for bushel's own state within the archive. For
+        example:
+
+        >>> DirectoryArchive("/srv/archive").state_path("bandwidth-history")
+        '/srv/archive/.bushel/bandwidth-history'
+
+        :param str name: The name of the file or directory.
+
+        :returns: Path as a :py:class:`str`.
+        """
+        return os.path.join(self.archive_path, ".bushel", name)
 
     ####################
     # out/ Paths       #
@@ -466,13 +844,16 @@ class DirectoryArchive:
         >>> DirectoryArchive("/srv/archive").path_for("path/to/descriptor")
         '/srv/archive/path/to/descriptor'
 
+        In a sharded archive, the path is under the root for the shard the
+        descriptor belongs to.
+
         :param bool create_dir: Create the directory ready to archive a
                                 descriptor.
 
         :returns: Archive path for the descriptor as a :py:class:`str`.
         """
         if isinstance(descriptor, str):
-            fpath = os.path.join(self.archive_path, descriptor)
+            fpath = os.path.join(self.shards.root_for(descriptor), descriptor)
         elif isinstance(descriptor, BridgeDescriptor):
             fpath = self.bridge_server_descriptor_path(descriptor.published,
                                                        descriptor.digest())
@@ -497,16 +878,16 @@ class DirectoryArchive:
                     descriptor.valid_after)
             else:
                 fpath = self.relay_consensus_path(descriptor.valid_after)
+        elif isinstance(descriptor, (BandwidthFile, StemBandwidthFile)):
+            fpath = self.relay_bandwidth_file_path(
+                bandwidth_file_published(descriptor),
+                bandwidth_file_digest(descriptor))
         elif isinstance(descriptor, NetworkStatusDocumentV3) and \
               descriptor.is_vote:
-            # TODO: The digest functionality should be appearing in stem.
-            # https://trac.torproject.org/projects/tor/ticket/28398
-            raw_content, ending = str(descriptor), "\ndirectory-signature "
-            raw_content = raw_content[:raw_content.find(ending) + len(ending)].encode("utf-8")
-            digest = hashlib.sha1(raw_content).hexdigest().upper()
             fpath = self.relay_vote_path(
                 descriptor.valid_after,
-                descriptor.directory_authorities[0].v3ident, digest)
+                descriptor.directory_authorities[0].v3ident,
+                vote_digest(descriptor))
         else:
             print(repr(descriptor))
             raise RuntimeError(
@@ -649,9 +1030,7 @@ class DirectoryArchive:
                 digest))
 
     def relay_microdescriptor_path(self, valid_after, digest):
-        digest_bytes = digest.encode('utf-8')
-        digest_bytes += b'=' * (len(digest_bytes) % 3)
-        digest = base64.decodebytes(digest_bytes).hex()
+        digest = microdescriptor_hex_digest(digest)
         return self.path_for(
             collector_534_microdescriptor_path(valid_after, digest))
 
@@ -711,65 +1090,956 @@ class DirectoryArchive:
                 valid_after,
                 collector_433_filename(valid_after, v3ident, digest)))
 
+    def relay_bandwidth_file_path(self, published, digest):
+        """
+        Generates a path, including the archive path, for a bandwidth file
+        created at the given time and with the given digest. For example:
+
+        >>> archive = DirectoryArchive("/srv/archive")
+        >>> published = datetime.datetime(2019, 3, 17, 6, 50, 58)
+        >>> digest = "31A8C8E3C1D7E4BA05E8EC2E3E3F6A13BD7D6C9C1B7FB0AE2E5D3AD1CCD9B2F1"
+        >>> archive.relay_bandwidth_file_path(published, digest)  # doctest: +ELLIPSIS
+        '/srv/archive/relay-descriptors/bandwidths/2019/03/17/2019-03-17-06-50-58-bandwidth-31A8...B2F1'
+
+        These paths follow the layout used by CollecTor for bandwidth files.
+
+        :param ~datetime.datetime published: The time the bandwidth file was
+                                             created.
+        :param str digest: The hex-encoded SHA-256 digest of the bandwidth
+                           file.
+
+        :returns: Path as a :py:class:`str`.
+        """
+        return self.path_for(
+            collector_522_path(
+                CollectorOutSubdirectory.RELAY_DESCRIPTORS,  # pylint: disable=no-member
+                CollectorOutRelayDescsMarker.BANDWIDTHS,  # pylint: disable=no-member
+                published,
+                collector_bandwidth_filename(published, digest)))
+
     ####################
     # Store Descriptor #
     ####################
 
+    def indexed_document(self, descriptor, path, size):
+        """
+        Describes a descriptor for the :py:class:`~bushel.index.DigestIndex`.
+
+        :param ~stem.descriptor.Descriptor descriptor: The descriptor.
+        :param str path: The path the descriptor is archived at.
+        :param int size: The size of the archived file in bytes.
+
+        :returns: An :py:class:`~bushel.index.IndexedDocument`, or *None* if
+                  the descriptor is not of a type that is indexed by digest.
+        """
+        key = document_key(descriptor)
+        if key is None:
+            return None
+        doctype, digest, published = key
+        return IndexedDocument(doctype, digest, self.shards.locate(path)[1],
+                               published, size)
+
+    def bloom_filter(self, doctype):
+        """
+        The :py:class:`~bushel.bloom.DigestBloomFilter` for a document type.
+
+        :param str doctype: One of :py:data:`~bushel.index.INDEXED_DOCTYPES`.
+
+        :rtype: ~bushel.bloom.DigestBloomFilter
+        """
+        if doctype not in self.bloom_filters:
+            self.bloom_filters[doctype] = DigestBloomFilter(
+                self.state_path(os.path.join("bloom", doctype)))
+        return self.bloom_filters[doctype]
+
+    def bloom_filter_stats(self):
+        """
+        Reports on the effectiveness of the Bloom filters used to skip lookups
+        for documents that are not archived. For each document type, the
+        following are reported:
+
+        ============================= ========================================
+        Key                           Description
+        ============================= ========================================
+        count                         Digests added to the filter
+        estimated_false_positive_rate Expected rate for the current count
+        negatives                     Lookups skipped by the filter
+        false_positives               Lookups passed by the filter for
+                                      documents that were not archived
+        false_positive_rate           Observed false-positive rate
+        ============================= ========================================
+
+        :returns: A :py:class:`dict` mapping document types to a
+                  :py:class:`dict` of statistics.
+        """
+        stats = {}
+        for doctype, bloom_filter in self.bloom_filters.items():
+            counters = self.bloom_filter_counters[doctype]
+            absent = counters["negatives"] + counters["false_positives"]
+            stats[doctype] = {
+                "count": bloom_filter.count,
+                "estimated_false_positive_rate":
+                    bloom_filter.estimated_false_positive_rate(),
+                "negatives": counters["negatives"],
+                "false_positives": counters["false_positives"],
+                "false_positive_rate":
+                    counters["false_positives"] / absent if absent else 0.0,
+            }
+        return stats
+
+    def _index_documents(self, documents):
+        """
+        Adds documents to the index and the Bloom filters. This performs
+        blocking I/O.
+
+        :param list documents: :py:class:`~bushel.index.IndexedDocument` for
+                               each document to add.
+        """
+        self.index.add_many(documents)
+        by_doctype = defaultdict(list)
+        for document in documents:
+            by_doctype[document.doctype].append(document.digest)
+        for doctype, digests in by_doctype.items():
+            self.bloom_filter(doctype).add_many(digests)
+
+    def _indexed_path(self, doctype, digest):
+        """
+        Looks up the path for a document in the Bloom filter and then the
+        index.
+
+        :returns: The path as a :py:class:`str` if the document is in the
+                  index, *False* if the document is known not to be in the
+                  archive, or *None* if the index cannot tell.
+        """
+        bloom_filter = self.bloom_filter(doctype)
+        if not bloom_filter.might_contain(digest):
+            self.bloom_filter_counters[doctype]["negatives"] += 1
+            return False
+        document = self.index.lookup(doctype, digest)
+        if document:
+            if document.path.endswith(".pack"):
+                # Stored by a PackedDirectoryArchive, only the plain layout
+                # can be checked from here.
+                return None
+            return self.path_for(document.path)
+        if self.index.authoritative:
+            if bloom_filter.complete:
+                self.bloom_filter_counters[doctype]["false_positives"] += 1
+            return False
+        return None
+
+    async def rebuild_index(self, max_workers=None):
+        """
+        Rebuilds the :py:class:`~bushel.index.DigestIndex` by walking the
+        archive in parallel. Once rebuilt, the index is authoritative and
+        lookups for documents not in the index will not touch the filesystem.
+        The Bloom filters are rebuilt from the index, after which most
+        lookups for documents that are not archived will not query the index.
+
+        :param int max_workers: The maximum number of threads to use for the
+                                walk.
+
+        :returns: The number of documents indexed as an :py:class:`int`.
+        """
+        loop = asyncio.get_running_loop()
+        count = await loop.run_in_executor(
+            None, self.index.rebuild, self.shards.roots, max_workers)
+        await loop.run_in_executor(None, self._rebuild_bloom_filters)
+        return count
+
+    def _catalog_extra(self):
+        """
+        Lists documents that are not stored as plain files in the archive, to
+        be included when rebuilding the catalog. This performs blocking I/O.
+
+        :returns: An iterable of (doctype, timestamp, size) tuples.
+        """
+        return []
+
+    async def rebuild_catalog(self, max_workers=None):
+        """
+        Rebuilds the :py:class:`~bushel.catalog.ArchiveCatalog` by walking the
+        archive in parallel.
+
+        :param int max_workers: The maximum number of threads to use for the
+                                walk.
+
+        :returns: The number of documents cataloged as an :py:class:`int`.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, lambda: self.catalog.rebuild(self.shards.roots, max_workers,
+                                               self._catalog_extra()))
+
+    async def _rebuild_from_consensuses(self, history, start, end):
+        """
+        Clears a history built from consensuses, such as the relay history,
+        and adds the consensuses archived between two times to it, reading
+        ahead with :py:meth:`consensuses`.
+
+        :returns: The number of consensuses added as an :py:class:`int`.
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, history.clear)
+        count = 0
+        async for consensus in self.consensuses(start, end):
+            await loop.run_in_executor(None, history.add_consensus, consensus)
+            count += 1
+        return count
+
+    async def rebuild_relay_history(self, start, end):
+        """
+        Rebuilds the :py:class:`~bushel.relay_history.RelayHistory` from the
+        consensuses archived between two times, reading ahead with
+        :py:meth:`consensuses`. Runs outside of the period are discarded.
+
+        :param ~datetime.datetime start: Earliest valid-after time to include.
+        :param ~datetime.datetime end: Latest valid-after time to include.
+
+        :returns: The number of consensuses added as an :py:class:`int`.
+        """
+        count = await self._rebuild_from_consensuses(self.relay_history, start,
+                                                     end)
+        LOG.info("Rebuilt relay history from %d consensuses", count)
+        return count
+
+    async def rebuild_address_index(self, start, end):
+        """
+        Rebuilds the :py:class:`~bushel.address_index.AddressIndex` from the
+        consensuses archived between two times, as for
+        :py:meth:`rebuild_relay_history`. The index is merged once rebuilt.
+
+        :param ~datetime.datetime start: Earliest valid-after time to include.
+        :param ~datetime.datetime end: Latest valid-after time to include.
+
+        :returns: The number of consensuses added as an :py:class:`int`.
+        """
+        count = await self._rebuild_from_consensuses(self.address_index, start,
+                                                     end)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.address_index.merge)
+        LOG.info("Rebuilt address index from %d consensuses", count)
+        return count
+
+    async def rebalance(self, dry_run=False):
+        """
+        Moves documents to the root of the shard they belong to, which is
+        required after adding roots to a sharded archive. See
+        :py:meth:`bushel.shard.ArchiveShards.rebalance`.
+
+        :param bool dry_run: Only count the documents that would be moved.
+
+        :returns: A :py:class:`dict` with the number of documents and bytes
+                  "moved".
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.shards.rebalance,
+                                          dry_run)
+
+    def _rebuild_bloom_filters(self):
+        for doctype in INDEXED_DOCTYPES:
+            self.bloom_filter(doctype).rebuild(
+                document.digest
+                for document in self.index.documents(doctype))
+
+    def _lock_for(self, path):
+        """
+        The concurrency limit for the root that contains a path.
+
+        :rtype: asyncio.BoundedSemaphore
+        """
+        if len(self.shard_locks) == 1:
+            return self.shard_locks[0]
+        return self.shard_locks[self.shards.locate(path)[0]]
+
+    def _by_shard(self, stored):
+        """
+        Partitions (descriptor, key, path, content) tuples by the root they
+        will be written under, preserving their order within each root.
+        """
+        if len(self.shard_locks) == 1:
+            return [stored]
+        by_shard = defaultdict(list)
+        for item in stored:
+            by_shard[self.shards.locate(item[2])[0]].append(item)
+        return list(by_shard.values())
+
+    def _create_directory(self, path):
+        """
+        Creates the directory for a file, remembering which directories are
+        known to exist so that they are only created once.
+        """
+        directory = os.path.dirname(path)
+        if directory not in self._known_directories:
+            os.makedirs(directory, exist_ok=True)
+            self._known_directories.add(directory)
+
+    def stored_path(self, descriptor, path):
+        """
+        The path that a descriptor is written to, which includes an extension
+        if the descriptor will be compressed.
+
+        :param ~stem.descriptor.Descriptor descriptor: The descriptor.
+        :param str path: The path for the descriptor from :py:meth:`path_for`.
+
+        :returns: Path as a :py:class:`str`.
+        """
+        if isinstance(descriptor, (NetworkStatusDocumentV3, BandwidthFile,
+                                   StemBandwidthFile)):
+            return path + self.compression.extension
+        return path
+
+    def _duplicate_of(self, key, path, content):
+        """
+        Finds an archived copy of a document that is about to be written. This
+        performs blocking I/O.
+
+        :param tuple key: The :py:func:`document_key` for the document.
+        :param str path: The path the document is to be written to.
+        :param bytes content: The uncompressed content to be written.
+
+        :returns: The path of an archived file with identical content, which
+                  is *path* itself if nothing needs to be written, or *None*
+                  if no copy was found.
+        """
+        if key is None:
+            if not os.path.exists(path):
+                return None
+            compression = compression_for_path(path)
+            if compression is ArchiveCompression.UNCOMPRESSED and \
+                  os.path.getsize(path) != len(content):
+                return None
+            with open(path, 'rb') as archived:
+                if compression.decompress(archived.read()) == content:
+                    return path
+            return None
+        doctype, digest, _ = key
+        if not self.bloom_filter(doctype).might_contain(digest):
+            return None
+        # The path of a digest-addressed document includes the digest, so
+        # any file already at the path has the same content.
+        if os.path.exists(path):
+            return path
+        if not self.hardlink_duplicates:
+            return None
+        document = self.index.lookup(doctype, digest)
+        if document is None or document.path.endswith(".pack"):
+            return None
+        indexed = self.path_for(document.path)
+        if compression_for_path(indexed) is compression_for_path(path) and \
+              os.path.exists(indexed):
+            return indexed
+        return None
+
+    @staticmethod
+    def _temporary_path(path):
+        """
+        A temporary path in the same directory as *path*, unique to the
+        calling thread. Directory listings skip these as they start with a
+        dot.
+        """
+        directory, filename = os.path.split(path)
+        return os.path.join(directory,
+                            f".{filename}.{threading.get_ident()}.tmp")
+
+    def _link(self, source, path):
+        temporary_path = self._temporary_path(path)
+        try:
+            os.link(source, temporary_path)
+        except OSError:
+            # Not supported by the filesystem, or across devices
+            return False
+        os.replace(temporary_path, path)
+        return True
+
+    def _write_batch(self, batch):
+        """
+        Writes a batch of documents, skipping or linking those that are
+        already archived. This performs blocking I/O.
+
+        :param list batch: (descriptor, key, path, content) tuples for each
+                           document to write, where the key is the
+                           :py:func:`document_key`. The descriptor is not
+                           used, and may be *None*.
+
+        :returns: A :py:class:`list` of (size, outcome) tuples, where the
+                  outcome is one of "written", "linked" or "skipped".
+        """
+        results = []
+        directories = set()
+        for _, key, path, content in batch:
+            self._create_directory(path)
+            duplicate = None
+            if self.skip_existing or self.hardlink_duplicates:
+                duplicate = self._duplicate_of(key, path, content)
+            if duplicate == path and self.skip_existing:
+                results.append((len(content), "skipped"))
+                continue
+            if duplicate and duplicate != path and \
+                  self._link(duplicate, path):
+                directories.add(os.path.dirname(path))
+                results.append((len(content), "linked"))
+                continue
+            content = compression_for_path(path).compress(content)
+            temporary_path = self._temporary_path(path)
+            with open(temporary_path, 'wb') as output:
+                output.write(content)
+                if self.fsync_interval is not None:
+                    output.flush()
+                    os.fsync(output.fileno())
+            os.replace(temporary_path, path)
+            directories.add(os.path.dirname(path))
+            results.append((len(content), "written"))
+        if self.fsync_interval is not None:
+            with self._unsynced_lock:
+                self._unsynced_directories.update(directories)
+        return results
+
+    def _count_stored(self, batch, results):
+        """
+        Counts the outcomes of a written batch.
+
+        :returns: (descriptor, key, path, size) tuples for each document that
+                  was written or linked, and so needs to be indexed.
+        """
+        stored = []
+        for (descriptor, key, path, _), (size, outcome) in zip(batch,
+                                                               results):
+            self.store_counters[outcome] += 1
+            self.store_counters[f"{outcome}_bytes"] += size
+            if outcome != "skipped":
+                stored.append((descriptor, key, path, size))
+        return stored
+
+    def store_stats(self):
+        """
+        Reports on the documents stored since the archive was opened:
+
+        ============= ======================================================
+        Key           Description
+        ============= ======================================================
+        written       Documents written
+        written_bytes Bytes written, after compression
+        linked        Documents hard-linked to an identical archived copy
+        linked_bytes  Uncompressed bytes not written due to linking
+        skipped       Documents that were already archived
+        skipped_bytes Uncompressed bytes not written due to skipping
+        ============= ======================================================
+
+        :rtype: dict
+        """
+        return {
+            key: self.store_counters[key]
+            for outcome in ("written", "linked", "skipped")
+            for key in (outcome, f"{outcome}_bytes")
+        }
+
+    def _sync_directories(self):
+        """
+        Syncs the directories that documents have been renamed into since the
+        last sync, making the renames durable.
+        """
+        with self._unsynced_lock:
+            directories = self._unsynced_directories
+            self._unsynced_directories = set()
+            self._last_sync = time.monotonic()
+        for directory in sorted(directories):
+            descriptor = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(descriptor)
+            finally:
+                os.close(descriptor)
+        if directories:
+            LOG.debug("Synced %d directories", len(directories))
+
+    async def _sync_if_due(self):
+        if self.fsync_interval is None or \
+              time.monotonic() - self._last_sync < self.fsync_interval:
+            return
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._sync_directories)
+
+    async def _enqueue(self, stored):
+        if self._writer is None or self._writer.done():
+            self._write_queue = asyncio.Queue(maxsize=WRITE_QUEUE_SIZE)
+            self._writer = asyncio.ensure_future(self._write_behind())
+        for item in stored:
+            await self._write_queue.put(item)
+
+    async def _write_behind(self):
+        """
+        Background task writing queued documents in batches.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._write_queue.get()]
+            while len(batch) < STORE_BATCH_SIZE and \
+                  not self._write_queue.empty():
+                batch.append(self._write_queue.get_nowait())
+            try:
+                for shard_batch in self._by_shard(batch):
+                    async with self._lock_for(shard_batch[0][2]):
+                        results = await loop.run_in_executor(
+                            None, self._write_batch, shard_batch)
+                    await self._after_store(
+                        self._count_stored(shard_batch, results))
+                await self._sync_if_due()
+            except Exception as error:  # pylint: disable=broad-except
+                LOG.exception("Failed to write %d queued documents",
+                              len(batch))
+                self._write_errors.append(error)
+            finally:
+                for _ in batch:
+                    self._write_queue.task_done()
+
+    async def flush(self):
+        """
+        Waits until all queued documents have been written and, if syncing
+        is enabled, synced to disk. This is a durability barrier: documents
+        stored before the call will survive a crash after it returns.
+
+        :raises Exception: The first error from writing queued documents
+                           since the last flush, if any could not be
+                           written.
+        """
+        if self._write_queue is not None:
+            await self._write_queue.join()
+        if self._write_errors:
+            errors, self._write_errors = self._write_errors, []
+            raise errors[0]
+        if self.fsync_interval is not None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._sync_directories)
+
+    async def _after_store(self, stored):
+        """
+        Updates the indexes, catalog, bandwidth history, relay history and
+        address index for stored descriptors.
+
+        :param list stored: (descriptor, key, path, size) tuples for each
+                            descriptor that was written. The descriptor is
+                            only needed for bandwidth files and consensuses,
+                            and may otherwise be *None*.
+        """
+        loop = asyncio.get_running_loop()
+        indexed_documents = [
+            IndexedDocument(key[0], key[1], self.shards.locate(path)[1],
+                            key[2], size)
+            for _, key, path, size in stored if key
+        ]
+        if indexed_documents:
+            await loop.run_in_executor(None, self._index_documents,
+                                       indexed_documents)
+        cataloged_documents = []
+        for _, key, path, size in stored:
+            classified = (key[0], key[2]) if key else classify_catalog_path(
+                self.shards.locate(path)[1])
+            if classified:
+                cataloged_documents.append(classified + (size, ))
+        if cataloged_documents:
+            await loop.run_in_executor(None, self.catalog.add_many,
+                                       cataloged_documents)
+        for descriptor, key, path, _ in stored:
+            if key and key[0] == VOTE:
+                vote = parse_vote_filename(os.path.basename(path))
+                if vote:
+                    self.vote_index.add(*vote)
+            elif isinstance(descriptor, (BandwidthFile, StemBandwidthFile)):
+                await loop.run_in_executor(
+                    None, self.bandwidth_history.append,
+                    as_bushel_bandwidth_file(descriptor))
+            elif isinstance(descriptor, NetworkStatusDocumentV3) and \
+                    descriptor.is_consensus and \
+                    not descriptor.is_microdescriptor:
+                await loop.run_in_executor(None,
+                                           self.relay_history.add_consensus,
+                                           descriptor)
+                await loop.run_in_executor(None,
+                                           self.address_index.add_consensus,
+                                           descriptor)
+
+    async def _store_batches(self, stored, batch_size=STORE_BATCH_SIZE):
+        """
+        Writes documents in batches, each written by a single executor task,
+        and then indexes them.
+
+        :param list stored: (descriptor, key, path, content) tuples for each
+                            document, as for :py:meth:`_write_batch`.
+        :param int batch_size: The maximum number of documents to write in
+                               a single executor task.
+        """
+        loop = asyncio.get_running_loop()
+
+        async def write_batch(batch):
+            async with self._lock_for(batch[0][2]):
+                results = await loop.run_in_executor(None, self._write_batch,
+                                                     batch)
+            return self._count_stored(batch, results)
+
+        written = await asyncio.gather(*[
+            write_batch(shard_stored[i:i + batch_size])
+            for shard_stored in self._by_shard(stored)
+            for i in range(0, len(shard_stored), batch_size)
+        ])
+        await self._after_store([item for batch in written for item in batch])
+        await self._sync_if_due()
+
     async def store(self, descriptor):
-        path = self.path_for(descriptor, create_dir=True)
+        path = self.stored_path(descriptor, self.path_for(descriptor))
         LOG.info("Saving: %s", path)
-        async with self.max_file_concurrency_lock:
-            async with aiofiles.open(path, 'wb') as output:
-                await output.write(prepare_annotated_content(descriptor))
+        content = prepare_annotated_content(descriptor)
+        batch = [(descriptor, document_key(descriptor), path, content)]
+        if self.write_behind:
+            await self._enqueue(batch)
+            return
+        loop = asyncio.get_running_loop()
+        async with self._lock_for(path):
+            results = await loop.run_in_executor(None, self._write_batch,
+                                                 batch)
+        await self._after_store(self._count_stored(batch, results))
+        await self._sync_if_due()
+
+    async def store_many(self, descriptors, batch_size=STORE_BATCH_SIZE):
+        """
+        Stores multiple descriptors. Descriptors are grouped by the directory
+        they will be stored in and written in batches, with each batch
+        written by a single executor task. Each directory is only created
+        once. In a sharded archive, each batch is written to a single root
+        so that the roots are written to concurrently.
+
+        :param list descriptors: The descriptors to store.
+        :param int batch_size: The maximum number of descriptors to write in
+                               a single executor task.
+
+        :returns: The number of descriptors stored as an :py:class:`int`.
+        """
+        started = time.monotonic()
+        by_directory = defaultdict(list)
+        for descriptor in descriptors:
+            path = self.stored_path(descriptor, self.path_for(descriptor))
+            by_directory[os.path.dirname(path)].append(
+                (descriptor, document_key(descriptor), path,
+                 prepare_annotated_content(descriptor)))
+        stored = [
+            item for directory in sorted(by_directory)
+            for item in by_directory[directory]
+        ]
+        if not stored:
+            return 0
+        if self.write_behind:
+            await self._enqueue(stored)
+            return len(stored)
+        await self._store_batches(stored, batch_size)
+        elapsed = time.monotonic() - started
+        LOG.info("Stored %d descriptors in %.3fs (%.0f descriptors/s)",
+                 len(stored), elapsed, len(stored) / max(elapsed, 1e-6))
+        return len(stored)
+
+    async def store_documents(self, stored, batch_size=STORE_BATCH_SIZE):
+        """
+        Stores documents that have already been annotated and assigned paths,
+        such as the members of a CollecTor tarball classified by
+        :py:func:`bushel.ingest.classify_member`. No document is parsed, and
+        documents are written in the order given, in batches as for
+        :py:meth:`store_many`.
+
+        :param list stored: (descriptor, key, path, content) tuples for each
+                            document. The key is the (doctype, digest,
+                            published) tuple used by the index, or *None*
+                            for documents that are not indexed. The
+                            descriptor is only needed for bandwidth files and
+                            unflavored consensuses, to update the bandwidth
+                            history, relay history and address index, and may
+                            otherwise be *None*. The content is the annotated
+                            document, uncompressed.
+        :param int batch_size: The maximum number of documents to write in
+                               a single executor task.
+
+        :returns: The number of documents stored as an :py:class:`int`.
+        """
+        if not stored:
+            return 0
+        if self.write_behind:
+            await self._enqueue(stored)
+        else:
+            await self._store_batches(stored, batch_size)
+        return len(stored)
 
     ####################
     # Get Descriptor   #
     ####################
 
+    def _cache_parsed(self, key, kwargs, document, size):
+        if self.parsed_cache is not None and key is not None:
+            self.parsed_cache.put((key, tuple(sorted(kwargs.items()))),
+                                  document, size)
+
+    def _load(self, path, kwargs, parse):
+        """
+        Loads a document, using the caches if they are enabled. This performs
+        blocking I/O.
+
+        :param str path: The path of the document.
+        :param dict kwargs: Additional arguments for
+                            :meth:`stem.descriptor.Descriptor.from_str`.
+        :param bool parse: Whether to parse the document if it is not in the
+                           parsed document cache.
+
+        :returns: A (cache key, raw content, document) :py:class:`tuple`,
+                  where the document is *None* if it has not been parsed, or
+                  *None* if the document could not be loaded.
+        """
+        key = None
+        if self.byte_cache is None and self.parsed_cache is None:
+            raw_content = read_archived(path, self.compression,
+                                        self.mmap_threshold)
+        else:
+            found = find_archived(path, self.compression)
+            if found is None:
+                return None
+            resolved, stat = found
+            key = (resolved, stat.st_mtime_ns)
+            if self.parsed_cache is not None:
+                document = self.parsed_cache.get(
+                    (key, tuple(sorted(kwargs.items()))))
+                if document is not None:
+                    return key, None, document
+            raw_content = None
+            if self.byte_cache is not None:
+                raw_content = self.byte_cache.get(key)
+            if raw_content is None:
+                raw_content = read_archived(resolved,
+                                            mmap_threshold=self.mmap_threshold)
+                if raw_content is not None and self.byte_cache is not None:
+                    self.byte_cache.put(key, raw_content, len(raw_content))
+        if raw_content is None:
+            return None
+        document = None
+        if parse:
+            document = parse_raw(raw_content, self.parser.parsers, **kwargs)
+            if document is None:
+                return None
+            self._cache_parsed(key, kwargs, document, len(raw_content))
+        return key, raw_content, document
+
+    async def _parse_entries(self, entries, kwargs):
+        """
+        Completes loading documents by parsing any that were not parsed when
+        they were read.
+
+        :param list entries: Tuples as returned by :py:meth:`_load`.
+        :param dict kwargs: Additional arguments for
+                            :meth:`stem.descriptor.Descriptor.from_str`.
+
+        :returns: A :py:class:`list` of the parsed documents.
+        """
+        pending = [raw for _, raw, document in entries if document is None]
+        parsed = iter(await self.parser.parse_many(pending, **kwargs)
+                      if pending else [])
+        documents = []
+        for key, raw_content, document in entries:
+            if document is None:
+                document = next(parsed)
+                if document is None:
+                    continue
+                self._cache_parsed(key, kwargs, document, len(raw_content))
+            documents.append(document)
+        return documents
+
+    def _load_paths(self, paths, kwargs, parse):
+        return [
+            entry for entry in (self._load(path, kwargs, parse)
+                                for path in paths) if entry
+        ]
+
+    async def _read_documents(self, paths, **kwargs):
+        loop = asyncio.get_running_loop()
+        async with self._lock_for(paths[0]):
+            entries = await loop.run_in_executor(
+                None, self._load_paths, paths, kwargs,
+                self.parser.parses_in_reader)
+        return await self._parse_entries(entries, kwargs)
+
+    async def _parse_file(self, path, **kwargs):
+        documents = await self._read_documents([path], **kwargs)
+        return documents[0] if documents else None
+
+    async def read_document(self, path):
+        """
+        Reads a document from the archive without parsing it, for consumers
+        that only need the raw bytes. The byte cache is used if enabled.
+
+        :param str path: The path of the document.
+
+        :returns: A :py:class:`~bushel.parsing.RawDocument`, or *None* if the
+                  document is not in the archive or has no ``@type``
+                  annotation.
+        """
+        loop = asyncio.get_running_loop()
+        async with self._lock_for(path):
+            entries = await loop.run_in_executor(None, self._load_paths,
+                                                 [path], {}, False)
+        if not entries:
+            return None
+        return read_raw(entries[0][1])
+
+    def cache_stats(self):
+        """
+        Reports the hit, miss and eviction counters for the raw byte cache
+        and the parsed document cache. See
+        :py:meth:`bushel.lru.LRUCache.stats`.
+
+        :returns: A :py:class:`dict` with "bytes" and "parsed" keys for the
+                  statistics of each cache, or *None* for a disabled cache.
+        """
+        return {
+            "bytes": self.byte_cache.stats() if self.byte_cache else None,
+            "parsed": self.parsed_cache.stats() if self.parsed_cache else None,
+        }
+
+    def _descriptor_path(self, doctype, digest, hint):
+        """
+        Finds the path for a server descriptor, extra-info descriptor or
+        microdescriptor using the index, falling back to the hint.
+
+        :returns: The path as a :py:class:`str`, or *False* if the descriptor
+                  is known not to be in the archive.
+        """
+        if doctype == MICRODESCRIPTOR:
+            path = self._indexed_path(doctype,
+                                      microdescriptor_hex_digest(digest))
+        else:
+            path = self._indexed_path(doctype, digest)
+        if path is None:
+            hint = hint or valid_after_now()
+            path_function = {
+                SERVER_DESCRIPTOR: self.relay_server_descriptor_path,
+                EXTRA_INFO: self.relay_extra_info_descriptor_path,
+                MICRODESCRIPTOR: self.relay_microdescriptor_path,
+            }[doctype]
+            path = path_function(hint, digest)
+        return path
+
+    def _load_descriptor(self, doctype, digest, hint, parse):
+        """
+        Loads a descriptor. This performs blocking I/O.
+
+        :returns: A (cache key, raw content, document) :py:class:`tuple` as
+                  for :py:meth:`_load`, or *None* if the descriptor is not in
+                  the archive.
+        """
+        path = self._descriptor_path(doctype, digest, hint)
+        if path is False:
+            return None
+        return self._load(path, {"descriptor_type": DESCRIPTOR_TYPES[doctype]},
+                          parse)
+
+    def _read_chunk(self, doctype, digests, hint, parse):
+        """
+        Reads, and optionally parses, a chunk of descriptors. This performs
+        blocking I/O and is run in an executor so that a whole chunk costs
+        only one handoff to a worker thread.
+
+        :returns: A :py:class:`list` of tuples as for :py:meth:`_load`.
+        """
+        return [
+            entry for entry in (
+                self._load_descriptor(doctype, digest, hint, parse)
+                for digest in digests) if entry
+        ]
+
+    def _descriptor_shard(self, doctype, digest):
+        if doctype == MICRODESCRIPTOR:
+            digest = microdescriptor_hex_digest(digest)
+        return self.shards.shard_for_digest(digest)
+
+    async def _read_descriptors(self, doctype, digests, hint):
+        loop = asyncio.get_running_loop()
+        async with self.shard_locks[self._descriptor_shard(doctype,
+                                                           digests[0])]:
+            entries = await loop.run_in_executor(None, self._read_chunk,
+                                                 doctype, digests, hint,
+                                                 self.parser.parses_in_reader)
+        return await self._parse_entries(
+            entries, {"descriptor_type": DESCRIPTOR_TYPES[doctype]})
+
+    async def _read_descriptor(self, doctype, digest, hint):
+        descriptors = await self._read_descriptors(doctype, [digest], hint)
+        return descriptors[0] if descriptors else None
+
+    async def iter_descriptors(self, doctype, digests, hint,
+                               chunk_size=READ_CHUNK_SIZE):
+        """
+        Retrieves multiple descriptors of the same type, published around the
+        same time (e.g. all referenced by the same consensus). The digests are
+        partitioned into chunks, and each chunk is read and parsed by a single
+        executor task. Descriptors are yielded as each chunk completes, so
+        their order does not match the order of the digests. In a sharded
+        archive, each chunk is read from a single root.
+
+        :param str doctype: One of :py:data:`~bushel.index.SERVER_DESCRIPTOR`,
+                            :py:data:`~bushel.index.EXTRA_INFO` or
+                            :py:data:`~bushel.index.MICRODESCRIPTOR`.
+        :param list(str) digests: Digests for the descriptors, as would be
+            given to the single descriptor retrieval method for the type.
+        :param ~datetime.datetime hint: Provides a hint on the published (or
+            valid_after) time to allow descriptors to be found in the archive
+            if they are not in the index.
+        :param int chunk_size: The maximum number of descriptors to read in a
+                               single executor task.
+
+        :returns: An asynchronous iterator of
+                  :py:class:`~stem.descriptor.Descriptor`.
+        """
+        by_shard = defaultdict(list)
+        for digest in digests:
+            by_shard[self._descriptor_shard(doctype, digest)].append(digest)
+        chunks = [
+            self._read_descriptors(doctype,
+                                   shard_digests[i:i + chunk_size], hint)
+            for shard_digests in by_shard.values()
+            for i in range(0, len(shard_digests), chunk_size)
+        ]
+        for chunk in asyncio.as_completed(chunks):
+            for descriptor in await chunk:
+                yield descriptor
+
     async def relay_server_descriptor(self, digest, published_hint):
         """
         Retrieves a relay's server descriptor from the archive.
 
         :param str digest: A hex-encoded digest of the descriptor.
         :param ~datetime.datetime published_hint: Provides a hint on the
-            published time to allow the descriptor to be found in the archive.
-            If the descriptor was not published in the same month as this, it
-            will not be found.
+            published time to allow the descriptor to be found in the archive
+            if it is not in the index. If the descriptor was not published in
+            the same month as this, it will not be found.
 
         :returns: A :py:class:`stem.descriptor.server_descriptor.RelayDescriptor`
                   if found, otherwise *None*.
         """
-        published_hint = published_hint or valid_after_now()
-        path = self.relay_server_descriptor_path(published_hint, digest)
-        async with self.max_file_concurrency_lock:
-            return await parse_file(
-                path, descriptor_type="server-descriptor 1.0")
-
-    async def _multiple_descriptors(self, single_descriptor_function, digests,
-                                    published_hint):
-        return [
-            descriptor for descriptor in await asyncio.gather(*[
-                single_descriptor_function(digest, published_hint)
-                for digest in digests
-            ]) if descriptor
-        ]
+        return await self._read_descriptor(SERVER_DESCRIPTOR, digest,
+                                           published_hint)
 
     async def relay_server_descriptors(self, digests, published_hint):
         """
         Retrieves multiple server descriptors published around the same time
-        (e.g. all referenced by the same consensus).
+        (e.g. all referenced by the same consensus). See
+        :py:meth:`iter_descriptors` to process the descriptors as they are
+        read.
 
         :param list(str) digest: Hex-encoded digests for the descriptors.
         :param ~datetime.datetime published_hint: Provides a hint on the
-            published time to allow the descriptor to be found in the archive.
-            If the descriptor was not published in the same month as this, it
-            will not be found.
+            published time to allow the descriptor to be found in the archive
+            if it is not in the index. If the descriptor was not published in
+            the same month as this, it will not be found.
 
         :returns: A :py:class:`list` of
                   :py:class:`stem.descriptor.server_descriptor.RelayDescriptor`.
         """
-        return await self._multiple_descriptors(self.relay_server_descriptor,
-                                                digests, published_hint)
+        return [
+            descriptor async for descriptor in self.iter_descriptors(
+                SERVER_DESCRIPTOR, digests, published_hint)
+        ]
 
     async def relay_microdescriptor(self, digest, valid_after_hint):
         """
@@ -777,36 +2047,37 @@ class DirectoryArchive:
 
         :param str digest: A hex-encoded digest of the descriptor.
         :param ~datetime.datetime valid_after_hint: Provides a hint on the
-            valid_after time to allow the descriptor to be found in the archive.
-            If the descriptor did not become valid in the same month as this,
-            it will not be found.
+            valid_after time to allow the descriptor to be found in the archive
+            if it is not in the index. If the descriptor did not become valid
+            in the same month as this, it will not be found.
 
         :returns: A :py:class:`stem.descriptor.microdescriptor.Microdescriptor`
                   if found, otherwise *None*.
         """
-        valid_after_hint = valid_after_hint or valid_after_now()
-        path = self.relay_microdescriptor_path(valid_after_hint, digest)
-        async with self.max_file_concurrency_lock:
-            return await parse_file(
-                path, descriptor_type="microdescriptor 1.0")
+        return await self._read_descriptor(MICRODESCRIPTOR, digest,
+                                           valid_after_hint)
 
     async def relay_microdescriptors(self, digests, valid_after_hint):
         """
         Retrieves multiple microdescriptors around the same valid_after time
-        (e.g. all referenced by the same microdescriptor consensus).
+        (e.g. all referenced by the same microdescriptor consensus). See
+        :py:meth:`iter_descriptors` to process the descriptors as they are
+        read.
 
         :param list(str) digest: Hex-encoded digests for the descriptors.
 
         :param ~datetime.datetime valid_after_hint: Provides a hint on the
-            valid_after time to allow the descriptor to be found in the archive.
-            If the descriptor did not become valid in the same month as this,
-            it will not be found.
+            valid_after time to allow the descriptor to be found in the archive
+            if it is not in the index. If the descriptor did not become valid
+            in the same month as this, it will not be found.
 
         :returns: A :py:class:`list` of
                   :py:class:`stem.descriptor.microdescriptor.Microdescriptor`.
         """
-        return await self._multiple_descriptors(self.relay_microdescriptor,
-                                                digests, valid_after_hint)
+        return [
+            descriptor async for descriptor in self.iter_descriptors(
+                MICRODESCRIPTOR, digests, valid_after_hint)
+        ]
 
     async def relay_extra_info_descriptor(self, digest, published_hint):
         """
@@ -814,34 +2085,35 @@ class DirectoryArchive:
 
         :param str digest: A hex-encoded digest of the descriptor.
         :param ~datetime.datetime published_hint: Provides a hint on the
-            published time to allow the descriptor to be found in the archive.
-            If the descriptor was not published in the same month as this, it
-            will not be found.
+            published time to allow the descriptor to be found in the archive
+            if it is not in the index. If the descriptor was not published in
+            the same month as this, it will not be found.
 
         :returns: A :py:class:`~stem.descriptor.extrainfo_descriptor.RelayExtraInfoDescriptor`
                   if found, otherwise *None*.
         """
-        published_hint = published_hint or valid_after_now()
-        path = self.relay_extra_info_descriptor_path(published_hint, digest)
-        async with self.max_file_concurrency_lock:
-            return await parse_file(path, descriptor_type="extra-info 1.0")
+        return await self._read_descriptor(EXTRA_INFO, digest, published_hint)
 
     async def relay_extra_info_descriptors(self, digests, published_hint):
         """
         Retrieves multiple extra-info descriptors published around the same time
-        (e.g. all referenced by server-descriptors in the same consensus).
+        (e.g. all referenced by server-descriptors in the same consensus). See
+        :py:meth:`iter_descriptors` to process the descriptors as they are
+        read.
 
         :param list(str) digest: Hex-encoded digests for the descriptors.
         :param ~datetime.datetime published_hint: Provides a hint on the
-            published time to allow the descriptor to be found in the archive.
-            If the descriptor was not published in the same month as this, it
-            will not be found.
+            published time to allow the descriptor to be found in the archive
+            if it is not in the index. If the descriptor was not published in
+            the same month as this, it will not be found.
 
         :returns: A :py:class:`list` of
                   :py:class:`stem.descriptor.extrainfo_descriptor.RelayExtraInfoDescriptor`.
         """
-        return await self._multiple_descriptors(
-            self.relay_extra_info_descriptor, digests, published_hint)
+        return [
+            descriptor async for descriptor in self.iter_descriptors(
+                EXTRA_INFO, digests, published_hint)
+        ]
 
     async def relay_vote(self, v3ident, digest="*", valid_after=None):
         """
@@ -859,17 +2131,82 @@ class DirectoryArchive:
         """
         valid_after = valid_after or valid_after_now()
         digest = digest.upper()
-        path = self.relay_vote_path(valid_after, v3ident, digest)
+        if digest == "*":
+            loop = asyncio.get_running_loop()
+            digests = await loop.run_in_executor(None, self.vote_index.lookup,
+                                                 valid_after, v3ident)
+            if not digests:
+                return None
+            path = self.relay_vote_path(valid_after, v3ident, digests[0])
+        else:
+            path = self._indexed_path(VOTE, digest)
+            if path is False:
+                return None
+            if path is None:
+                path = self.relay_vote_path(valid_after, v3ident, digest)
+        return await self._parse_file(
+            path, descriptor_type="network-status-vote-3 1.0")
+
+    async def relay_bandwidth_file(self, published, digest="*"):
+        """
+        Retrieves a bandwidth file from the archive.
+
+        :param ~datetime.datetime published: The time the bandwidth file was
+                                             created.
+        :param str digest: A hex-encoded SHA-256 digest of the bandwidth file.
+                           This will automatically be fixed to upper-case. If
+                           not specified, any bandwidth file created at the
+                           given time will be returned.
+
+        :returns: A :py:class:`~stem.descriptor.bandwidth_file.BandwidthFile`
+                  if found, otherwise *None*.
+        """
+        digest = digest.upper()
+        path = self.relay_bandwidth_file_path(published, digest)
         if digest == "*":
             try:
                 path = (await aglob(path))[0]
             except IndexError:
                 return None
-        async with self.max_file_concurrency_lock:
-            return await parse_file(
-                path, descriptor_type="network-status-vote-3 1.0")
+        return await self._parse_file(path, descriptor_type="bandwidth-file 1.0")
+
+    async def relay_bandwidth_history(self, fingerprint, start, end):
+        """
+        Retrieves the measured bandwidths for a relay from the bandwidth files
+        that have been stored in the archive. This does not parse the
+        bandwidth files, instead using the compact
+        :py:class:`~bushel.bandwidth.history.BandwidthHistory` store.
 
-    async def relay_consensus(self, flavor="ns", valid_after=None):
+        :param str fingerprint: The fingerprint of the relay.
+        :param ~datetime.datetime start: Earliest timestamp to include.
+        :param ~datetime.datetime end: Latest timestamp to include.
+
+        :returns: A :py:class:`list` of (:py:class:`~datetime.datetime`,
+                  :py:class:`int`) tuples, sorted by timestamp.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, self.bandwidth_history.bandwidth, fingerprint, start, end)
+
+    async def relay_status_history(self, fingerprint, start=None, end=None):
+        """
+        Retrieves the history of a relay's status in the consensus between two
+        times, from the :py:class:`~bushel.relay_history.RelayHistory`. No
+        consensuses are read.
+
+        :param str fingerprint: The fingerprint of the relay.
+        :param ~datetime.datetime start: If set, the start of the period.
+        :param ~datetime.datetime end: If set, the end of the period.
+
+        :returns: A :py:class:`list` of
+                  :py:class:`~bushel.relay_history.RelayRun`, ordered by
+                  start time.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.relay_history.runs,
+                                          fingerprint, start, end)
+
+    async def relay_consensus(self, flavor="ns", valid_after=None, raw=False):
         """
         Retrieves a consensus from the archive.
 
@@ -877,6 +2214,8 @@ class DirectoryArchive:
                                      given valid_after time, otherwise a vote
                                      that became valid at the top of the
                                      current hour will be retrieved.
+        :param bool raw: If *True*, the consensus is not parsed and a
+                         :py:class:`~bushel.parsing.RawDocument` is returned.
 
         :returns: A :py:class:`~stem.descriptor.network_status.NetworkStatusDocumentV3`
                   if found, otherwise *None*.
@@ -886,5 +2225,286 @@ class DirectoryArchive:
             path = self.relay_microdescriptor_consensus_path(valid_after)
         else:  # probably we want "ns"
             path = self.relay_consensus_path(valid_after)
-        async with self.max_file_concurrency_lock:
-            return await parse_file(path)
+        if raw:
+            return await self.read_document(path)
+        return await self._parse_file(path)
+
+    ####################
+    # Snapshots        #
+    ####################
+
+    async def _consensus_valid_at(self, flavor, when):
+        """
+        Finds the latest consensus of a flavor that became valid at or before
+        a time, looking back at most :py:data:`CONSENSUS_LOOKBACK` hours.
+
+        :returns: A (raw content, consensus) :py:class:`tuple`, or *None* if
+                  no consensus was valid at the time.
+        """
+        hour = when.replace(minute=0, second=0, microsecond=0)
+        loop = asyncio.get_running_loop()
+        for hours in range(CONSENSUS_LOOKBACK):
+            valid_after = hour - datetime.timedelta(hours=hours)
+            if flavor == "microdesc":
+                path = self.relay_microdescriptor_consensus_path(valid_after)
+            else:
+                path = self.relay_consensus_path(valid_after)
+            async with self._lock_for(path):
+                entries = await loop.run_in_executor(None, self._load_paths,
+                                                     [path], {}, False)
+            if not entries:
+                continue
+            raw_content = bytes(entries[0][1])
+            consensus = await self.parser.parse(raw_content)
+            if consensus is None or consensus.valid_until <= when:
+                return None
+            return raw_content, consensus
+        return None
+
+    async def _read_referenced(self, snapshot, doctype, digests, hint):
+        """
+        Reads the descriptors referenced by a snapshot's documents into the
+        snapshot. Descriptors that are not found using the index or the hint
+        are tried again in the previous month, as a consensus can reference
+        descriptors published before the month began.
+
+        :param list(str) digests: Digests as given to
+                                  :py:meth:`iter_descriptors`.
+
+        :returns: A :py:class:`list` of the parsed descriptors.
+        """
+        if doctype == MICRODESCRIPTOR:
+            keys = {microdescriptor_hex_digest(d): d for d in digests}
+        else:
+            keys = {d.lower(): d for d in digests}
+        found = []
+        for hint in (hint, hint.replace(day=1) - datetime.timedelta(days=1)):
+            missing = [
+                digest for key, digest in keys.items()
+                if key not in snapshot.documents[doctype]
+            ]
+            if not missing:
+                break
+            async for descriptor in self.iter_descriptors(
+                    doctype, missing, hint):
+                snapshot.add(doctype, document_key(descriptor)[1],
+                             prepare_annotated_content(descriptor), descriptor)
+                found.append(descriptor)
+        return found
+
+    async def _snapshot_flavor(self, snapshot, flavor, when):
+        consensus = await self._consensus_valid_at(flavor, when)
+        if consensus is None:
+            return
+        raw_content, consensus = consensus
+        snapshot.add(CONSENSUS_FLAVORS[flavor], flavor, raw_content)
+        hint = consensus.valid_after
+        if flavor == "microdesc":
+            await self._read_referenced(snapshot, MICRODESCRIPTOR, [
+                router.microdescriptor_digest
+                for router in consensus.routers.values()
+            ], hint)
+            return
+        descriptors = await self._read_referenced(
+            snapshot, SERVER_DESCRIPTOR,
+            [router.digest for router in consensus.routers.values()], hint)
+        await self._read_referenced(snapshot, EXTRA_INFO, [
+            descriptor.extra_info_digest for descriptor in descriptors
+            if descriptor.extra_info_digest
+        ], hint)
+
+    def snapshot_path(self, when):
+        """
+        The path at which a snapshot is persisted. Snapshots are keyed by the
+        hour, as all consensuses become valid at the top of an hour.
+
+        :param ~datetime.datetime when: The time of the snapshot.
+
+        :returns: The path as a :py:class:`str`.
+        """
+        return os.path.join(self.state_path("snapshots"),
+                            f"{when:%Y-%m-%d-%H}.snapshot")
+
+    async def snapshot(self, when, persist=False):
+        """
+        Materializes the network as it was at a time: the consensuses valid
+        at the time, every server descriptor and microdescriptor they
+        reference, and the extra-info descriptors referenced by those server
+        descriptors. Each level of the reference closure is read as one batch
+        using :py:meth:`iter_descriptors`, and the two consensus flavors are
+        resolved concurrently. See :py:mod:`bushel.snapshot`.
+
+        :param ~datetime.datetime when: The time of the snapshot.
+        :param bool persist: If *True*, the snapshot is saved to
+                             :py:meth:`snapshot_path`, and a snapshot already
+                             saved there is loaded instead of reading the
+                             archive.
+
+        :returns: A :py:class:`~bushel.snapshot.NetworkSnapshot`.
+        """
+        loop = asyncio.get_running_loop()
+        path = self.snapshot_path(when)
+        if persist:
+            snapshot = await loop.run_in_executor(None, NetworkSnapshot.load,
+                                                  path)
+            if snapshot is not None:
+                return snapshot
+        snapshot = NetworkSnapshot(when)
+        await asyncio.gather(*[
+            self._snapshot_flavor(snapshot, flavor, when)
+            for flavor in CONSENSUS_FLAVORS
+        ])
+        LOG.info("Materialized snapshot at %s: %s", when, snapshot.counts())
+        if persist:
+            await loop.run_in_executor(None, snapshot.save, path)
+        return snapshot
+
+    ####################
+    # Streaming        #
+    ####################
+
+    async def _read_ahead(self, chunks, read, read_ahead):
+        """
+        Reads and parses chunks of documents in order, keeping up to
+        *read_ahead* chunks in flight while the consumer processes the current
+        chunk. The queue of in-flight chunks bounds the memory used.
+
+        :param chunks: An asynchronous iterator of chunks, such as lists of
+                       paths.
+        :param read: A coroutine function that reads and parses a chunk,
+                     returning a :py:class:`list` of documents.
+        :param int read_ahead: The maximum number of chunks to read ahead.
+
+        :returns: An asynchronous iterator of the parsed documents.
+        """
+        queue = asyncio.Queue(maxsize=read_ahead)
+
+        async def produce():
+            async for chunk in chunks:
+                await queue.put(asyncio.ensure_future(read(chunk)))
+            await queue.put(None)
+
+        producer = asyncio.ensure_future(produce())
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is None:
+                    break
+                for document in await chunk:
+                    yield document
+            await producer
+        finally:
+            producer.cancel()
+            while not queue.empty():
+                chunk = queue.get_nowait()
+                if chunk is not None:
+                    chunk.cancel()
+
+    async def _daily_paths(self, directory_function, start, end, match):
+        loop = asyncio.get_running_loop()
+        for day in days_between(start, end):
+            directory = directory_function(day)
+            for filename in await loop.run_in_executor(
+                    None, _list_directory, directory):
+                timestamp = filename_timestamp(filename)
+                if timestamp and start <= timestamp <= end and match(filename):
+                    yield [os.path.join(directory, filename)]
+
+    async def consensuses(self, start, end, flavor="ns",
+                          read_ahead=READ_AHEAD):
+        """
+        Iterates over the consensuses in the archive that became valid between
+        two times, in order of valid-after time. The next *read_ahead*
+        consensuses are read and parsed concurrently while the current one is
+        being processed. For example::
+
+            async for consensus in archive.consensuses(start, end):
+                print(consensus.valid_after, len(consensus.routers))
+
+        :param ~datetime.datetime start: Earliest valid-after time to include.
+        :param ~datetime.datetime end: Latest valid-after time to include.
+        :param str flavor: Either "ns" or "microdesc".
+        :param int read_ahead: The maximum number of consensuses to read
+                               ahead.
+
+        :returns: An asynchronous iterator of
+                  :py:class:`~stem.descriptor.networkstatus.NetworkStatusDocumentV3`.
+        """
+        if flavor == "microdesc":
+            path_function = self.relay_microdescriptor_consensus_path
+        else:
+            path_function = self.relay_consensus_path
+        paths = self._daily_paths(
+            lambda day: os.path.dirname(path_function(day)), start, end,
+            lambda filename: True)
+        async for consensus in self._read_ahead(paths, self._read_documents,
+                                                read_ahead):
+            yield consensus
+
+    async def votes(self, start, end, v3ident=None, read_ahead=READ_AHEAD):
+        """
+        Iterates over the votes in the archive that became valid between two
+        times, in order of valid-after time and then v3ident. The next
+        *read_ahead* votes are read and parsed concurrently while the current
+        one is being processed.
+
+        :param ~datetime.datetime start: Earliest valid-after time to include.
+        :param ~datetime.datetime end: Latest valid-after time to include.
+        :param str v3ident: If set, only votes from the authority with this
+                            v3ident will be included.
+        :param int read_ahead: The maximum number of votes to read ahead.
+
+        :returns: An asynchronous iterator of
+                  :py:class:`~stem.descriptor.networkstatus.NetworkStatusDocumentV3`.
+        """
+        marker = f"-vote-{v3ident.upper()}-" if v3ident else "-vote-"
+        paths = self._daily_paths(
+            lambda day: os.path.dirname(self.relay_vote_path(day, "", "")),
+            start, end, lambda filename: marker in filename)
+        async for vote in self._read_ahead(
+                paths,
+                functools.partial(self._read_documents,
+                                  descriptor_type="network-status-vote-3 1.0"),
+                read_ahead):
+            yield vote
+
+    async def server_descriptors(self, month, read_ahead=READ_AHEAD,
+                                 chunk_size=READ_CHUNK_SIZE):
+        """
+        Iterates over the server descriptors in the archive that were
+        published in a month. Descriptors are read in chunks, in the order
+        they appear in the archive layout (by digest), with the next
+        *read_ahead* chunks read concurrently.
+
+        :param ~datetime.datetime month: A time within the month.
+        :param int read_ahead: The maximum number of chunks to read ahead.
+        :param int chunk_size: The number of descriptors in each chunk.
+
+        :returns: An asynchronous iterator of
+                  :py:class:`~stem.descriptor.server_descriptor.RelayDescriptor`.
+        """
+        month_path = os.path.join(
+            CollectorOutSubdirectory.RELAY_DESCRIPTORS.value,
+            CollectorOutRelayDescsMarker.SERVER_DESCRIPTOR.value,
+            collector_533_substructure(month))
+        loop = asyncio.get_running_loop()
+
+        async def path_chunks():
+            for first in "0123456789abcdef":
+                for second in "0123456789abcdef":
+                    directory = self.path_for(
+                        os.path.join(month_path, first, second))
+                    filenames = await loop.run_in_executor(
+                        None, _list_directory, directory)
+                    for i in range(0, len(filenames), chunk_size):
+                        yield [
+                            os.path.join(directory, filename)
+                            for filename in filenames[i:i + chunk_size]
+                        ]
+
+        async for descriptor in self._read_ahead(
+                path_chunks(),
+                functools.partial(self._read_documents,
+                                  descriptor_type="server-descriptor 1.0"),
+                read_ahead):
+            yield descriptor
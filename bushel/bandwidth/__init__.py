@@ -5,5 +5,6 @@ This module contains stuff related to bandwidth scanners.
    :maxdepth: 2
 
    bandwidth/file.rst
+   bandwidth/history.rst
 """
 # TODO: Write a better docstring
@@ -7,6 +7,7 @@ import base64
 import collections
 import datetime
 import enum
+import hashlib
 import logging
 import re
 import textwrap
@@ -14,6 +15,8 @@ import textwrap
 import nacl.signing
 import nacl.encoding
 
+from stem.descriptor import TypeAnnotation
+
 from bushel.document import BaseDocument
 
 LOG = logging.getLogger('bushel')
@@ -163,12 +166,93 @@ class BandwidthFile(BaseDocument):
     def __init__(self, raw_content):
         super().__init__(raw_content)
         self.PARSE_FUNCTIONS = dict()
+        self._lines = None
 
     def parse(self):
         for line in self.lines():
             if item.keyword in self.PARSE_FUNCTIONS:
                 self.PARSE_FUNCTIONS[line.keyword](item)
 
+    def type_annotation(self):
+        """
+        Provides the type annotation used when archiving bandwidth files,
+        "@type bandwidth-file 1.0".
+
+        :rtype: stem.descriptor.TypeAnnotation
+        """
+        return TypeAnnotation("bandwidth-file", 1, 0)
+
+    def digest(self):
+        """
+        Calculates the digest of the bandwidth file. This is the upper-case
+        hex-encoded SHA-256 digest of the raw content, as used in archive
+        filenames.
+
+        :rtype: str
+        """
+        return hashlib.sha256(self.raw_content).hexdigest().upper()
+
+    def _raw_lines(self):
+        if self._lines is None:
+            self._lines = bytes(self.raw_content).rstrip(b"\n").split(b"\n")
+        return self._lines
+
+    @property
+    def timestamp(self):
+        """
+        The timestamp found on the first line of the bandwidth file.
+
+        :rtype: datetime.datetime
+        """
+        return datetime.datetime.utcfromtimestamp(int(self._raw_lines()[0]))
+
+    @property
+    def published(self):
+        """
+        The time that this bandwidth file was created. This is taken from the
+        ``file_created`` header if present, falling back to the timestamp
+        found on the first line for older versions.
+
+        :rtype: datetime.datetime
+        """
+        file_created = self.header().get("file_created")
+        if file_created:
+            return datetime.datetime.strptime(file_created,
+                                              "%Y-%m-%dT%H:%M:%S")
+        return self.timestamp
+
+    def header(self):
+        """
+        Key-values found in the header lines of the bandwidth file. Documents
+        prior to version 1.1.0 have no header lines, in which case this will
+        be empty.
+
+        :rtype: dict
+        """
+        header = {}
+        for line in self._raw_lines()[1:]:
+            if line.startswith(b"====") or b" " in line:
+                break
+            key, _, value = line.decode('utf-8').partition("=")
+            header[key] = value
+        return header
+
+    def relays(self):
+        """
+        Iterates over the relay lines of the bandwidth file, producing a
+        :class:`dict` of key-values for each. This does not use the
+        tokenizer, so that large files can be processed quickly when only
+        simple values (such as ``node_id`` and ``bw``) are needed.
+
+        :returns: iterator for :class:`dict`
+        """
+        for line in self._raw_lines()[1:]:
+            if line.startswith(b"====") or b" " not in line:
+                # Terminator or header line
+                continue
+            yield dict(kv.partition("=")[::2]
+                       for kv in line.decode('utf-8').split(" "))
+
     def lines(self, allowed_errors=None):
         liner = BandwidthFileLiner(allowed_errors)
         for token in self.tokenize():
@@ -210,7 +294,7 @@ class BandwidthFile(BaseDocument):
             '(?P<%s>%s)' % pair for pair in token_specification)
         line_num = 1
         line_start = 0
-        for mo in re.finditer(tok_regex, self.raw_content.decode('utf-8')):
+        for mo in re.finditer(tok_regex, str(self.raw_content, 'utf-8')):
             kind = mo.lastgroup
             value = mo.group()
             column = mo.start() - line_start
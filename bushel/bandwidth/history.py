@@ -0,0 +1,238 @@
+"""
+Compact storage of relay bandwidth measurements over time.
+
+Answering questions such as "what was the measured bandwidth of relay X over
+the last 6 months" from archived bandwidth files would require parsing
+hundreds of large documents. The :class:`BandwidthHistory` instead keeps an
+append-only, columnar store with one directory per month::
+
+    2018-11/
+        node_ids    # One fingerprint per line, the line number is its index
+        timestamp   # uint32 bandwidth file timestamps
+        node        # uint32 indexes into node_ids
+        bw          # uint64 bandwidth values
+
+Each row is spread across the three column files, so ``timestamp[i]``,
+``node[i]`` and ``bw[i]`` together form one measurement. Rows are only ever
+appended, and a row that was only partially written (e.g. due to a crash) is
+ignored by truncating all columns to the shortest column when reading.
+
+Measurements are identified by the timestamp of their bandwidth file, so a
+bandwidth file with a timestamp that is already recorded for the month is
+not appended again. This makes storing or importing the same bandwidth file
+more than once harmless.
+"""
+
+import array
+import datetime
+import logging
+import os
+import os.path
+import threading
+
+LOG = logging.getLogger('bushel')
+
+TIMESTAMP_TYPECODE = 'I'
+NODE_TYPECODE = 'I'
+BW_TYPECODE = 'Q'
+
+
+def month_name(timestamp):
+    """
+    Create the name used for the directory containing measurements for the
+    month of a given timestamp. For example:
+
+    >>> month_name(datetime.datetime(2018, 11, 19, 15))
+    '2018-11'
+
+    :param ~datetime.datetime timestamp: A time within the month.
+
+    :returns: Directory name as a :py:class:`str`.
+    """
+    return f"{timestamp.year}-{timestamp.month:02d}"
+
+
+def months_between(start, end):
+    """
+    Generates the first day of each month between *start* and *end*
+    inclusive. For example:
+
+    >>> start = datetime.datetime(2018, 11, 19)
+    >>> end = datetime.datetime(2019, 1, 5)
+    >>> [month_name(m) for m in months_between(start, end)]
+    ['2018-11', '2018-12', '2019-01']
+    """
+    month = datetime.datetime(start.year, start.month, 1)
+    while month <= end:
+        yield month
+        if month.month == 12:
+            month = month.replace(year=month.year + 1, month=1)
+        else:
+            month = month.replace(month=month.month + 1)
+
+
+def _read_column(path, typecode, count=None):
+    column = array.array(typecode)
+    try:
+        with open(path, 'rb') as source:
+            column.frombytes(source.read())
+    except FileNotFoundError:
+        pass
+    if count is not None:
+        del column[count:]
+    return column
+
+
+class BandwidthHistory:
+    """
+    Append-only columnar store of relay bandwidth measurements.
+
+    All methods perform blocking I/O. When used from an :py:mod:`asyncio`
+    application these should be called in an executor, as is done by
+    :py:class:`~bushel.archive.DirectoryArchive`.
+
+    :param str history_path: Path to the directory used for the store. This
+                             will be created if it does not exist.
+    """
+
+    def __init__(self, history_path):
+        self.history_path = history_path
+        self._node_ids = {}
+        self._timestamps = {}
+        self._lock = threading.Lock()
+
+    def _month_path(self, timestamp, filename=""):
+        return os.path.join(self.history_path, month_name(timestamp), filename)
+
+    def _load_node_ids(self, timestamp):
+        month = month_name(timestamp)
+        if month not in self._node_ids:
+            node_ids = {}
+            try:
+                with open(self._month_path(timestamp, "node_ids")) as source:
+                    for index, line in enumerate(source):
+                        node_ids[line.strip()] = index
+            except FileNotFoundError:
+                pass
+            self._node_ids[month] = node_ids
+        return self._node_ids[month]
+
+    def _load_timestamps(self, timestamp):
+        month = month_name(timestamp)
+        if month not in self._timestamps:
+            self._timestamps[month] = set(
+                _read_column(self._month_path(timestamp, "timestamp"),
+                             TIMESTAMP_TYPECODE, self._row_count(timestamp)))
+        return self._timestamps[month]
+
+    def _row_count(self, timestamp):
+        sizes = [
+            os.path.getsize(self._month_path(timestamp, name)) //
+            array.array(typecode).itemsize
+            if os.path.exists(self._month_path(timestamp, name)) else 0
+            for name, typecode in [("timestamp", TIMESTAMP_TYPECODE),
+                                   ("node", NODE_TYPECODE),
+                                   ("bw", BW_TYPECODE)]
+        ]
+        return min(sizes)
+
+    def append(self, bandwidth_file):
+        """
+        Appends the measurements from a bandwidth file to the store. Relay
+        lines without a ``node_id`` or ``bw`` are skipped, as is the whole
+        file if measurements with its timestamp are already recorded.
+
+        :param ~bushel.bandwidth.file.BandwidthFile bandwidth_file: The
+            bandwidth file to take measurements from.
+
+        :returns: The number of measurements appended as an :py:class:`int`.
+        """
+        timestamp = bandwidth_file.timestamp
+        epoch = int(timestamp.replace(tzinfo=datetime.timezone.utc).timestamp())
+        with self._lock:
+            recorded = self._load_timestamps(timestamp)
+            if epoch in recorded:
+                LOG.debug("Bandwidth measurements for %s already recorded",
+                          timestamp)
+                return 0
+            os.makedirs(self._month_path(timestamp), exist_ok=True)
+            node_ids = self._load_node_ids(timestamp)
+            new_node_ids = []
+            timestamps = array.array(TIMESTAMP_TYPECODE)
+            nodes = array.array(NODE_TYPECODE)
+            bws = array.array(BW_TYPECODE)
+            for relay in bandwidth_file.relays():
+                if "node_id" not in relay or "bw" not in relay:
+                    continue
+                node_id = relay["node_id"].lstrip("$").upper()
+                if node_id not in node_ids:
+                    node_ids[node_id] = len(node_ids)
+                    new_node_ids.append(node_id)
+                timestamps.append(epoch)
+                nodes.append(node_ids[node_id])
+                bws.append(int(relay["bw"]))
+            if new_node_ids:
+                with open(self._month_path(timestamp, "node_ids"), 'a') as output:
+                    output.write("".join(f"{n}\n" for n in new_node_ids))
+            # Discard any partially written row before appending so that the
+            # columns remain aligned.
+            count = self._row_count(timestamp)
+            for name, column in [("timestamp", timestamps), ("node", nodes),
+                                 ("bw", bws)]:
+                with open(self._month_path(timestamp, name), 'ab') as output:
+                    output.truncate(count * column.itemsize)
+                    column.tofile(output)
+            recorded.add(epoch)
+        LOG.debug("Appended %d bandwidth measurements for %s", len(bws),
+                  timestamp)
+        return len(bws)
+
+    def _month_rows(self, month, node_index):
+        count = self._row_count(month)
+        raw_nodes = _read_column(self._month_path(month, "node"),
+                                 NODE_TYPECODE, count).tobytes()
+        needle = array.array(NODE_TYPECODE, [node_index]).tobytes()
+        itemsize = len(needle)
+        rows = []
+        # Searching the raw bytes lets the scan run at C speed, alignment is
+        # checked to discard matches spanning two values.
+        offset = raw_nodes.find(needle)
+        while offset != -1:
+            if offset % itemsize == 0:
+                rows.append(offset // itemsize)
+            offset = raw_nodes.find(needle, offset + 1)
+        return rows
+
+    def bandwidth(self, fingerprint, start, end):
+        """
+        Retrieves the measured bandwidths for a relay between two times.
+
+        :param str fingerprint: The fingerprint of the relay.
+        :param ~datetime.datetime start: Earliest timestamp to include.
+        :param ~datetime.datetime end: Latest timestamp to include.
+
+        :returns: A :py:class:`list` of (:py:class:`~datetime.datetime`,
+                  :py:class:`int`) tuples for the timestamp of the bandwidth
+                  file and the measured bandwidth, sorted by timestamp.
+        """
+        fingerprint = fingerprint.lstrip("$").upper()
+        measurements = []
+        with self._lock:
+            for month in months_between(start, end):
+                node_index = self._load_node_ids(month).get(fingerprint)
+                if node_index is None:
+                    continue
+                rows = self._month_rows(month, node_index)
+                if not rows:
+                    continue
+                count = self._row_count(month)
+                timestamps = _read_column(self._month_path(month, "timestamp"),
+                                          TIMESTAMP_TYPECODE, count)
+                bws = _read_column(self._month_path(month, "bw"), BW_TYPECODE,
+                                   count)
+                for row in rows:
+                    timestamp = datetime.datetime.utcfromtimestamp(
+                        timestamps[row])
+                    if start <= timestamp <= end:
+                        measurements.append((timestamp, bws[row]))
+        return sorted(measurements)
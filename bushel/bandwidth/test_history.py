@@ -0,0 +1,52 @@
+import datetime
+import tempfile
+
+from nose.tools import assert_equal
+
+from bushel.bandwidth.file import BandwidthFile
+from bushel.bandwidth.history import BandwidthHistory
+from bushel.bandwidth.test_file import example_version_100
+from bushel.bandwidth.test_file import example_sbws_103
+
+
+def test_bandwidth_file_relays():
+    relays = list(BandwidthFile(example_sbws_103).relays())
+    assert_equal(len(relays), 2)
+    assert_equal(relays[0]["node_id"],
+                 "$68A483E05A2ABDCA6DA5A3EF8DB5177638A27F80")
+    assert_equal(relays[1]["bw"], "1")
+
+
+def test_bandwidth_file_published():
+    assert_equal(BandwidthFile(example_version_100).published,
+                 datetime.datetime(2018, 4, 16, 20, 49, 18))
+    assert_equal(BandwidthFile(example_sbws_103).published,
+                 datetime.datetime(2018, 4, 16, 21, 49, 18))
+
+
+def test_bandwidth_history():
+    with tempfile.TemporaryDirectory() as history_path:
+        history = BandwidthHistory(history_path)
+        assert_equal(history.append(BandwidthFile(example_version_100)), 2)
+        later = example_sbws_103.replace(b"1523911758", b"1523915358", 1)
+        assert_equal(history.append(BandwidthFile(later)), 2)
+        # A bandwidth file that is already recorded is not appended again
+        assert_equal(history.append(BandwidthFile(later)), 0)
+        start = datetime.datetime(2018, 1, 1)
+        end = datetime.datetime(2018, 12, 31)
+        assert_equal(
+            history.bandwidth("$68A483E05A2ABDCA6DA5A3EF8DB5177638A27F80",
+                              start, end),
+            [(datetime.datetime(2018, 4, 16, 20, 49, 18), 760),
+             (datetime.datetime(2018, 4, 16, 21, 49, 18), 38000)])
+        # A fresh instance reads back what is on disk
+        history = BandwidthHistory(history_path)
+        assert_equal(history.append(BandwidthFile(example_version_100)), 0)
+        assert_equal(
+            history.bandwidth("96C15995F30895689291F455587BD94CA427B6FC",
+                              start, end),
+            [(datetime.datetime(2018, 4, 16, 20, 49, 18), 189),
+             (datetime.datetime(2018, 4, 16, 21, 49, 18), 1)])
+        assert_equal(
+            history.bandwidth("0000000000000000000000000000000000000000",
+                              start, end), [])
@@ -0,0 +1,219 @@
+"""
+Bloom filters for quickly ruling out documents that are not in a
+:py:class:`~bushel.archive.DirectoryArchive`.
+
+Right after a new consensus is published, most of the descriptors it
+references will not yet be in the archive, and each lookup would otherwise
+cost at least an index query. A :py:class:`DigestBloomFilter` answers "is this
+digest definitely not archived?" from memory, only allowing through lookups
+for digests that might be archived.
+
+Each filter is stored in a single file that is memory-mapped, so bits set as
+documents are stored are persisted incrementally by the operating system.
+The file starts with a 32 byte header::
+
+    magic       8 bytes   b"BSHBLOOM"
+    hashes      uint32    number of bit positions per digest
+    complete    uint32    1 if every archived document has been added
+    bits        uint64    number of bits in the filter
+    count       uint64    number of digests added
+
+A filter is only *complete* once it has been populated from a complete
+:py:class:`~bushel.index.DigestIndex`, until then a negative answer cannot be
+trusted and :py:meth:`DigestBloomFilter.might_contain` always returns *True*.
+"""
+
+import hashlib
+import math
+import mmap
+import os
+import os.path
+import struct
+import threading
+
+MAGIC = b"BSHBLOOM"
+HEADER = struct.Struct("<8sIIQQ")
+DEFAULT_CAPACITY = 4 * 1024 * 1024
+DEFAULT_FALSE_POSITIVE_RATE = 0.01
+
+
+def filter_parameters(capacity, false_positive_rate):
+    """
+    Calculates the optimal number of bits and hash functions for a Bloom
+    filter. For example:
+
+    >>> filter_parameters(1000, 0.01)
+    (9586, 7)
+
+    :param int capacity: The number of digests the filter is expected to hold.
+    :param float false_positive_rate: The target false-positive rate when the
+                                      filter holds *capacity* digests.
+
+    :returns: A (bits, hashes) :py:class:`tuple` of :py:class:`int`.
+    """
+    bits = math.ceil(-capacity * math.log(false_positive_rate) / math.log(2)**2)
+    hashes = max(1, round(bits / capacity * math.log(2)))
+    return bits, hashes
+
+
+def _positions(digest, bits, hashes):
+    raw = hashlib.blake2b(digest.lower().encode('ascii'), digest_size=16).digest()
+    first, second = struct.unpack("<QQ", raw)
+    second |= 1
+    return [(first + i * second) % bits for i in range(hashes)]
+
+
+class DigestBloomFilter:
+    """
+    A persistent Bloom filter of document digests.
+
+    :param str filter_path: Path to the file used to store the filter. This
+                            will be created if it does not exist.
+    :param int capacity: The number of digests the filter is sized for when
+                         it is created.
+    :param float false_positive_rate: The target false-positive rate at
+                                      *capacity* when the filter is created.
+    """
+
+    def __init__(self, filter_path, capacity=DEFAULT_CAPACITY,
+                 false_positive_rate=DEFAULT_FALSE_POSITIVE_RATE):
+        self.filter_path = filter_path
+        self.capacity = capacity
+        self.false_positive_rate = false_positive_rate
+        self._file = None
+        self._map = None
+        self._lock = threading.Lock()
+
+    def _open(self, create):
+        if self._map is not None:
+            return True
+        with self._lock:
+            if self._map is not None:
+                return True
+            if not os.path.exists(self.filter_path):
+                if not create:
+                    return False
+                self._create()
+            self._file = open(self.filter_path, 'r+b')
+            self._map = mmap.mmap(self._file.fileno(), 0)
+            magic, self.hashes, _, self.bits, _ = HEADER.unpack_from(self._map)
+            if magic != MAGIC:
+                raise ValueError(f"{self.filter_path} is not a Bloom filter")
+            return True
+
+    def _create(self):
+        bits, hashes = filter_parameters(self.capacity,
+                                         self.false_positive_rate)
+        os.makedirs(os.path.dirname(self.filter_path), exist_ok=True)
+        with open(self.filter_path, 'wb') as output:
+            output.write(HEADER.pack(MAGIC, hashes, 0, bits, 0))
+            # Extending with truncate leaves a sparse file, disk space is only
+            # used as bits are set.
+            output.truncate(HEADER.size + (bits + 7) // 8)
+
+    def close(self):
+        """
+        Closes the filter file. It will be reopened if the filter is used
+        again.
+        """
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._file.close()
+                self._map = None
+                self._file = None
+
+    @property
+    def complete(self):
+        """
+        *True* if every archived document has been added to the filter, and so
+        negative answers can be trusted.
+        """
+        if not self._open(create=False):
+            return False
+        return HEADER.unpack_from(self._map)[2] == 1
+
+    @property
+    def count(self):
+        """
+        The number of digests that have been added to the filter.
+        """
+        if not self._open(create=False):
+            return 0
+        return HEADER.unpack_from(self._map)[4]
+
+    def _set_header(self, complete=None, count=None):
+        _, hashes, old_complete, bits, old_count = HEADER.unpack_from(self._map)
+        HEADER.pack_into(
+            self._map, 0, MAGIC, hashes,
+            old_complete if complete is None else int(complete), bits,
+            old_count if count is None else count)
+
+    def add_many(self, digests):
+        """
+        Adds digests to the filter.
+
+        :param list(str) digests: Hex-encoded digests.
+        """
+        self._open(create=True)
+        with self._lock:
+            added = 0
+            for digest in digests:
+                for position in _positions(digest, self.bits, self.hashes):
+                    offset = HEADER.size + position // 8
+                    self._map[offset] |= 1 << (position % 8)
+                added += 1
+            self._set_header(count=HEADER.unpack_from(self._map)[4] + added)
+
+    def add(self, digest):
+        """
+        Adds a digest to the filter.
+
+        :param str digest: A hex-encoded digest.
+        """
+        self.add_many([digest])
+
+    def rebuild(self, digests):
+        """
+        Replaces the contents of the filter with the given digests and marks
+        the filter as complete. The filter is resized for the number of
+        digests if required.
+
+        :param list(str) digests: Hex-encoded digests of every archived
+                                  document of the filter's type.
+        """
+        digests = list(digests)
+        self.close()
+        self.capacity = max(self.capacity, 2 * len(digests))
+        if os.path.exists(self.filter_path):
+            os.unlink(self.filter_path)
+        self.add_many(digests)
+        with self._lock:
+            self._set_header(complete=True)
+
+    def might_contain(self, digest):
+        """
+        Checks if a digest might have been added to the filter.
+
+        :param str digest: A hex-encoded digest.
+
+        :returns: *False* if the digest is definitely not in the archive,
+                  otherwise *True*.
+        """
+        if not self.complete:
+            return True
+        for position in _positions(digest, self.bits, self.hashes):
+            if not self._map[HEADER.size + position // 8] & (1 << (position % 8)):
+                return False
+        return True
+
+    def estimated_false_positive_rate(self):
+        """
+        Estimates the current false-positive rate of the filter from the number
+        of digests that have been added.
+
+        :rtype: float
+        """
+        if not self._open(create=False):
+            return 0.0
+        return (1 - math.exp(-self.hashes * self.count / self.bits))**self.hashes
@@ -3,7 +3,7 @@ import datetime
 import logging
 import random
 import sys
-from collections import defaultdict
+import time
 
 import stem
 
@@ -12,14 +12,133 @@ from bushel import EXTRA_INFO_DESCRIPTOR
 from bushel import DirectoryCacheMode
 from bushel.archive import DirectoryArchive
 from bushel.downloader import DirectoryDownloader
+from bushel.lru import LRUCache
 
 LOG = logging.getLogger('')
 
 MICRODESCRIPTOR = 30
 
+DESCRIPTOR_CACHE_SIZES = {
+    SERVER_DESCRIPTOR: 64 * 1024 * 1024,
+    EXTRA_INFO_DESCRIPTOR: 64 * 1024 * 1024,
+    MICRODESCRIPTOR: 32 * 1024 * 1024,
+}
+"""
+Default maximum total size in bytes of the cached descriptors of each type.
+"""
+
+DESCRIPTOR_TTLS = {
+    SERVER_DESCRIPTOR: datetime.timedelta(hours=48),
+    EXTRA_INFO_DESCRIPTOR: datetime.timedelta(hours=48),
+    MICRODESCRIPTOR: datetime.timedelta(days=7),
+}
+"""
+Default time for which descriptors of each type are cached. For server and
+extra-info descriptors this is measured from the published time, as relays
+publish new descriptors at least every 18 hours. Microdescriptors have no
+published time and are cached for this long after they were added.
+"""
+
+
+def cache_key(doctype, digest):
+    """
+    Normalizes a descriptor digest for use as a cache key, so that digests
+    from consensuses and from descriptors match. For example:
+
+    >>> cache_key(SERVER_DESCRIPTOR,
+    ...           "a94a07b201598d847105ae5fcd5bc3ab10124389")
+    'A94A07B201598D847105AE5FCD5BC3AB10124389'
+
+    :param int doctype: The type of descriptor.
+    :param str digest: A hex-encoded digest, or a base64-encoded digest for a
+                       microdescriptor.
+
+    :returns: The key as a :py:class:`str`.
+    """
+    if doctype == MICRODESCRIPTOR:
+        return digest.rstrip("=")
+    return digest.upper()
+
+
+class DescriptorCache:
+    """
+    An in-memory cache of descriptors, with a separate
+    :py:class:`~bushel.lru.LRUCache` for each type of descriptor. Each cache
+    is bounded by the total size of the raw descriptors, and descriptors are
+    also evicted once they are too old to be useful. Descriptors are keyed by
+    their own digest.
+
+    :param dict max_sizes: The maximum total size in bytes of the descriptors
+                           of each type. Defaults to
+                           :py:data:`DESCRIPTOR_CACHE_SIZES`.
+    :param dict ttls: The :py:class:`~datetime.timedelta` for which
+                      descriptors of each type are cached. Defaults to
+                      :py:data:`DESCRIPTOR_TTLS`.
+    :param clock: A function returning the current time as a POSIX timestamp.
+    """
+
+    def __init__(self, max_sizes=None, ttls=None, clock=time.time):
+        self.max_sizes = {**DESCRIPTOR_CACHE_SIZES, **(max_sizes or {})}
+        self.ttls = {**DESCRIPTOR_TTLS, **(ttls or {})}
+        self.clock = clock
+        self.caches = {
+            doctype: LRUCache(max_size, clock)
+            for doctype, max_size in self.max_sizes.items()
+        }
+
+    def get(self, doctype, digest):
+        """
+        Retrieves a descriptor from the cache.
+
+        :param int doctype: The type of descriptor.
+        :param str digest: The digest of the descriptor.
+
+        :returns: The descriptor, or *None* if it is not cached or has expired.
+        """
+        return self.caches[doctype].get(cache_key(doctype, digest))
+
+    def put(self, doctype, descriptor):
+        """
+        Adds a descriptor to the cache, keyed by its own digest.
+
+        :param int doctype: The type of descriptor.
+        :param ~stem.descriptor.Descriptor descriptor: The descriptor.
+        """
+        published = getattr(descriptor, "published", None)
+        if published is not None:
+            expires = published.replace(
+                tzinfo=datetime.timezone.utc).timestamp()
+        else:
+            expires = self.clock()
+        expires += self.ttls[doctype].total_seconds()
+        self.caches[doctype].put(cache_key(doctype, descriptor.digest()),
+                                 descriptor, len(descriptor.get_bytes()),
+                                 expires)
+
+    def expire(self):
+        """
+        Removes all expired descriptors.
+
+        :returns: The number of descriptors removed as an :py:class:`int`.
+        """
+        return sum(cache.expire() for cache in self.caches.values())
+
+    def stats(self):
+        """
+        Reports the statistics for the cache of each type of descriptor. See
+        :py:meth:`bushel.lru.LRUCache.stats`.
+
+        :returns: A :py:class:`dict` of statistics keyed by type.
+        """
+        return {
+            doctype: cache.stats()
+            for doctype, cache in self.caches.items()
+        }
+
+
 class DirectoryCache:
-    def __init__(self, archive_path):
-        self.descriptors = defaultdict(dict)
+    def __init__(self, archive_path, cache_sizes=None, cache_ttls=None):
+        self.descriptors = DescriptorCache(cache_sizes, cache_ttls)
         self.archive = DirectoryArchive(archive_path)
         self.downloader = DirectoryDownloader()
         self.downloader.descriptor_cache = self._cached_descriptor # TODO: Do something more sensible
@@ -53,81 +172,64 @@ class DirectoryCache:
         return vote
 
     def _cached_descriptor(self, doctype, digest):
-        if doctype in self.descriptors:
-            if digest in self.descriptors[doctype]:
-                return self.descriptors[doctype][digest]
+        return self.descriptors.get(doctype, digest)
 
-    async def relay_server_descriptors(self, digests, published_hint=None):
+    async def _descriptors(self, doctype, digests, archived, downloaded):
+        """
+        Retrieves descriptors from the in-memory cache, then the archive, and
+        then from directory servers. Descriptors that are found in the
+        archive or downloaded are added to the in-memory cache, and
+        downloaded descriptors are also archived.
+
+        :param int doctype: The type of descriptor.
+        :param list(str) digests: The digests of the descriptors.
+        :param archived: Coroutine function to retrieve a list of descriptors
+                         from the archive.
+        :param downloaded: Coroutine function to download a list of
+                           descriptors.
+        """
         descriptors = []
+        missing = {}
         for digest in digests:
-            descriptor = self._cached_descriptor(SERVER_DESCRIPTOR, digest)
+            descriptor = self.descriptors.get(doctype, digest)
             if descriptor:
                 descriptors.append(descriptor)
-                digests.remove(descriptor.digest())
-        if not digests:
+            else:
+                missing[cache_key(doctype, digest)] = digest
+        if not missing:
             return descriptors
-        archived_descriptors = await self.archive.relay_server_descriptors(
-            digests, published_hint=published_hint)
-        for descriptor in archived_descriptors:
-            digests.remove(descriptor.digest())
-        descriptors += archived_descriptors
-        if digests:
-            downloaded_descriptors = await self.downloader.relay_server_descriptors(
-                digests, published_hint=published_hint)
+        found = await archived(list(missing.values()))
+        for descriptor in found:
+            missing.pop(cache_key(doctype, descriptor.digest()), None)
+        if missing:
+            downloaded_descriptors = await downloaded(list(missing.values()))
             if downloaded_descriptors:
-                descriptors += downloaded_descriptors
-                for descriptor in downloaded_descriptors:
-                    await self.archive.store(descriptor)
-        for descriptor in descriptors:
-            self.descriptors[SERVER_DESCRIPTOR][digest] = descriptor
-        return descriptors
+                found += downloaded_descriptors
+                await self.archive.store_many(downloaded_descriptors)
+        for descriptor in found:
+            self.descriptors.put(doctype, descriptor)
+        return descriptors + found
+
+    async def relay_server_descriptors(self, digests, published_hint=None):
+        return await self._descriptors(
+            SERVER_DESCRIPTOR, digests,
+            lambda missing: self.archive.relay_server_descriptors(
+                missing, published_hint=published_hint),
+            lambda missing: self.downloader.relay_server_descriptors(
+                missing, published_hint=published_hint))
 
     async def relay_extra_info_descriptors(self, digests, published_hint=None):
-        descriptors = []
-        for digest in digests:
-            descriptor = self._cached_descriptor(EXTRA_INFO_DESCRIPTOR, digest)
-            if descriptor:
-                descriptors.append(descriptor)
-                digests.remove(descriptor.digest())
-        if not digests:
-            return descriptors
-        archived_descriptors = await self.archive.relay_extra_info_descriptors(
-            digests, published_hint=published_hint)
-        for descriptor in archived_descriptors:
-            digests.remove(descriptor.digest())
-        descriptors += archived_descriptors
-        if digests:
-            downloaded_descriptors = await self.downloader.relay_extra_info_descriptors(
-                digests, published_hint=published_hint)
-            if downloaded_descriptors:
-                descriptors += downloaded_descriptors
-                for descriptor in downloaded_descriptors:
-                    await self.archive.store(descriptor)
-        for descriptor in descriptors:
-            self.descriptors[EXTRA_INFO_DESCRIPTOR][digest] = descriptor
-        return descriptors
+        return await self._descriptors(
+            EXTRA_INFO_DESCRIPTOR, digests,
+            lambda missing: self.archive.relay_extra_info_descriptors(
+                missing, published_hint=published_hint),
+            lambda missing: self.downloader.relay_extra_info_descriptors(
+                missing, published_hint=published_hint))
 
     async def relay_microdescriptors(self, microdescriptor_hashes, valid_after_hint=None):
-        descriptors = []
-        for digest in microdescriptor_hashes:
-            descriptor = self._cached_descriptor(MICRODESCRIPTOR, digest)
-            if descriptor:
-                descriptors.append(descriptor)
-                microdescriptor_hashes.remove(descriptor.digest())
-        if not microdescriptor_hashes:
-            return descriptors
-        archived_descriptors = await self.archive.relay_microdescriptors(
-            microdescriptor_hashes, valid_after_hint=valid_after_hint)
-        for descriptor in archived_descriptors:
-            microdescriptor_hashes.remove(descriptor.digest())
-        descriptors += archived_descriptors
-        if microdescriptor_hashes:
-            downloaded_descriptors = await self.downloader.relay_microdescriptors(
-                microdescriptor_hashes, valid_after_hint=valid_after_hint)
-            if downloaded_descriptors:
-                descriptors += downloaded_descriptors
-                for descriptor in downloaded_descriptors:
-                    await self.archive.store(descriptor)
-        for descriptor in descriptors:
-            self.descriptors[MICRODESCRIPTOR][digest] = descriptor
-        return descriptors
+        return await self._descriptors(
+            MICRODESCRIPTOR, microdescriptor_hashes,
+            lambda missing: self.archive.relay_microdescriptors(
+                missing, valid_after_hint=valid_after_hint),
+            lambda missing: self.downloader.relay_microdescriptors(
+                missing, valid_after_hint=valid_after_hint))
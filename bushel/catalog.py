@@ -0,0 +1,352 @@
+"""
+Incremental catalog of the contents of a
+:py:class:`~bushel.archive.DirectoryArchive`.
+
+The catalog holds the number of documents, their total size and the first and
+last timestamps for each type of document in each month, so that questions
+such as "how many server descriptors are there for 2018-11" can be answered
+without walking the archive. It is kept in an SQLite database in the
+archive's state and is updated whenever documents are stored.
+
+The timestamp used for each document is its published time for descriptors
+and bandwidth files, and its valid-after time for statuses and votes.
+Microdescriptors carry no timestamp and are filed by the month they were
+archived in, so their first and last timestamps only record the month.
+
+If the archive has been modified by other tools, or the catalog has been lost,
+:py:meth:`ArchiveCatalog.rebuild` walks the archive to recreate it. For
+example::
+
+    archive = DirectoryArchive("/srv/archive")
+    for entry in archive.catalog.entries(SERVER_DESCRIPTOR):
+        print(entry.month, entry.count, entry.size)
+"""
+
+import collections
+import concurrent.futures
+import datetime
+import logging
+import os
+import os.path
+import sqlite3
+import threading
+import typing
+
+from bushel.collector.filesystem import CollectorOutBridgeDescsMarker
+from bushel.collector.filesystem import CollectorOutRelayDescsMarker
+from bushel.collector.filesystem import CollectorOutSubdirectory
+from bushel.compression import strip_compression_extension
+from bushel.index import MICRODESCRIPTOR
+from bushel.index import VOTE
+from bushel.index import BANDWIDTH_FILE
+from bushel.index import _month_subtrees
+from bushel.index import _published_from_content
+from bushel.index import classify_path
+
+LOG = logging.getLogger('bushel')
+
+CONSENSUS = "network-status-consensus-3"
+MICRODESC_CONSENSUS = "network-status-microdesc-consensus-3"
+BRIDGE_STATUS = "bridge-network-status"
+
+_STATUS_MARKERS = {
+    (CollectorOutSubdirectory.RELAY_DESCRIPTORS.value,
+     CollectorOutRelayDescsMarker.CONSENSUS.value): CONSENSUS,
+    (CollectorOutSubdirectory.BRIDGE_DESCRIPTORS.value,
+     CollectorOutBridgeDescsMarker.STATUSES.value): BRIDGE_STATUS,
+}
+
+
+class CatalogEntry(typing.NamedTuple):
+    """
+    The documents of one type in one month of the archive.
+    """
+    doctype: str
+    """The type of document, such as "server-descriptor"."""
+    month: datetime.datetime
+    """The start of the month."""
+    count: int
+    """The number of documents."""
+    size: int
+    """The total size of the documents in bytes, as stored."""
+    first: typing.Optional[datetime.datetime]
+    """The earliest timestamp of the documents."""
+    last: typing.Optional[datetime.datetime]
+    """The latest timestamp of the documents."""
+
+
+def _status_timestamp(doctype, filename):
+    try:
+        if doctype == BRIDGE_STATUS:
+            return datetime.datetime.strptime(filename[:15], "%Y%m%d-%H%M%S")
+        return datetime.datetime.strptime(filename[:19], "%Y-%m-%d-%H-%M-%S")
+    except ValueError:
+        return None
+
+
+def classify_catalog_path(path):
+    """
+    Determines the type and timestamp of any document from its path relative
+    to the archive root. For example:
+
+    >>> classify_catalog_path("relay-descriptors/consensus/2018/11/19/"
+    ...                       "2018-11-19-15-00-00-consensus.xz")
+    ('network-status-consensus-3', datetime.datetime(2018, 11, 19, 15, 0))
+
+    Documents addressed by digest are classified as by
+    :py:func:`~bushel.index.classify_path`, so descriptors are only given the
+    month as their timestamp.
+
+    :param str path: The path relative to the archive root.
+
+    :returns: A (doctype, timestamp) :py:class:`tuple`, or *None* if the path
+              does not hold a document.
+    """
+    classified = classify_path(path)
+    if classified is not None:
+        return classified[0], classified[2]
+    parts = strip_compression_extension(path).split(os.sep)
+    doctype = _STATUS_MARKERS.get(tuple(parts[0:2]))
+    if doctype is None and parts[0:2] == [
+            CollectorOutSubdirectory.RELAY_DESCRIPTORS.value,
+            CollectorOutRelayDescsMarker.MICRODESC.value] and \
+            len(parts) > 4 and parts[4] == "consensus-microdesc":
+        doctype = MICRODESC_CONSENSUS
+    if doctype is None:
+        return None
+    timestamp = _status_timestamp(doctype, parts[-1])
+    if timestamp is None:
+        return None
+    return doctype, timestamp
+
+
+def _month_of(timestamp):
+    return f"{timestamp:%Y-%m}"
+
+
+def _walk_subtree(archive_path, subtree):
+    """
+    Walks a single subtree of the archive, returning (doctype, timestamp,
+    size) tuples for each document found.
+    """
+    documents = []
+    for dirpath, _, filenames in os.walk(os.path.join(archive_path, subtree)):
+        for filename in filenames:
+            if filename.startswith("."):
+                continue
+            fullpath = os.path.join(dirpath, filename)
+            relpath = os.path.relpath(fullpath, archive_path)
+            classified = classify_path(relpath)
+            if classified is not None:
+                doctype, _, timestamp = classified
+                if doctype not in [MICRODESCRIPTOR, VOTE, BANDWIDTH_FILE]:
+                    timestamp = _published_from_content(fullpath) or timestamp
+            else:
+                classified = classify_catalog_path(relpath)
+                if classified is None:
+                    continue
+                doctype, timestamp = classified
+            documents.append((doctype, timestamp, os.path.getsize(fullpath)))
+    return documents
+
+
+class ArchiveCatalog:
+    """
+    Persistent per-type, per-month statistics for the documents in an
+    archive.
+
+    All methods perform blocking I/O, although queries are fast enough to be
+    performed directly from an :py:mod:`asyncio` event loop. The database is
+    only created when the first document is added, so that read-only
+    archives are not modified.
+
+    :param str catalog_path: Path to the SQLite database file.
+    """
+
+    def __init__(self, catalog_path):
+        self.catalog_path = catalog_path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self, create):
+        if self._connection is None:
+            if not create and not os.path.exists(self.catalog_path):
+                return None
+            os.makedirs(os.path.dirname(self.catalog_path), exist_ok=True)
+            connection = sqlite3.connect(self.catalog_path,
+                                         check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS catalog ("
+                               "doctype TEXT NOT NULL, "
+                               "month TEXT NOT NULL, "
+                               "count INTEGER NOT NULL, "
+                               "size INTEGER NOT NULL, "
+                               "first TIMESTAMP, "
+                               "last TIMESTAMP, "
+                               "PRIMARY KEY (doctype, month))")
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def close(self):
+        """
+        Closes the connection to the database, if open.
+        """
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def add_many(self, documents):
+        """
+        Records documents that have been added to the archive, in a single
+        transaction.
+
+        :param list documents: (doctype, timestamp, size) tuples for each
+                               document.
+        """
+        totals = {}
+        for doctype, timestamp, size in documents:
+            key = (doctype, _month_of(timestamp))
+            count, total, first, last = totals.get(key, (0, 0, timestamp,
+                                                          timestamp))
+            totals[key] = (count + 1, total + size, min(first, timestamp),
+                           max(last, timestamp))
+        if not totals:
+            return
+        with self._lock:
+            connection = self._connect(create=True)
+            with connection:
+                connection.executemany(
+                    "INSERT INTO catalog VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (doctype, month) DO UPDATE SET "
+                    "count = count + excluded.count, "
+                    "size = size + excluded.size, "
+                    "first = min(first, excluded.first), "
+                    "last = max(last, excluded.last)",
+                    [(doctype, month, count, total, first.isoformat(" "),
+                      last.isoformat(" "))
+                     for (doctype, month), (count, total, first, last)
+                     in totals.items()])
+
+    def remove_many(self, documents):
+        """
+        Records documents that have been removed from the archive, in a
+        single transaction. The first and last timestamps are not changed, as
+        the timestamps of the remaining documents are not known.
+
+        :param list documents: (doctype, timestamp, size) tuples for each
+                               document.
+        """
+        totals = collections.Counter()
+        sizes = collections.Counter()
+        for doctype, timestamp, size in documents:
+            totals[(doctype, _month_of(timestamp))] += 1
+            sizes[(doctype, _month_of(timestamp))] += size
+        if not totals:
+            return
+        with self._lock:
+            connection = self._connect(create=False)
+            if connection is None:
+                return
+            with connection:
+                connection.executemany(
+                    "UPDATE catalog SET count = max(count - ?, 0), "
+                    "size = max(size - ?, 0) WHERE doctype = ? AND month = ?",
+                    [(count, sizes[key], key[0], key[1])
+                     for key, count in totals.items()])
+                connection.execute("DELETE FROM catalog WHERE count = 0")
+
+    def entries(self, doctype=None, month=None):
+        """
+        Queries the catalog.
+
+        :param str doctype: Only include this type of document.
+        :param ~datetime.datetime month: Only include the month containing
+                                         this time.
+
+        :returns: A :py:class:`list` of :py:class:`CatalogEntry`, ordered by
+                  type and then month.
+        """
+        conditions, parameters = [], []
+        if doctype is not None:
+            conditions.append("doctype = ?")
+            parameters.append(doctype)
+        if month is not None:
+            conditions.append("month = ?")
+            parameters.append(_month_of(month))
+        query = "SELECT * FROM catalog"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY doctype, month"
+        with self._lock:
+            connection = self._connect(create=False)
+            if connection is None:
+                return []
+            rows = connection.execute(query, parameters).fetchall()
+        return [
+            CatalogEntry(row[0], datetime.datetime.strptime(row[1], "%Y-%m"),
+                         row[2], row[3],
+                         datetime.datetime.fromisoformat(row[4])
+                         if row[4] else None,
+                         datetime.datetime.fromisoformat(row[5])
+                         if row[5] else None)
+            for row in rows
+        ]
+
+    def latest(self, doctype):
+        """
+        The latest timestamp of any document of a type, for example to check
+        that the archive is being kept up to date.
+
+        :param str doctype: The type of document.
+
+        :returns: A :py:class:`~datetime.datetime`, or *None* if there are no
+                  documents of that type.
+        """
+        with self._lock:
+            connection = self._connect(create=False)
+            if connection is None:
+                return None
+            row = connection.execute(
+                "SELECT max(last) FROM catalog WHERE doctype = ?",
+                (doctype, )).fetchone()
+        return datetime.datetime.fromisoformat(row[0]) if row[0] else None
+
+    def rebuild(self, archive_path, max_workers=None, extra=None):
+        """
+        Rebuilds the catalog by walking the archive. Each month of each type
+        of document is walked in parallel using a thread pool.
+
+        :param str archive_path: The root of the archive, or a
+                                 :py:class:`list` of the roots of a sharded
+                                 archive.
+        :param int max_workers: The maximum number of threads to use for the
+                                walk.
+        :param extra: An iterable of further (doctype, timestamp, size)
+                      tuples for documents not stored as plain files, such as
+                      those in packs.
+
+        :returns: The number of documents cataloged as an :py:class:`int`.
+        """
+        roots = [archive_path] if isinstance(archive_path, str) \
+            else archive_path
+        subtrees = [(root, subtree) for root in roots
+                    for subtree in _month_subtrees(root)]
+        with self._lock:
+            connection = self._connect(create=True)
+            with connection:
+                connection.execute("DELETE FROM catalog")
+        count = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            for documents in executor.map(
+                    lambda subtree: _walk_subtree(*subtree), subtrees):
+                self.add_many(documents)
+                count += len(documents)
+        if extra is not None:
+            documents = list(extra)
+            self.add_many(documents)
+            count += len(documents)
+        LOG.info("Rebuilt catalog of %d documents", count)
+        return count
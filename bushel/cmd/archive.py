@@ -0,0 +1,248 @@
+import argparse
+import datetime
+import sys
+
+from bushel import PluggableCommand
+from bushel.archive import DirectoryArchive
+from bushel.compression import ArchiveCompression
+from bushel.export import TARBALL_KINDS
+from bushel.export import export_month
+from bushel.export import tarball_name
+from bushel.fsck import check_archive
+from bushel.ingest import import_tarball
+from bushel.retention import EXPIRABLE_DOCTYPES
+from bushel.retention import RetentionPolicy
+from bushel.retention import apply_retention
+
+def cmd_archive(args):
+    sys.stdout.buffer.write(b"not implemented")
+
+async def cmd_rebalance(args):
+    archive = DirectoryArchive(args.roots)
+    moved = await archive.rebalance(dry_run=args.dry_run)
+    print(f"{'Would move' if args.dry_run else 'Moved'} {moved['moved']} "
+          f"documents ({moved['bytes']} bytes)")
+
+async def cmd_import(args):
+    archive = DirectoryArchive(args.archive_path or ["."])
+    for tarball_path in args.tarballs:
+        stats = await import_tarball(archive, tarball_path)
+        print(f"{tarball_path}: {stats['documents']} documents, "
+              f"{stats['unrecognized']} unrecognized, "
+              f"{stats['mb_per_second']:.1f} MB/s, "
+              f"{stats['documents_per_second']:.0f} documents/s")
+
+async def cmd_export(args):
+    archive = DirectoryArchive(args.archive_path or ["."])
+    month = datetime.datetime.strptime(args.month, "%Y-%m")
+    compression = ArchiveCompression[args.compression.upper()]
+    for kind in args.kind or TARBALL_KINDS:
+        output_path = tarball_name(kind, month, compression)
+        stats = await export_month(archive, kind, month, output_path,
+                                   compression, workers=args.threads)
+        print(f"{output_path}: {stats['documents']} documents, "
+              f"{stats['bytes']} bytes, {stats['compressed_bytes']} bytes "
+              "compressed")
+
+async def cmd_fsck(args):
+    archive = DirectoryArchive(args.archive_path or ["."])
+    stats = await check_archive(archive, quarantine=not args.no_quarantine,
+                                parse=args.parse, max_workers=args.threads,
+                                max_units=args.max_units,
+                                restart=args.restart)
+    print(f"Checked {stats['checked']} documents ({stats['bytes']} bytes), "
+          f"{stats['bad']} damaged, {stats['quarantined']} quarantined")
+    if stats["remaining_units"]:
+        print(f"{stats['remaining_units']} units remaining, run again to "
+              "resume")
+    if stats["bad"]:
+        sys.exit(1)
+
+async def cmd_stats(args):
+    archive = DirectoryArchive(args.archive_path or ["."])
+    if args.rebuild:
+        await archive.rebuild_catalog(max_workers=args.threads)
+    month = datetime.datetime.strptime(args.month, "%Y-%m") \
+        if args.month else None
+    for entry in archive.catalog.entries(args.doctype, month):
+        print(f"{entry.doctype:<38} {entry.month:%Y-%m} {entry.count:>9} "
+              f"{entry.size:>14} {entry.first:%Y-%m-%d %H:%M} "
+              f"{entry.last:%Y-%m-%d %H:%M}")
+
+def expire_rule(value):
+    doctype, _, months = value.partition("=")
+    if doctype not in EXPIRABLE_DOCTYPES or not months.isdigit():
+        raise argparse.ArgumentTypeError(
+            f"expected DOCTYPE=MONTHS with DOCTYPE one of "
+            f"{', '.join(EXPIRABLE_DOCTYPES)}")
+    return doctype, int(months)
+
+async def cmd_retention(args):
+    archive = DirectoryArchive(args.archive_path or ["."])
+    policy = RetentionPolicy(expire=dict(args.expire or []),
+                             compact_after=args.compact_after)
+    report = await apply_retention(archive, policy, dry_run=args.dry_run)
+    print(f"{'Would expire' if args.dry_run else 'Expired'} "
+          f"{report['expired']} documents ({report['expired_bytes']} bytes)")
+    print(f"{'Would compact' if args.dry_run else 'Compacted'} "
+          f"{report['compacted']} documents ({report['compacted_bytes']} "
+          f"bytes) and pack {report['packed']} descriptors")
+    print(f"{'Would reclaim' if args.dry_run else 'Reclaimed'} "
+          f"{report['reclaimed_bytes']} bytes")
+
+
+async def cmd_address(args):
+    archive = DirectoryArchive(args.archive_path or ["."])
+    start = args.at or args.start
+    end = None if args.at else args.end
+    if start is None:
+        sys.exit("Either --at or --start is required")
+    if args.rebuild:
+        if args.start is None or args.end is None:
+            sys.exit("--rebuild requires --start and --end")
+        await archive.rebuild_address_index(args.start, args.end)
+    if "/" in args.address:
+        intervals = archive.address_index.lookup_network(args.address, start,
+                                                         end)
+    else:
+        intervals = archive.address_index.lookup(args.address, start, end)
+    for interval in intervals:
+        print(f"{interval.address:<39} {interval.fingerprint} "
+              f"{interval.start:%Y-%m-%d %H:%M} "
+              f"{interval.end:%Y-%m-%d %H:%M}")
+    if not intervals:
+        print(f"{args.address} was not a relay address at that time")
+        sys.exit(1)
+
+
+class ArchiveCommand(PluggableCommand):
+    @staticmethod
+    def register_subparser(subparsers):
+        parser_archive = subparsers.add_parser(
+            "archive", help="Directory archive maintenance commands")
+        archive_subparsers = parser_archive.add_subparsers(help="Subcommands")
+        parser_archive.set_defaults(func=cmd_archive)
+
+        parser_rebalance = archive_subparsers.add_parser(
+            "rebalance",
+            help="Move documents to their shards after adding a root")
+        parser_rebalance.add_argument(
+            "roots", metavar="ROOT", nargs="+",
+            help="Roots of the sharded archive, with the first root first")
+        parser_rebalance.add_argument(
+            "--dry-run", action="store_true",
+            help="Only report the documents that would be moved")
+        parser_rebalance.set_defaults(coro=cmd_rebalance, func=None)
+
+        parser_import = archive_subparsers.add_parser(
+            "import", help="Import CollecTor tarballs into the archive")
+        parser_import.add_argument("tarballs", metavar="TARBALL", nargs="+",
+                                   help="CollecTor tarballs to import")
+        parser_import.add_argument(
+            "--archive-path", action="append",
+            help=("Path to the archive, given once for each root of a "
+                  "sharded archive"))
+        parser_import.set_defaults(coro=cmd_import, func=None)
+
+        parser_export = archive_subparsers.add_parser(
+            "export", help="Export a month as CollecTor tarballs")
+        parser_export.add_argument("--month", metavar="YYYY-MM",
+                                   required=True, help="Month to export")
+        parser_export.add_argument(
+            "--kind", action="append", choices=list(TARBALL_KINDS),
+            help="Kind of tarball to export, defaults to all kinds")
+        parser_export.add_argument("--compression", default="xz",
+                                   choices=["xz", "zstd"],
+                                   help="Compression for the tarballs")
+        parser_export.add_argument("--threads", type=int,
+                                   help="Number of compression threads")
+        parser_export.add_argument(
+            "--archive-path", action="append",
+            help=("Path to the archive, given once for each root of a "
+                  "sharded archive"))
+        parser_export.set_defaults(coro=cmd_export, func=None)
+
+        parser_fsck = archive_subparsers.add_parser(
+            "fsck", help="Verify the digests of documents in the archive")
+        parser_fsck.add_argument(
+            "--no-quarantine", action="store_true",
+            help="Only report damaged documents, leaving them in place")
+        parser_fsck.add_argument("--parse", action="store_true",
+                                 help="Also parse every document with stem")
+        parser_fsck.add_argument("--threads", type=int,
+                                 help="Number of scanning threads")
+        parser_fsck.add_argument(
+            "--max-units", type=int,
+            help=("Stop after this many units of work, resuming on the next "
+                  "run"))
+        parser_fsck.add_argument(
+            "--restart", action="store_true",
+            help="Ignore the checkpoint of an earlier scan and start again")
+        parser_fsck.add_argument(
+            "--archive-path", action="append",
+            help=("Path to the archive, given once for each root of a "
+                  "sharded archive"))
+        parser_fsck.set_defaults(coro=cmd_fsck, func=None)
+
+        parser_stats = archive_subparsers.add_parser(
+            "stats",
+            help="Show document counts and sizes by type and month")
+        parser_stats.add_argument("--doctype",
+                                  help="Only show this type of document")
+        parser_stats.add_argument("--month", metavar="YYYY-MM",
+                                  help="Only show this month")
+        parser_stats.add_argument(
+            "--rebuild", action="store_true",
+            help="Rebuild the catalog by walking the archive first")
+        parser_stats.add_argument("--threads", type=int,
+                                  help="Number of threads for a rebuild")
+        parser_stats.add_argument(
+            "--archive-path", action="append",
+            help=("Path to the archive, given once for each root of a "
+                  "sharded archive"))
+        parser_stats.set_defaults(coro=cmd_stats, func=None)
+
+        parser_retention = archive_subparsers.add_parser(
+            "retention",
+            help="Expire unreferenced documents and compact old months")
+        parser_retention.add_argument(
+            "--expire", metavar="DOCTYPE=MONTHS", action="append",
+            type=expire_rule,
+            help=("Expire documents of a type not referenced by a consensus "
+                  "in this many months"))
+        parser_retention.add_argument(
+            "--compact-after", metavar="MONTHS", type=int,
+            help="Compact months older than this many months")
+        parser_retention.add_argument(
+            "--dry-run", action="store_true",
+            help="Only report what would be expired and compacted")
+        parser_retention.add_argument(
+            "--archive-path", action="append",
+            help=("Path to the archive, given once for each root of a "
+                  "sharded archive"))
+        parser_retention.set_defaults(coro=cmd_retention, func=None)
+
+        parser_address = archive_subparsers.add_parser(
+            "address",
+            help="Find the relays that used an address or network")
+        parser_address.add_argument(
+            "address", metavar="ADDRESS",
+            help="IPv4 or IPv6 address, or a network such as 198.51.100.0/24")
+        parser_address.add_argument(
+            "--at", metavar="TIME", type=datetime.datetime.fromisoformat,
+            help="Time to check, such as \"2018-11-19 15:30\"")
+        parser_address.add_argument(
+            "--start", metavar="TIME", type=datetime.datetime.fromisoformat,
+            help="Start of a period to check")
+        parser_address.add_argument(
+            "--end", metavar="TIME", type=datetime.datetime.fromisoformat,
+            help="End of a period to check")
+        parser_address.add_argument(
+            "--rebuild", action="store_true",
+            help=("Rebuild the address index from the consensuses between "
+                  "--start and --end first"))
+        parser_address.add_argument(
+            "--archive-path", action="append",
+            help=("Path to the archive, given once for each root of a "
+                  "sharded archive"))
+        parser_address.set_defaults(coro=cmd_address, func=None)
@@ -96,12 +96,14 @@ class CollectorOutRelayDescsMarker(enum.Enum):
     ======================= ===========
     Name                    Description
     ======================= ===========
+    BANDWIDTHS              Bandwidth files
     CONSENSUS               Network status consensuses (§5.3.2)
     EXTRA_INFO              Relay extra-info descriptors (§5.3.2)
     SERVER_DESCRIPTOR       Relay server descriptors (§5.3.2)
     VOTE                    Network status votes (§5.3.2)
     ======================= ===========
     """
+    BANDWIDTHS = 'bandwidths'
     CONSENSUS = 'consensus'
     EXTRA_INFO = 'extra-info'
     MICRODESC = 'microdesc'
@@ -0,0 +1,230 @@
+"""
+At-rest compression for documents in a
+:py:class:`~bushel.archive.DirectoryArchive`.
+
+Network status documents and bandwidth files are large and compress well, so
+the archive can optionally store them compressed. Compressed files are stored
+at the usual path with a filename extension added, and the extension is used
+to determine how to decompress the file when it is read. As paths in the
+CollecTor File Structure Protocol never contain a "." in the filename, this
+does not introduce any ambiguity.
+
+zstd compression is only available if the optional :py:mod:`zstandard`
+module is installed. :py:func:`preferred_compression` can be used to choose
+the best available algorithm.
+"""
+
+import enum
+import gzip
+import lzma
+import mmap
+import os
+import os.path
+
+from bushel.collector.filesystem import CollecTorIndexCompression
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def _zstd_compress(data):
+    if zstandard is None:
+        raise RuntimeError("zstd compression requires the zstandard module")
+    return zstandard.ZstdCompressor().compress(data)
+
+
+def _zstd_decompress(data):
+    if zstandard is None:
+        raise RuntimeError("zstd decompression requires the zstandard module")
+    return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+
+def _identity(data):
+    return data
+
+
+class ArchiveCompression(enum.Enum):
+    """
+    Enumeration of supported compression algorithms for archived documents.
+    Decompression for xz and gzip reuses :class:`CollecTorIndexCompression`.
+
+    ======================= ===========
+    Name                    Description
+    ======================= ===========
+    UNCOMPRESSED            Uncompressed
+    GZ                      gzip
+    XZ                      xz
+    ZSTD                    zstd (requires :py:mod:`zstandard`)
+    ======================= ===========
+
+    :var str extension: Filename extension with leading dot (".").
+    """
+    UNCOMPRESSED = ("", _identity, _identity)
+    GZ = (".gz", gzip.compress, CollecTorIndexCompression.GZ.decompress)
+    XZ = (".xz", lzma.compress, CollecTorIndexCompression.XZ.decompress)
+    ZSTD = (".zst", _zstd_compress, _zstd_decompress)
+
+    def __init__(self, extension, compress, decompress):
+        self.extension = extension
+        self.compress = compress
+        self.decompress = decompress
+
+    @property
+    def available(self):
+        """
+        *False* if this algorithm requires an optional module that is not
+        installed.
+        """
+        return self is not ArchiveCompression.ZSTD or zstandard is not None
+
+
+def preferred_compression():
+    """
+    The best available compression algorithm, zstd if :py:mod:`zstandard` is
+    installed and xz otherwise.
+
+    :rtype: ArchiveCompression
+    """
+    if ArchiveCompression.ZSTD.available:
+        return ArchiveCompression.ZSTD
+    return ArchiveCompression.XZ
+
+
+def compression_for_path(path):
+    """
+    Determines the compression used for a file from its filename extension.
+    For example:
+
+    >>> compression_for_path("relay-descriptors/consensus/2018/11/19/"
+    ...                      "2018-11-19-15-00-00-consensus.xz").name
+    'XZ'
+    >>> compression_for_path("relay-descriptors/consensus/2018/11/19/"
+    ...                      "2018-11-19-15-00-00-consensus").name
+    'UNCOMPRESSED'
+
+    :param str path: The path of the file.
+
+    :rtype: ArchiveCompression
+    """
+    extension = os.path.splitext(path)[1]
+    for compression in ArchiveCompression:
+        if compression.extension and compression.extension == extension:
+            return compression
+    return ArchiveCompression.UNCOMPRESSED
+
+
+def strip_compression_extension(path):
+    """
+    Removes any compression extension from a path. For example:
+
+    >>> strip_compression_extension("2018-11-19-15-00-00-consensus.zst")
+    '2018-11-19-15-00-00-consensus'
+
+    :param str path: The path of the file.
+
+    :returns: The path without the extension as a :py:class:`str`.
+    """
+    extension = compression_for_path(path).extension
+    if extension:
+        return path[:-len(extension)]
+    return path
+
+
+def _candidates(path, preferred):
+    if compression_for_path(path) is not ArchiveCompression.UNCOMPRESSED:
+        return [path]
+    return [path + preferred.extension] + [
+        path + compression.extension for compression in ArchiveCompression
+        if compression is not preferred and compression.available
+    ]
+
+
+def find_archived(path, preferred=ArchiveCompression.UNCOMPRESSED):
+    """
+    Finds which variant of a path exists in the archive. This performs
+    blocking I/O.
+
+    :param str path: The path of the document, with or without a compression
+                     extension.
+    :param ArchiveCompression preferred: The variant to try first.
+
+    :returns: A (path, :py:class:`os.stat_result`) :py:class:`tuple` for the
+              variant that exists, or *None* if no variant exists.
+    """
+    for candidate in _candidates(path, preferred):
+        try:
+            return candidate, os.stat(candidate)
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def _map_file(source):
+    mapped = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+    # The memoryview keeps the mapping alive, it is unmapped when the last
+    # reference to the view (e.g. from a parsed document) is released.
+    return memoryview(mapped)
+
+
+def read_archived(path, preferred=ArchiveCompression.UNCOMPRESSED,
+                  mmap_threshold=None):
+    """
+    Reads a document from the archive, trying each compressed variant of the
+    path in turn and decompressing if required. This performs blocking I/O.
+
+    Uncompressed files at least *mmap_threshold* bytes long are memory-mapped
+    instead of being read, and a read-only :py:class:`memoryview` of the
+    mapping is returned. This avoids copying large documents, such as votes,
+    into memory before parsing.
+
+    :param str path: The path of the document, with or without a compression
+                     extension.
+    :param ArchiveCompression preferred: The variant to try first, normally
+                                         the compression used when writing.
+    :param int mmap_threshold: The minimum size of a file to memory-map, or
+                               *None* to never memory-map files.
+
+    :returns: The decompressed :py:class:`bytes` (or :py:class:`memoryview`),
+              or *None* if no variant of the file exists.
+    """
+    for candidate in _candidates(path, preferred):
+        compression = compression_for_path(candidate)
+        try:
+            with open(candidate, 'rb') as source:
+                if compression is ArchiveCompression.UNCOMPRESSED and \
+                      mmap_threshold is not None and \
+                      os.fstat(source.fileno()).st_size >= max(mmap_threshold, 1):
+                    return _map_file(source)
+                raw_content = source.read()
+        except FileNotFoundError:
+            continue
+        return compression.decompress(raw_content)
+    return None
+
+
+def open_compressed(path):
+    """
+    Opens a file for streaming reads, decompressing it according to its
+    filename extension. Files made of several concatenated xz streams, gzip
+    members or zstd frames (such as those written by
+    :py:class:`~bushel.export.BlockCompressingWriter`) are read as a single
+    file. Files without a known extension are opened unchanged.
+
+    :param str path: The path of the file.
+
+    :returns: A binary file object.
+    """
+    compression = compression_for_path(path)
+    if compression is ArchiveCompression.XZ:
+        return lzma.open(path, 'rb')
+    if compression is ArchiveCompression.GZ:
+        return gzip.open(path, 'rb')
+    if compression is ArchiveCompression.ZSTD:
+        if zstandard is None:
+            raise RuntimeError(
+                "zstd decompression requires the zstandard module")
+        return zstandard.ZstdDecompressor().stream_reader(
+            open(path, 'rb'), read_across_frames=True, closefd=True)
+    return open(path, 'rb')
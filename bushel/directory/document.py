@@ -520,7 +520,10 @@ class DirectoryDocument(BaseDocument):
             item->object [label="has zero or more"];
         }
 
-    :param bytes raw_content: raw document contents
+    :param bytes raw_content: raw document contents, either as
+                              :py:class:`bytes` or as a
+                              :py:class:`memoryview` (e.g. of a
+                              memory-mapped file)
     """
 
     def __init__(self, raw_content):
@@ -590,7 +593,7 @@ class DirectoryDocument(BaseDocument):
             '(?P<%s>%s)' % pair for pair in token_specification)
         line_num = 1
         line_start = 0
-        for mo in re.finditer(tok_regex, self.raw_content.decode('utf-8')):
+        for mo in re.finditer(tok_regex, str(self.raw_content, 'utf-8')):
             kind = mo.lastgroup
             value = mo.group()
             column = mo.start() - line_start
@@ -7,4 +7,4 @@ class BaseDocument:
         return self.raw_content
 
     def __str__(self):
-        return self.raw_content.decode('utf-8')
+        return str(self.raw_content, 'utf-8')
@@ -0,0 +1,283 @@
+"""
+Export of a month of a :py:class:`~bushel.archive.DirectoryArchive` as a
+CollecTor-compatible tarball, such as ``server-descriptors-2018-11.tar.xz``.
+
+The archive is walked one directory at a time in sorted order, and members
+are streamed into a tar writer, so memory use does not depend on the size of
+the month. Documents stored compressed in the archive are exported
+uncompressed under their usual name.
+
+The tar stream is cut into fixed-size blocks that are compressed in parallel
+by a pool of threads (both :py:mod:`lzma` and :py:mod:`zstandard` release the
+GIL while compressing). Each block becomes an independent xz stream or zstd
+frame, and these are written in order. Decompressors (including ``xz``,
+``zstd`` and :py:func:`~bushel.compression.open_compressed`) treat
+concatenated streams or frames as a single file.
+
+The output is byte-reproducible: members are written in sorted order with
+fixed ownership, permissions and modification times, and block boundaries
+depend only on the content. Exporting the same month of the same archive
+twice gives identical files.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import datetime
+import io
+import os
+import os.path
+import tarfile
+
+from bushel.collector.filesystem import CollectorOutRelayDescsMarker
+from bushel.collector.filesystem import CollectorOutSubdirectory
+from bushel.compression import ArchiveCompression
+from bushel.compression import compression_for_path
+from bushel.compression import strip_compression_extension
+
+EXPORT_BLOCK_SIZE = 8 * 1024 * 1024
+
+TARBALL_KINDS = {
+    "server-descriptors": [
+        (CollectorOutRelayDescsMarker.SERVER_DESCRIPTOR, None)],
+    "extra-infos": [(CollectorOutRelayDescsMarker.EXTRA_INFO, None)],
+    "microdescs": [(CollectorOutRelayDescsMarker.MICRODESC,
+                    "consensus-microdesc"),
+                   (CollectorOutRelayDescsMarker.MICRODESC, "micro")],
+    "consensuses": [(CollectorOutRelayDescsMarker.CONSENSUS, None)],
+    "votes": [(CollectorOutRelayDescsMarker.VOTE, None)],
+    "bandwidths": [(CollectorOutRelayDescsMarker.BANDWIDTHS, None)],
+}
+"""
+The kinds of monthly tarball that can be exported, mapped to the directories
+of the archive that they contain.
+"""
+
+
+def tarball_name(kind, month, compression=ArchiveCompression.XZ):
+    """
+    The CollecTor filename for a monthly tarball. For example:
+
+    >>> tarball_name("server-descriptors", datetime.datetime(2018, 11, 1))
+    'server-descriptors-2018-11.tar.xz'
+
+    :param str kind: One of the keys of :py:data:`TARBALL_KINDS`.
+    :param ~datetime.datetime month: A time within the month.
+    :param ~bushel.compression.ArchiveCompression compression: The
+        compression of the tarball.
+
+    :returns: Filename as a :py:class:`str`.
+    """
+    return f"{kind}-{month:%Y-%m}.tar{compression.extension}"
+
+
+class BlockCompressingWriter:
+    """
+    A write-only file object that compresses in fixed-size blocks using a pool
+    of threads, writing the compressed blocks in order. At most two blocks
+    per thread are held in memory.
+
+    :param fileobj: The file object to write compressed blocks to.
+    :param ~bushel.compression.ArchiveCompression compression: The
+        compression for each block.
+    :param int block_size: The size of each uncompressed block in bytes.
+    :param int workers: The number of compression threads, defaults to the
+                        number of CPUs.
+    """
+
+    def __init__(self, fileobj, compression, block_size=EXPORT_BLOCK_SIZE,
+                 workers=None):
+        self.fileobj = fileobj
+        self.compression = compression
+        self.block_size = block_size
+        self.workers = workers or os.cpu_count() or 1
+        self._executor = concurrent.futures.ThreadPoolExecutor(self.workers)
+        self._pending = collections.deque()
+        self._buffer = bytearray()
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def _drain(self, keep):
+        while len(self._pending) > keep:
+            block = self._pending.popleft().result()
+            self.fileobj.write(block)
+            self.bytes_out += len(block)
+
+    def _submit(self, block):
+        self._pending.append(
+            self._executor.submit(self.compression.compress, bytes(block)))
+        self._drain(2 * self.workers)
+
+    def write(self, data):
+        self._buffer += data
+        self.bytes_in += len(data)
+        while len(self._buffer) >= self.block_size:
+            self._submit(self._buffer[:self.block_size])
+            del self._buffer[:self.block_size]
+        return len(data)
+
+    def close(self):
+        """
+        Compresses and writes any remaining data. The underlying file object
+        is not closed.
+        """
+        if self._buffer:
+            self._submit(self._buffer)
+            self._buffer = bytearray()
+        self._drain(0)
+        self.shutdown()
+
+    def shutdown(self):
+        """
+        Stops the compression threads, discarding any data that has not been
+        written. This is safe to call after :py:meth:`close`.
+        """
+        self._executor.shutdown()
+        self._pending.clear()
+        self._buffer = bytearray()
+
+
+def _list_roots(archive, relative):
+    """
+    Lists a directory of the archive across every root, so that a directory
+    that has not yet been rebalanced is still exported completely.
+
+    A document can be found under more than one name, such as both ``X`` and
+    ``X.xz`` part way through compaction or after the compression setting
+    was changed, or in more than one root. Only one copy is listed: the one
+    in the first root, preferring the uncompressed copy within a root.
+
+    :returns: A :py:class:`list` of (name, path, is directory) tuples,
+              sorted by name, where the names of documents have any
+              compression extension removed.
+    """
+    entries = {}
+    for root in archive.shards.roots:
+        try:
+            with os.scandir(os.path.join(root, relative)) as scanned:
+                scanned = sorted(scanned, key=lambda entry: entry.name)
+        except FileNotFoundError:
+            continue
+        for entry in scanned:
+            if entry.name.startswith("."):
+                continue
+            is_dir = entry.is_dir()
+            name = entry.name if is_dir else strip_compression_extension(
+                entry.name)
+            if name not in entries:
+                entries[name] = (entry.path, is_dir)
+    return [(name, ) + entries[name] for name in sorted(entries)]
+
+
+def _walk_sorted(archive, relative, member_prefix):
+    """
+    Walks a directory of the archive depth-first in sorted order.
+
+    :returns: An iterator of (member name, path) tuples.
+    """
+    for name, path, is_dir in _list_roots(archive, relative):
+        if is_dir:
+            yield from _walk_sorted(archive, os.path.join(relative, name),
+                                    f"{member_prefix}/{name}")
+        else:
+            yield f"{member_prefix}/{name}", path
+
+
+def month_members(archive, kind, month):
+    """
+    Lists the members of a monthly tarball in order, without reading them.
+
+    :param ~bushel.archive.DirectoryArchive archive: The archive.
+    :param str kind: One of the keys of :py:data:`TARBALL_KINDS`.
+    :param ~datetime.datetime month: A time within the month.
+
+    :returns: An iterator of (member name, path) tuples.
+    """
+    top = f"{kind}-{month:%Y-%m}"
+    for marker, subdirectory in TARBALL_KINDS[kind]:
+        relative = os.path.join(
+            CollectorOutSubdirectory.RELAY_DESCRIPTORS.value, marker.value,
+            f"{month:%Y}", f"{month:%m}")
+        prefix = top
+        if subdirectory:
+            relative = os.path.join(relative, subdirectory)
+            prefix = f"{top}/{subdirectory}"
+        yield from _walk_sorted(archive, relative, prefix)
+
+
+def _tar_info(name, size, mtime):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = mtime
+    info.mode = 0o644
+    info.uid = info.gid = 0
+    info.uname = info.gname = ""
+    return info
+
+
+def _export_month(archive, kind, month, output_path, compression,
+                  block_size, workers):
+    if compression is ArchiveCompression.GZ:
+        # gzip headers include a timestamp
+        raise ValueError("gzip compressed exports are not reproducible")
+    if not compression.available:
+        raise ValueError(f"Compression {compression.name} is not available")
+    month = datetime.datetime(month.year, month.month, 1)
+    mtime = int(month.replace(tzinfo=datetime.timezone.utc).timestamp())
+    count = 0
+    temporary_path = output_path + ".tmp"
+    writer = None
+    try:
+        with open(temporary_path, 'wb') as output:
+            writer = BlockCompressingWriter(output, compression, block_size,
+                                            workers)
+            with tarfile.open(fileobj=writer, mode="w|",
+                              format=tarfile.GNU_FORMAT) as tarball:
+                for name, path in month_members(archive, kind, month):
+                    with open(path, 'rb') as member:
+                        content = compression_for_path(path).decompress(
+                            member.read())
+                    tarball.addfile(_tar_info(name, len(content), mtime),
+                                    fileobj=io.BytesIO(content))
+                    count += 1
+            writer.close()
+        os.replace(temporary_path, output_path)
+    finally:
+        if writer is not None:
+            writer.shutdown()
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+    return {
+        "documents": count,
+        "bytes": writer.bytes_in,
+        "compressed_bytes": writer.bytes_out,
+    }
+
+
+async def export_month(archive, kind, month, output_path,
+                       compression=ArchiveCompression.XZ,
+                       block_size=EXPORT_BLOCK_SIZE, workers=None):
+    """
+    Exports a month of the archive as a CollecTor-compatible tarball. The
+    tarball is written to a temporary file that is renamed into place once
+    complete.
+
+    :param ~bushel.archive.DirectoryArchive archive: The archive.
+    :param str kind: One of the keys of :py:data:`TARBALL_KINDS`.
+    :param ~datetime.datetime month: A time within the month.
+    :param str output_path: The path to write the tarball to, see
+                            :py:func:`tarball_name`.
+    :param ~bushel.compression.ArchiveCompression compression: Either xz,
+        zstd or uncompressed.
+    :param int block_size: The size of each independently compressed block.
+    :param int workers: The number of compression threads, defaults to the
+                        number of CPUs.
+
+    :returns: A :py:class:`dict` with the number of "documents", and the
+              uncompressed and compressed sizes in "bytes" and
+              "compressed_bytes".
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, _export_month, archive, kind,
+                                      month, output_path, compression,
+                                      block_size, workers)
@@ -0,0 +1,110 @@
+"""
+Factories for the documents used in bushel's tests.
+
+Consensuses are created for hours after :py:data:`START`, each fresh for an
+hour and valid for three, so that consecutive hours form a sequence of
+consensuses as published by the authorities.
+"""
+
+import base64
+import datetime
+
+from stem.descriptor.networkstatus import NetworkStatusDocumentV3
+from stem.descriptor.router_status_entry import RouterStatusEntryV3
+from stem.descriptor.server_descriptor import RelayDescriptor
+
+START = datetime.datetime(2018, 11, 19, 15)
+RELAY = "9695DFC35FFEB861329B9F1AB04C46397020CE31"
+OTHER = "BA44A889E64B93FAA2B114E02C2A279A8555C533"
+
+
+def b64(digest):
+    """
+    Encodes a digest as in a router status entry, without padding.
+
+    >>> b64(bytes(20))
+    'AAAAAAAAAAAAAAAAAAAAAAAAAAA'
+    """
+    return base64.b64encode(digest).rstrip(b"=").decode('ascii')
+
+
+def timestamp(hours):
+    """
+    Formats a time a number of hours after :py:data:`START`.
+
+    >>> timestamp(2)
+    '2018-11-19 17:00:00'
+    """
+    return f"{START + datetime.timedelta(hours=hours):%Y-%m-%d %H:%M:%S}"
+
+
+def relay_descriptors(count, **fields):
+    """
+    Creates server descriptors for distinct relays named "test0", "test1"
+    and so on.
+
+    :param int count: The number of descriptors.
+    :param fields: Additional fields for every descriptor, with underscores
+                   in place of dashes, such as *published*.
+
+    :returns: A :py:class:`list` of
+              :py:class:`~stem.descriptor.server_descriptor.RelayDescriptor`.
+    """
+    fields = {key.replace("_", "-"): value for key, value in fields.items()}
+    return [
+        RelayDescriptor.create({
+            "router": f"test{i} 127.0.0.1 9001 0 0",
+            **fields
+        }) for i in range(count)
+    ]
+
+
+def router(fingerprint, address="127.0.0.1", flags=None, ipv6=None,
+           digest=None, nickname="test"):
+    """
+    Creates a router status entry.
+
+    :param str fingerprint: The hex-encoded fingerprint of the relay.
+    :param str address: The IPv4 address of the relay.
+    :param str flags: The space-separated flags, and a bandwidth weight of
+                      100, if set.
+    :param str ipv6: An IPv6 address for an ``a`` line, if set.
+    :param str digest: The hex-encoded digest of the relay's server
+                       descriptor.
+    :param str nickname: The nickname of the relay.
+
+    :returns: A :py:class:`~stem.descriptor.router_status_entry.RouterStatusEntryV3`.
+    """
+    digest = b64(bytes.fromhex(digest)) if digest else \
+        "p1aag7VwarGxqctS7/fS0y5FU+s"
+    fields = {
+        "r": (f"{nickname} {b64(bytes.fromhex(fingerprint))} {digest} "
+              f"2018-11-19 14:00:00 {address} 9001 0"),
+    }
+    if flags:
+        fields["s"] = flags
+        fields["w"] = "Bandwidth=100"
+    if ipv6:
+        fields["a"] = f"[{ipv6}]:9001"
+    return RouterStatusEntryV3.create(fields)
+
+
+def consensus(hour, routers=(), flavor=None):
+    """
+    Creates a consensus valid after a number of hours after
+    :py:data:`START`.
+
+    :param int hour: The number of hours after :py:data:`START`.
+    :param routers: The router status entries.
+    :param str flavor: The flavor, such as "microdesc", if set.
+
+    :returns: A :py:class:`~stem.descriptor.networkstatus.NetworkStatusDocumentV3`.
+    """
+    fields = {
+        "valid-after": timestamp(hour),
+        "fresh-until": timestamp(hour + 1),
+        "valid-until": timestamp(hour + 3),
+    }
+    if flavor:
+        fields["network-status-version"] = f"3 {flavor}"
+    return NetworkStatusDocumentV3.create(fields, routers=list(routers))
@@ -0,0 +1,375 @@
+"""
+Integrity scanning of a :py:class:`~bushel.archive.DirectoryArchive`.
+
+Most documents in the archive are named by their digest, so damage to a file
+(from a failing disk, a truncated copy or a bug) can be detected by hashing it
+again. The digest is recomputed for each type of document as follows:
+
+========================= ====================================================
+Documents                 Digest
+========================= ====================================================
+Server and extra-info     SHA-1 from the start of the descriptor to the end of
+descriptors               the ``router-signature`` line
+Bridge descriptors        The ``router-digest`` line, as the sanitized
+                          descriptor cannot be hashed to its original digest
+Microdescriptors          SHA-256 of the microdescriptor
+Votes                     SHA-1 up to the end of the ``directory-signature``
+                          keyword
+Bandwidth files           SHA-256 of the bandwidth file
+========================= ====================================================
+
+Annotations are removed before hashing, and documents stored compressed are
+decompressed. Documents that are not named by a digest, such as consensuses,
+are only checked to decompress and to start with a ``@type`` annotation,
+unless full parsing is requested.
+
+The archive is split into work units of a few thousand files, such as one
+``a/9`` directory of server descriptors or one day of consensuses, and the
+units are scanned in parallel by a pool of threads using :py:func:`os.scandir`.
+:py:mod:`hashlib` releases the GIL while hashing, so hashing runs in parallel.
+Each completed unit is appended to a checkpoint file in the archive's state,
+so that a scan over a large archive can be stopped and resumed. For example::
+
+    archive = DirectoryArchive("/srv/archive")
+    stats = await check_archive(archive, max_units=1000)
+
+Damaged files are moved to a quarantine directory in the archive's state,
+keeping their relative path, and are removed from the
+:py:class:`~bushel.index.DigestIndex` so that they can be fetched again.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import hashlib
+import io
+import json
+import logging
+import os
+import os.path
+import shutil
+
+import stem.descriptor
+
+from bushel.compression import compression_for_path
+from bushel.index import BANDWIDTH_FILE
+from bushel.index import BRIDGE_EXTRA_INFO
+from bushel.index import BRIDGE_SERVER_DESCRIPTOR
+from bushel.index import EXTRA_INFO
+from bushel.index import MICRODESCRIPTOR
+from bushel.index import SERVER_DESCRIPTOR
+from bushel.index import VOTE
+from bushel.index import _month_subtrees
+from bushel.index import classify_path
+
+LOG = logging.getLogger('bushel')
+
+CHECKPOINT_NAME = "fsck-checkpoint"
+QUARANTINE_NAME = "quarantine"
+
+_DIGEST_RANGES = {
+    SERVER_DESCRIPTOR: (b"router ", b"\nrouter-signature\n", hashlib.sha1),
+    EXTRA_INFO: (b"extra-info ", b"\nrouter-signature\n", hashlib.sha1),
+    VOTE: (b"network-status-version ", b"\ndirectory-signature ",
+           hashlib.sha1),
+    MICRODESCRIPTOR: (None, None, hashlib.sha256),
+    BANDWIDTH_FILE: (None, None, hashlib.sha256),
+}
+
+
+def strip_annotations(content):
+    """
+    Removes the annotations from the start of a document. For example:
+
+    >>> strip_annotations(b"@type server-descriptor 1.0\\nrouter test")
+    b'router test'
+
+    :param bytes content: The raw document.
+
+    :returns: The document without annotations as :py:class:`bytes`.
+    """
+    start = 0
+    while content.startswith(b"@", start):
+        end = content.find(b"\n", start)
+        if end == -1:
+            return b""
+        start = end + 1
+    return content[start:]
+
+
+def _router_digest(content):
+    start = content.find(b"\nrouter-digest ")
+    if start == -1:
+        return None
+    start += len(b"\nrouter-digest ")
+    end = content.find(b"\n", start)
+    return content[start:end if end != -1 else None].decode(
+        'ascii', 'replace').strip().lower()
+
+
+def document_digest(doctype, content):
+    """
+    Recomputes the digest that names a document in the archive. For example:
+
+    >>> document_digest(MICRODESCRIPTOR, b"@type microdescriptor 1.0\\n"
+    ...                 b"onion-key\\n")
+    '9b06363eee3b270edb14118cf186b6d09fc5fb0b5381e7ea567f09ba17f32f1b'
+
+    :param str doctype: One of :py:data:`bushel.index.INDEXED_DOCTYPES`.
+    :param bytes content: The uncompressed document, with or without
+                          annotations.
+
+    :returns: The lower-case hex-encoded digest as a :py:class:`str`, or
+              *None* if the digest could not be found.
+    """
+    content = strip_annotations(content)
+    if doctype in (BRIDGE_SERVER_DESCRIPTOR, BRIDGE_EXTRA_INFO):
+        return _router_digest(content)
+    start_marker, end_marker, hash_function = _DIGEST_RANGES[doctype]
+    if end_marker is not None:
+        if not content.startswith(start_marker):
+            return None
+        end = content.find(end_marker)
+        if end == -1:
+            return None
+        content = content[:end + len(end_marker)]
+    return hash_function(content).hexdigest()
+
+
+def verify_file(path, relative, parse=False):
+    """
+    Checks a single file in the archive. This performs blocking I/O.
+
+    :param str path: The path of the file.
+    :param str relative: The path of the file relative to its archive root.
+    :param bool parse: Also parse documents with stem.
+
+    :returns: A :py:class:`str` describing the damage, or *None* if the file
+              is intact.
+    """
+    try:
+        with open(path, 'rb') as document:
+            content = compression_for_path(path).decompress(document.read())
+    except Exception as exc:  # pylint: disable=broad-except
+        return f"unreadable: {exc}"
+    if not content.startswith(b"@type "):
+        return "missing type annotation"
+    classified = classify_path(relative)
+    if classified is not None:
+        doctype, digest, _ = classified
+        actual = document_digest(doctype, content)
+        if actual != digest.lower():
+            return f"digest mismatch: {actual}"
+    if parse:
+        try:
+            for _ in stem.descriptor.parse_file(io.BytesIO(content),
+                                                validate=True):
+                pass
+        except Exception as exc:  # pylint: disable=broad-except
+            return f"does not parse: {exc}"
+    return None
+
+
+def work_units(root, depth=2):
+    """
+    Divides an archive root into units of work for a scan. Each month of
+    each type of document is divided further, down to *depth* levels, so
+    that no unit is too large to repeat if a scan is interrupted. This
+    performs blocking I/O.
+
+    :param str root: The archive root.
+    :param int depth: The number of levels below each month to divide.
+
+    :returns: A sorted :py:class:`list` of (relative directory, recursive)
+              tuples. Units that are not recursive only contain the files
+              directly in the directory.
+    """
+    units = []
+
+    def divide(relative, remaining):
+        has_files = False
+        with os.scandir(os.path.join(root, relative)) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    child = os.path.join(relative, entry.name)
+                    if remaining > 1:
+                        divide(child, remaining - 1)
+                    else:
+                        units.append((child, True))
+                elif not entry.name.startswith("."):
+                    has_files = True
+        if has_files:
+            units.append((relative, False))
+
+    for subtree in _month_subtrees(root):
+        divide(subtree, depth)
+    return sorted(units)
+
+
+def _unit_key(root, relative, recursive):
+    return f"{root}:{relative}:{'r' if recursive else 'f'}"
+
+
+def _scan(root, relative, recursive):
+    with os.scandir(os.path.join(root, relative)) as entries:
+        for entry in entries:
+            if entry.name.startswith("."):
+                # Temporary files of an interrupted write
+                continue
+            if entry.is_dir():
+                if recursive:
+                    yield from _scan(root, os.path.join(relative, entry.name),
+                                     True)
+            else:
+                yield entry.path, os.path.join(relative, entry.name)
+
+
+class ArchiveChecker:
+    """
+    Scans an archive for damaged documents, see :py:func:`check_archive`.
+
+    :param ~bushel.archive.DirectoryArchive archive: The archive.
+    :param bool quarantine: Move damaged files to the quarantine directory.
+    :param bool parse: Also parse documents with stem.
+    """
+
+    def __init__(self, archive, quarantine=True, parse=False):
+        self.archive = archive
+        self.quarantine = quarantine
+        self.parse = parse
+        self.checkpoint_path = archive.state_path(CHECKPOINT_NAME)
+        self.quarantine_path = archive.state_path(QUARANTINE_NAME)
+
+    def load_checkpoint(self):
+        """
+        Reads the units completed by an earlier, interrupted scan.
+
+        :returns: A (completed unit keys, counts) :py:class:`tuple`, where the
+                  counts are a :py:class:`~collections.Counter` of the stats
+                  for those units.
+        """
+        completed = set()
+        counts = collections.Counter()
+        try:
+            with open(self.checkpoint_path) as checkpoint:
+                for line in checkpoint:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Partial line from an interrupted write
+                        continue
+                    completed.add(entry["unit"])
+                    counts.update(entry["counts"])
+        except FileNotFoundError:
+            pass
+        return completed, counts
+
+    def _record(self, key, counts):
+        os.makedirs(os.path.dirname(self.checkpoint_path), exist_ok=True)
+        with open(self.checkpoint_path, 'a') as checkpoint:
+            checkpoint.write(json.dumps({"unit": key,
+                                         "counts": dict(counts)}) + "\n")
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+
+    def _quarantine(self, path, relative):
+        target = os.path.join(self.quarantine_path, relative)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.move(path, target)
+        classified = classify_path(relative)
+        if classified is not None:
+            self.archive.index.remove(classified[0], classified[1])
+        LOG.warning("Quarantined %s as %s", path, target)
+
+    def check_unit(self, root, relative, recursive):
+        """
+        Checks every file in a unit of work. This performs blocking I/O.
+
+        :returns: A :py:class:`~collections.Counter` of the files and bytes
+                  "checked", and the files found "bad" and "quarantined".
+        """
+        counts = collections.Counter()
+        for path, relative_path in _scan(root, relative, recursive):
+            counts["checked"] += 1
+            counts["bytes"] += os.path.getsize(path)
+            damage = verify_file(path, relative_path, self.parse)
+            if damage is None:
+                continue
+            LOG.error("Damaged document %s: %s", path, damage)
+            counts["bad"] += 1
+            if self.quarantine:
+                self._quarantine(path, relative_path)
+                counts["quarantined"] += 1
+        return counts
+
+    async def run(self, max_workers=None, max_units=None, restart=False):
+        """
+        Runs the scan, resuming from the checkpoint if there is one. See
+        :py:func:`check_archive`.
+        """
+        loop = asyncio.get_running_loop()
+        if restart and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        completed, counts = await loop.run_in_executor(None,
+                                                       self.load_checkpoint)
+        units = []
+        for root in self.archive.shards.roots:
+            for relative, recursive in await loop.run_in_executor(
+                    None, work_units, root):
+                key = _unit_key(root, relative, recursive)
+                if key not in completed:
+                    units.append((key, root, relative, recursive))
+        if completed:
+            LOG.info("Resuming scan with %d units completed, %d remaining",
+                     len(completed), len(units))
+        remaining = len(units)
+        if max_units is not None:
+            units = units[:max_units]
+
+        async def check(executor, key, root, relative, recursive):
+            nonlocal remaining
+            unit_counts = await loop.run_in_executor(
+                executor, self.check_unit, root, relative, recursive)
+            await loop.run_in_executor(None, self._record, key, unit_counts)
+            counts.update(unit_counts)
+            remaining -= 1
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            await asyncio.gather(*[check(executor, *unit) for unit in units])
+        if remaining == 0 and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        stats = {name: counts[name]
+                 for name in ("checked", "bytes", "bad", "quarantined")}
+        stats["remaining_units"] = remaining
+        LOG.info("Checked %d documents (%d bytes), %d damaged, %d units "
+                 "remaining", stats["checked"], stats["bytes"], stats["bad"],
+                 remaining)
+        return stats
+
+
+async def check_archive(archive, quarantine=True, parse=False,
+                        max_workers=None, max_units=None, restart=False):
+    """
+    Scans an archive for damaged documents, verifying the digest of each
+    document named by its digest.
+
+    Progress is checkpointed after each unit of work. If a checkpoint exists
+    from an earlier scan that did not complete, the scan resumes from it and
+    the stats include the units that were already completed. The checkpoint
+    is removed once every unit has been checked.
+
+    :param ~bushel.archive.DirectoryArchive archive: The archive.
+    :param bool quarantine: Move damaged files to the quarantine directory.
+    :param bool parse: Also parse every document with stem, which is much
+                       slower.
+    :param int max_workers: The maximum number of threads to scan with.
+    :param int max_units: Stop after checking this many units of work, for
+                          example to spread a scan over several runs.
+    :param bool restart: Ignore any checkpoint and start a new scan.
+
+    :returns: A :py:class:`dict` with the number of files and bytes
+              "checked", the files found "bad" and "quarantined", and the
+              number of "remaining_units" left to check.
+    """
+    checker = ArchiveChecker(archive, quarantine, parse)
+    return await checker.run(max_workers, max_units, restart)
@@ -0,0 +1,528 @@
+"""
+Persistent index of the documents held in a
+:py:class:`~bushel.archive.DirectoryArchive`.
+
+The CollecTor File Structure Protocol places descriptors in directories
+according to their published time, so finding a descriptor by digest alone
+requires a guess at when it was published. The :py:class:`DigestIndex` maps
+the digest of each archived document to its type, path, published time and
+size so that lookups do not depend on such hints.
+
+The index is stored in an SQLite database using write-ahead logging, allowing
+readers to continue while the archive is being written to. It is kept up to
+date as documents are stored, and can be rebuilt from the archive at any time
+by walking the directory tree.
+"""
+
+import collections
+import concurrent.futures
+import datetime
+import logging
+import os
+import os.path
+import re
+import sqlite3
+import threading
+
+from bushel.collector.filesystem import CollectorOutBridgeDescsMarker
+from bushel.collector.filesystem import CollectorOutRelayDescsMarker
+from bushel.collector.filesystem import CollectorOutSubdirectory
+from bushel.compression import read_archived
+from bushel.compression import strip_compression_extension
+
+LOG = logging.getLogger('bushel')
+
+VOTE_INDEX_DAYS = 31
+
+BRIDGE_EXTRA_INFO = "bridge-extra-info"
+BRIDGE_SERVER_DESCRIPTOR = "bridge-server-descriptor"
+BANDWIDTH_FILE = "bandwidth-file"
+EXTRA_INFO = "extra-info"
+MICRODESCRIPTOR = "microdescriptor"
+SERVER_DESCRIPTOR = "server-descriptor"
+VOTE = "network-status-vote-3"
+
+INDEXED_DOCTYPES = [
+    BANDWIDTH_FILE, BRIDGE_EXTRA_INFO, BRIDGE_SERVER_DESCRIPTOR, EXTRA_INFO,
+    MICRODESCRIPTOR, SERVER_DESCRIPTOR, VOTE
+]
+
+_DIGEST_MARKERS = {
+    (CollectorOutSubdirectory.RELAY_DESCRIPTORS.value,
+     CollectorOutRelayDescsMarker.SERVER_DESCRIPTOR.value): SERVER_DESCRIPTOR,
+    (CollectorOutSubdirectory.RELAY_DESCRIPTORS.value,
+     CollectorOutRelayDescsMarker.EXTRA_INFO.value): EXTRA_INFO,
+    (CollectorOutSubdirectory.BRIDGE_DESCRIPTORS.value,
+     CollectorOutBridgeDescsMarker.SERVER_DESCRIPTOR.value):
+        BRIDGE_SERVER_DESCRIPTOR,
+    (CollectorOutSubdirectory.BRIDGE_DESCRIPTORS.value,
+     CollectorOutBridgeDescsMarker.EXTRA_INFO.value): BRIDGE_EXTRA_INFO,
+}
+
+_VOTE_FILENAME = re.compile(
+    r"^(\d{4}-\d{2}-\d{2}-\d{2}-\d{2}-\d{2})-vote-([0-9A-F]{40})-([0-9A-F]{40})$")
+_BANDWIDTH_FILENAME = re.compile(
+    r"^(\d{4}-\d{2}-\d{2}-\d{2}-\d{2}-\d{2})-bandwidth-([0-9A-F]{64})$")
+_HEX_DIGEST = re.compile(r"^[0-9a-f]{40}$|^[0-9a-f]{64}$")
+
+
+class IndexedDocument(collections.namedtuple(
+        "IndexedDocument",
+    ['doctype', 'digest', 'path', 'published', 'size'])):
+    """
+    A document known to the :py:class:`DigestIndex`.
+
+    :var str doctype: The type of the document, one of the values in
+                      :py:data:`INDEXED_DOCTYPES`.
+    :var str digest: The lower-case hex-encoded digest of the document.
+    :var str path: The path of the document relative to the archive root.
+    :var ~datetime.datetime published: The published (or valid-after) time of
+        the document. For documents that do not have a published time, such
+        as microdescriptors, this is the start of the month that the document
+        was archived in.
+    :var int size: The size of the file in bytes.
+    """
+
+
+def classify_path(path):
+    """
+    Determines the type, digest and (approximate) timestamp of a document from
+    its path relative to the archive root. For example:
+
+    >>> classify_path("relay-descriptors/server-descriptor/2018/11/a/9/"
+    ...               "a94a07b201598d847105ae5fcd5bc3ab10124389")
+    ('server-descriptor', 'a94a07b201598d847105ae5fcd5bc3ab10124389', datetime.datetime(2018, 11, 1, 0, 0))
+
+    Paths that do not hold documents indexed by digest (such as consensuses)
+    or that are not valid paths in the archive give *None*:
+
+    >>> classify_path("relay-descriptors/consensus/2018/11/19/"
+    ...               "2018-11-19-15-00-00-consensus") is None
+    True
+
+    :param str path: The path relative to the archive root.
+
+    :returns: A :py:class:`tuple` of (doctype, digest, timestamp), or *None*.
+    """
+    parts = strip_compression_extension(path).split(os.sep)
+    filename = parts[-1]
+    try:
+        if tuple(parts[0:2]) in _DIGEST_MARKERS and len(parts) == 7:
+            if not _HEX_DIGEST.match(filename):
+                return None
+            return (_DIGEST_MARKERS[tuple(parts[0:2])], filename,
+                    datetime.datetime(int(parts[2]), int(parts[3]), 1))
+        if parts[0:2] == [CollectorOutSubdirectory.RELAY_DESCRIPTORS.value,
+                          CollectorOutRelayDescsMarker.MICRODESC.value] and \
+              len(parts) == 8 and parts[4] == "micro":
+            if not _HEX_DIGEST.match(filename):
+                return None
+            return (MICRODESCRIPTOR, filename,
+                    datetime.datetime(int(parts[2]), int(parts[3]), 1))
+    except ValueError:
+        return None
+    for doctype, pattern in [(VOTE, _VOTE_FILENAME),
+                             (BANDWIDTH_FILE, _BANDWIDTH_FILENAME)]:
+        match = pattern.match(filename)
+        if match:
+            return (doctype, match.group(match.lastindex).lower(),
+                    datetime.datetime.strptime(match.group(1),
+                                               "%Y-%m-%d-%H-%M-%S"))
+    return None
+
+
+def parse_vote_filename(filename):
+    """
+    Determines the valid-after time, authority and digest of a vote from its
+    filename in the archive. For example:
+
+    >>> parse_vote_filename("2018-11-19-15-00-00-vote-"
+    ...                     "D586D18309DED4CD6D57C18FDB97EFA96D330566-"
+    ...                     "663B503182575D242B9D8A67334365FF8ECB53BB.xz")  # doctest: +ELLIPSIS
+    (datetime.datetime(2018, 11, 19, 15, 0), 'D586...566', '663B...3BB')
+
+    :param str filename: The filename, which may have a compression
+                         extension.
+
+    :returns: A (valid-after, v3ident, digest) :py:class:`tuple`, or *None*
+              if the filename is not that of a vote.
+    """
+    match = _VOTE_FILENAME.match(strip_compression_extension(filename))
+    if not match:
+        return None
+    return (datetime.datetime.strptime(match.group(1), "%Y-%m-%d-%H-%M-%S"),
+            match.group(2), match.group(3))
+
+
+def scan_published(content):
+    r"""
+    Finds the published time within a descriptor without parsing it. For
+    example:
+
+    >>> scan_published(b"router test 127.0.0.1 9001 0 0\n"
+    ...                b"published 2018-11-19 15:01:02\n")
+    datetime.datetime(2018, 11, 19, 15, 1, 2)
+
+    :param bytes content: The raw descriptor, with or without annotations.
+
+    :returns: A :py:class:`~datetime.datetime`, or *None* if the descriptor
+              has no valid published line.
+    """
+    start = content.find(b"\npublished ")
+    if start == -1:
+        return None
+    start += len(b"\npublished ")
+    try:
+        return datetime.datetime.strptime(
+            bytes(content[start:start + 19]).decode('utf-8'),
+            "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return None
+
+
+def _published_from_content(path):
+    """
+    Finds the published time within an archived descriptor without parsing it.
+    """
+    return scan_published(read_archived(path))
+
+
+def _walk_subtree(archive_path, subtree):
+    documents = []
+    for dirpath, _, filenames in os.walk(os.path.join(archive_path, subtree)):
+        for filename in filenames:
+            fullpath = os.path.join(dirpath, filename)
+            relpath = os.path.relpath(fullpath, archive_path)
+            classified = classify_path(relpath)
+            if classified is None:
+                continue
+            doctype, digest, timestamp = classified
+            if doctype not in [MICRODESCRIPTOR, VOTE, BANDWIDTH_FILE]:
+                timestamp = _published_from_content(fullpath) or timestamp
+            documents.append(
+                IndexedDocument(doctype, digest, relpath, timestamp,
+                                os.path.getsize(fullpath)))
+    return documents
+
+
+def _month_subtrees(archive_path):
+    """
+    Lists the directories that can be walked independently, which is a
+    directory for each month under each marker.
+    """
+    subtrees = []
+    for subdirectory in CollectorOutSubdirectory:
+        subdirectory_path = os.path.join(archive_path, subdirectory.value)
+        if not os.path.isdir(subdirectory_path):
+            continue
+        for marker in os.scandir(subdirectory_path):
+            if not marker.is_dir():
+                continue
+            for year in os.scandir(marker.path):
+                if not year.is_dir():
+                    continue
+                for month in os.scandir(year.path):
+                    if month.is_dir():
+                        subtrees.append(
+                            os.path.relpath(month.path, archive_path))
+    return subtrees
+
+
+class DigestIndex:
+    """
+    Persistent index mapping digests to archived documents.
+
+    All methods perform blocking I/O, although lookups are typically fast
+    enough (a single B-tree lookup) to be performed directly from an
+    :py:mod:`asyncio` event loop. The database is only created when the first
+    document is added, so that read-only archives are not modified.
+
+    :param str index_path: Path to the SQLite database file.
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self._connection = None
+        self._authoritative = False
+        self._lock = threading.Lock()
+
+    def _connect(self, create):
+        if self._connection is None:
+            if not create and not os.path.exists(self.index_path):
+                return None
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            connection = sqlite3.connect(self.index_path,
+                                         check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS documents ("
+                               "doctype TEXT NOT NULL, "
+                               "digest TEXT NOT NULL, "
+                               "path TEXT NOT NULL, "
+                               "published TIMESTAMP, "
+                               "size INTEGER, "
+                               "PRIMARY KEY (doctype, digest))")
+            connection.execute("CREATE TABLE IF NOT EXISTS meta ("
+                               "key TEXT PRIMARY KEY, value TEXT)")
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def close(self):
+        """
+        Closes the connection to the database, if open.
+        """
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    @property
+    def authoritative(self):
+        """
+        *True* if the index is known to cover every document in the archive,
+        i.e. it has been rebuilt and then maintained by every store since.
+        When the index is authoritative, a miss in the index means that the
+        document is not in the archive.
+        """
+        if self._authoritative:
+            return True
+        with self._lock:
+            connection = self._connect(create=False)
+            if connection is None:
+                return False
+            row = connection.execute(
+                "SELECT value FROM meta WHERE key = 'authoritative'").fetchone()
+            self._authoritative = row is not None and row[0] == "1"
+            return self._authoritative
+
+    def add(self, document):
+        """
+        Adds, or replaces, a document in the index.
+
+        :param IndexedDocument document: The document to add.
+        """
+        self.add_many([document])
+
+    def add_many(self, documents):
+        """
+        Adds, or replaces, multiple documents in the index in a single
+        transaction.
+
+        :param list(IndexedDocument) documents: The documents to add.
+        """
+        with self._lock:
+            connection = self._connect(create=True)
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?)",
+                    [(d.doctype, d.digest.lower(), d.path,
+                      d.published.isoformat(" ") if d.published else None,
+                      d.size) for d in documents])
+
+    def remove(self, doctype, digest):
+        """
+        Removes a document from the index, if present.
+
+        :param str doctype: The type of the document.
+        :param str digest: The hex-encoded digest of the document.
+        """
+        self.remove_many([(doctype, digest)])
+
+    def remove_many(self, documents):
+        """
+        Removes multiple documents from the index in a single transaction.
+
+        :param list documents: (doctype, digest) tuples for each document.
+        """
+        with self._lock:
+            connection = self._connect(create=False)
+            if connection is None:
+                return
+            with connection:
+                connection.executemany(
+                    "DELETE FROM documents WHERE doctype = ? AND digest = ?",
+                    [(doctype, digest.lower())
+                     for doctype, digest in documents])
+
+    def lookup(self, doctype, digest):
+        """
+        Finds a document in the index.
+
+        :param str doctype: The type of the document.
+        :param str digest: The hex-encoded digest of the document.
+
+        :returns: An :py:class:`IndexedDocument`, or *None* if the document is
+                  not in the index.
+        """
+        with self._lock:
+            connection = self._connect(create=False)
+            if connection is None:
+                return None
+            row = connection.execute(
+                "SELECT doctype, digest, path, published, size "
+                "FROM documents WHERE doctype = ? AND digest = ?",
+                (doctype, digest.lower())).fetchone()
+        if row is None:
+            return None
+        return IndexedDocument(row[0], row[1], row[2],
+                               _parse_published(row[3]), row[4])
+
+    def documents(self, doctype=None):
+        """
+        Iterates over the documents in the index, sorted by digest.
+
+        :param str doctype: If set, only documents of this type are included.
+
+        :returns: iterator for :py:class:`IndexedDocument`
+        """
+        with self._lock:
+            connection = self._connect(create=False)
+            if connection is None:
+                return
+            if doctype is None:
+                rows = connection.execute(
+                    "SELECT doctype, digest, path, published, size "
+                    "FROM documents ORDER BY digest").fetchall()
+            else:
+                rows = connection.execute(
+                    "SELECT doctype, digest, path, published, size "
+                    "FROM documents WHERE doctype = ? ORDER BY digest",
+                    (doctype,)).fetchall()
+        for row in rows:
+            yield IndexedDocument(row[0], row[1], row[2],
+                                  _parse_published(row[3]), row[4])
+
+    def rebuild(self, archive_path, max_workers=None):
+        """
+        Rebuilds the index by walking the archive. Each month of each type of
+        document is walked in parallel using a thread pool. Once complete,
+        the index is marked as authoritative.
+
+        :param str archive_path: The root of the archive, or a
+                                 :py:class:`list` of the roots of a sharded
+                                 archive.
+        :param int max_workers: The maximum number of threads to use for the
+                                walk.
+
+        :returns: The number of documents indexed as an :py:class:`int`.
+        """
+        roots = [archive_path] if isinstance(archive_path, str) \
+            else archive_path
+        subtrees = [(root, subtree) for root in roots
+                    for subtree in _month_subtrees(root)]
+        count = 0
+        with self._lock:
+            connection = self._connect(create=True)
+            with connection:
+                connection.execute("DELETE FROM documents")
+                connection.execute(
+                    "DELETE FROM meta WHERE key = 'authoritative'")
+            self._authoritative = False
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            for documents in executor.map(
+                    lambda subtree: _walk_subtree(*subtree), subtrees):
+                self.add_many(documents)
+                count += len(documents)
+                LOG.debug("Indexed %d documents", count)
+        with self._lock:
+            with self._connection:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('authoritative', '1')")
+        LOG.info("Rebuilt index of %d documents", count)
+        return count
+
+
+class VoteIndex:
+    """
+    In-memory index of the votes in the archive, mapping the valid-after time
+    and authority v3ident of each vote to the digests of the votes.
+
+    The index for a day is built the first time it is needed by listing the
+    day's vote directory with :py:func:`os.scandir`, and is then kept up to
+    date by :py:meth:`add` as votes are stored. Only the most recently used
+    days are kept in memory.
+
+    :param directory_function: A function taking a
+                               :py:class:`~datetime.datetime` and returning
+                               the path of the directory holding votes for
+                               that day.
+    :param int max_days: The maximum number of days to keep in memory.
+
+    Valid-after times are only compared to the second, as they are in vote
+    filenames.
+    """
+
+    def __init__(self, directory_function, max_days=VOTE_INDEX_DAYS):
+        self.directory_function = directory_function
+        self.max_days = max_days
+        self._days = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _scan(self, day):
+        votes = collections.defaultdict(list)
+        try:
+            with os.scandir(self.directory_function(day)) as entries:
+                for entry in entries:
+                    vote = parse_vote_filename(entry.name)
+                    if vote:
+                        votes[vote[0:2]].append(vote[2])
+        except FileNotFoundError:
+            pass
+        return votes
+
+    def _day(self, valid_after, scan):
+        day = valid_after.date()
+        with self._lock:
+            if day in self._days:
+                self._days.move_to_end(day)
+                return self._days[day]
+        if not scan:
+            return None
+        votes = self._scan(valid_after)
+        with self._lock:
+            # Another thread may have scanned or added to the day meanwhile
+            votes = self._days.setdefault(day, votes)
+            self._days.move_to_end(day)
+            while len(self._days) > self.max_days:
+                self._days.popitem(last=False)
+        return votes
+
+    def lookup(self, valid_after, v3ident):
+        """
+        Finds the digests of the votes made by an authority for a valid-after
+        time. This may perform blocking I/O the first time a day is looked up.
+
+        :param ~datetime.datetime valid_after: The valid-after time.
+        :param str v3ident: The v3ident of the authority.
+
+        :returns: A sorted :py:class:`list` of upper-case hex-encoded digests.
+        """
+        valid_after = valid_after.replace(microsecond=0)
+        votes = self._day(valid_after, scan=True)
+        with self._lock:
+            return sorted(votes.get((valid_after, v3ident.upper()), []))
+
+    def add(self, valid_after, v3ident, digest):
+        """
+        Records that a vote has been stored. If the day has not been loaded,
+        this has no effect as the vote will be found when it is scanned.
+
+        :param ~datetime.datetime valid_after: The valid-after time.
+        :param str v3ident: The v3ident of the authority.
+        :param str digest: The hex-encoded digest of the vote.
+        """
+        valid_after = valid_after.replace(microsecond=0)
+        votes = self._day(valid_after, scan=False)
+        if votes is None:
+            return
+        with self._lock:
+            digests = votes[(valid_after, v3ident.upper())]
+            if digest.upper() not in digests:
+                digests.append(digest.upper())
+
+
+def _parse_published(value):
+    if value is None:
+        return None
+    return datetime.datetime.fromisoformat(value)
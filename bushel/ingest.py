@@ -0,0 +1,385 @@
+"""
+Bulk import of CollecTor tarballs into a
+:py:class:`~bushel.archive.DirectoryArchive`.
+
+CollecTor publishes monthly tarballs of each document type, such as
+``server-descriptors-2018-11.tar.xz``. Each member is a single document with
+a ``@type`` annotation. The path for each document in the archive is derived
+from that annotation, the member's filename and, for descriptors filed by
+published time, a scan for the ``published`` line. Only unflavored
+consensuses are parsed, so that they can be added to the archive's relay
+history and address index, and so importing other documents is limited by
+decompression and writing rather than parsing.
+
+An import runs as a pipeline of three stages, connected by bounded queues so
+that memory use does not depend on the size of the tarball:
+
+============== ==============================================================
+Stage          Description
+============== ==============================================================
+Decompress     Reads chunks of members from the tarball as it is decompressed
+Classify       Determines the type, digest and archive path of each member
+Write          Writes chunks using the archive's batched store path
+============== ==============================================================
+
+Each stage runs its blocking work in an executor, so all three proceed
+concurrently. Classified members are written with
+:py:meth:`~bushel.archive.DirectoryArchive.store_documents`. Documents that are already archived are skipped as for
+:py:meth:`~bushel.archive.DirectoryArchive.store`, so an interrupted import
+can simply be run again. For example::
+
+    archive = DirectoryArchive("/srv/archive")
+    stats = await import_tarball(archive, "server-descriptors-2018-11.tar.xz")
+"""
+
+import asyncio
+import datetime
+import logging
+import os.path
+import re
+import tarfile
+import time
+
+from bushel.archive import STORE_BATCH_SIZE
+from bushel.archive import collector_534_microdescriptor_path
+from bushel.archive import filename_timestamp
+from bushel.bandwidth.file import BandwidthFile
+from bushel.compression import open_compressed
+from bushel.index import BANDWIDTH_FILE
+from bushel.index import BRIDGE_EXTRA_INFO
+from bushel.index import BRIDGE_SERVER_DESCRIPTOR
+from bushel.index import EXTRA_INFO
+from bushel.index import MICRODESCRIPTOR
+from bushel.index import SERVER_DESCRIPTOR
+from bushel.index import VOTE
+from bushel.index import classify_path
+from bushel.index import parse_vote_filename
+from bushel.index import scan_published
+from bushel.parsing import parse_raw
+
+LOG = logging.getLogger('bushel')
+
+IMPORT_CHUNK_SIZE = 1024
+IMPORT_QUEUE_SIZE = 4
+PROGRESS_INTERVAL = 10.0
+
+_MONTH_DIRECTORY = re.compile(r"-(\d{4})-(\d{2})$")
+_HEX_DIGEST = re.compile(r"^[0-9a-fA-F]{40}$|^[0-9a-fA-F]{64}$")
+
+
+def annotation_type(content):
+    """
+    Finds the document type from the ``@type`` annotation at the start of a
+    document. For example:
+
+    >>> annotation_type(b"@type server-descriptor 1.0\\nrouter ...")
+    'server-descriptor'
+
+    :param bytes content: The raw document.
+
+    :returns: The type as a :py:class:`str`, or *None* if the document does
+              not start with a type annotation.
+    """
+    if not content.startswith(b"@type "):
+        return None
+    end = content.find(b"\n")
+    fields = content[6:end if end != -1 else None].split()
+    return fields[0].decode('utf-8', 'replace') if fields else None
+
+
+def _member_month(name):
+    """
+    The month of a tarball from the top-level directory of a member, such as
+    "microdescs-2018-11".
+    """
+    match = _MONTH_DIRECTORY.search(name.split("/")[0])
+    if not match:
+        return None
+    return datetime.datetime(int(match.group(1)), int(match.group(2)), 1)
+
+
+def _descriptor(path_function, doctype):
+    def classify(archive, name, content):
+        digest = os.path.basename(name).lower()
+        published = scan_published(content)
+        if not _HEX_DIGEST.match(digest) or published is None:
+            return None
+        return ((doctype, digest, published),
+                path_function(archive)(published, digest), False)
+
+    return classify
+
+
+def _microdescriptor(archive, name, content):
+    digest = os.path.basename(name).lower()
+    month = _member_month(name)
+    if not _HEX_DIGEST.match(digest) or month is None:
+        return None
+    return ((MICRODESCRIPTOR, digest, month),
+            archive.path_for(collector_534_microdescriptor_path(month,
+                                                                digest)),
+            False)
+
+
+def _consensus(path_function):
+    def classify(archive, name, content):
+        valid_after = filename_timestamp(os.path.basename(name))
+        if valid_after is None:
+            return None
+        return None, path_function(archive)(valid_after), True
+
+    return classify
+
+
+def _vote(archive, name, content):
+    vote = parse_vote_filename(os.path.basename(name))
+    if vote is None:
+        return None
+    valid_after, v3ident, digest = vote
+    return ((VOTE, digest.lower(), valid_after),
+            archive.relay_vote_path(valid_after, v3ident, digest), True)
+
+
+def _bandwidth_file(archive, name, content):
+    classified = classify_path(os.path.basename(name))
+    if classified is None or classified[0] != BANDWIDTH_FILE:
+        return None
+    _, digest, published = classified
+    return ((BANDWIDTH_FILE, digest, published),
+            archive.relay_bandwidth_file_path(published, digest.upper()),
+            True)
+
+
+def _bridge_status(archive, name, content):
+    filename = os.path.basename(name)
+    try:
+        valid_after = datetime.datetime.strptime(filename[:15],
+                                                 "%Y%m%d-%H%M%S")
+    except ValueError:
+        return None
+    return None, archive.bridge_status_path(valid_after, filename[16:]), False
+
+
+CLASSIFIERS = {
+    "server-descriptor": _descriptor(
+        lambda archive: archive.relay_server_descriptor_path,
+        SERVER_DESCRIPTOR),
+    "extra-info": _descriptor(
+        lambda archive: archive.relay_extra_info_descriptor_path, EXTRA_INFO),
+    "bridge-server-descriptor": _descriptor(
+        lambda archive: archive.bridge_server_descriptor_path,
+        BRIDGE_SERVER_DESCRIPTOR),
+    "bridge-extra-info": _descriptor(
+        lambda archive: archive.bridge_extra_info_descriptor_path,
+        BRIDGE_EXTRA_INFO),
+    "microdescriptor": _microdescriptor,
+    "network-status-consensus-3": _consensus(
+        lambda archive: archive.relay_consensus_path),
+    "network-status-microdesc-consensus-3": _consensus(
+        lambda archive: archive.relay_microdescriptor_consensus_path),
+    "network-status-vote-3": _vote,
+    "bandwidth-file": _bandwidth_file,
+    "bridge-network-status": _bridge_status,
+}
+"""
+Functions to classify tarball members, keyed by the type in their ``@type``
+annotation.
+"""
+
+
+def classify_member(archive, name, content):
+    """
+    Determines where a tarball member belongs in an archive. Only bandwidth
+    files and unflavored consensuses are parsed.
+
+    :param ~bushel.archive.DirectoryArchive archive: The archive.
+    :param str name: The name of the member in the tarball.
+    :param bytes content: The content of the member.
+
+    :returns: A (descriptor, key, path, content) :py:class:`tuple` as used by
+              :py:meth:`~bushel.archive.DirectoryArchive.store_documents`,
+              or *None* if the member could not be classified. The
+              descriptor is only set for bandwidth files, which are added to
+              the bandwidth history, and for unflavored consensuses, which
+              are added to the relay history and address index.
+    """
+    classifier = CLASSIFIERS.get(annotation_type(content))
+    if classifier is None:
+        return None
+    classified = classifier(archive, name, content)
+    if classified is None:
+        return None
+    key, path, compressible = classified
+    if compressible:
+        path += archive.compression.extension
+    descriptor = None
+    if key and key[0] == BANDWIDTH_FILE:
+        descriptor = BandwidthFile(content[content.find(b"\n") + 1:])
+    elif annotation_type(content) == "network-status-consensus-3":
+        descriptor = parse_raw(content)
+        if descriptor is None:
+            LOG.warning("Could not parse consensus %s, it will not be added "
+                        "to the relay history or address index", name)
+    return descriptor, key, path, content
+
+
+class ImportProgress:
+    """
+    Tracks the progress of an import, logging the rate periodically.
+
+    :param str name: A name for the import to use in log messages.
+    :param float interval: The minimum number of seconds between log
+                           messages.
+    """
+
+    def __init__(self, name, interval=PROGRESS_INTERVAL):
+        self.name = name
+        self.interval = interval
+        self.started = time.monotonic()
+        self._logged = self.started
+        self.documents = 0
+        self.bytes = 0
+        self.unrecognized = 0
+
+    def update(self, documents, size, unrecognized=0):
+        """
+        Records documents that have been imported.
+
+        :param int documents: The number of documents.
+        :param int size: Their total size in bytes.
+        :param int unrecognized: Members that could not be classified.
+        """
+        self.documents += documents
+        self.bytes += size
+        self.unrecognized += unrecognized
+        now = time.monotonic()
+        if now - self._logged >= self.interval:
+            self._logged = now
+            self.log()
+
+    def log(self):
+        """
+        Logs the progress so far.
+        """
+        stats = self.stats()
+        LOG.info("%s: %d documents, %.1f MB/s, %.0f documents/s", self.name,
+                 stats["documents"], stats["mb_per_second"],
+                 stats["documents_per_second"])
+
+    def stats(self):
+        """
+        Reports the progress so far.
+
+        :returns: A :py:class:`dict` of the documents and bytes imported,
+                  members that were not recognized, the elapsed time, and the
+                  rates in MB/s and documents/s.
+        """
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        return {
+            "documents": self.documents,
+            "bytes": self.bytes,
+            "unrecognized": self.unrecognized,
+            "elapsed": elapsed,
+            "mb_per_second": self.bytes / elapsed / 1e6,
+            "documents_per_second": self.documents / elapsed,
+        }
+
+
+def _open_tarball(tarball_path):
+    source = open_compressed(tarball_path)
+    return source, tarfile.open(fileobj=source, mode="r|*")
+
+
+def _read_chunk(members, tarball, chunk_size):
+    chunk = []
+    for member in members:
+        if not member.isfile():
+            continue
+        chunk.append((member.name, tarball.extractfile(member).read()))
+        if len(chunk) >= chunk_size:
+            break
+    return chunk
+
+
+def _classify_chunk(archive, chunk):
+    stored = []
+    for name, content in chunk:
+        classified = classify_member(archive, name, content)
+        if classified is None:
+            LOG.debug("Could not classify %s", name)
+            continue
+        stored.append(classified)
+    return stored, len(chunk) - len(stored), sum(len(c) for _, c in chunk)
+
+
+async def import_tarball(archive, tarball_path, chunk_size=IMPORT_CHUNK_SIZE,
+                         batch_size=STORE_BATCH_SIZE,
+                         progress_interval=PROGRESS_INTERVAL):
+    """
+    Imports the documents in a CollecTor tarball into an archive. Tarballs
+    compressed with xz, gzip or zstd (including multi-stream files) are
+    decompressed according to their extension, and any other compression
+    supported by :py:mod:`tarfile` is detected.
+
+    :param ~bushel.archive.DirectoryArchive archive: The archive.
+    :param str tarball_path: The path of the tarball.
+    :param int chunk_size: The number of members passed between pipeline
+                           stages at a time.
+    :param int batch_size: The maximum number of documents to write in a
+                           single executor task.
+    :param float progress_interval: The minimum number of seconds between
+                                    progress log messages.
+
+    :returns: A :py:class:`dict` as for :py:meth:`ImportProgress.stats`.
+    """
+    loop = asyncio.get_running_loop()
+    progress = ImportProgress(os.path.basename(tarball_path),
+                              progress_interval)
+    read_queue = asyncio.Queue(maxsize=IMPORT_QUEUE_SIZE)
+    write_queue = asyncio.Queue(maxsize=IMPORT_QUEUE_SIZE)
+
+    async def decompress():
+        source, tarball = await loop.run_in_executor(None, _open_tarball,
+                                                     tarball_path)
+        try:
+            members = iter(tarball)
+            while True:
+                chunk = await loop.run_in_executor(None, _read_chunk, members,
+                                                   tarball, chunk_size)
+                if not chunk:
+                    break
+                await read_queue.put(chunk)
+        finally:
+            tarball.close()
+            source.close()
+            await read_queue.put(None)
+
+    async def classify():
+        try:
+            while True:
+                chunk = await read_queue.get()
+                if chunk is None:
+                    break
+                await write_queue.put(await loop.run_in_executor(
+                    None, _classify_chunk, archive, chunk))
+        finally:
+            await write_queue.put(None)
+
+    async def write():
+        while True:
+            classified = await write_queue.get()
+            if classified is None:
+                break
+            stored, unrecognized, size = classified
+            await archive.store_documents(stored, batch_size)
+            progress.update(len(stored), size, unrecognized)
+
+    stages = [asyncio.ensure_future(stage())
+              for stage in (decompress, classify, write)]
+    try:
+        await asyncio.gather(*stages)
+    finally:
+        for stage in stages:
+            stage.cancel()
+    progress.log()
+    return progress.stats()
@@ -0,0 +1,151 @@
+"""
+A least-recently-used cache bounded by the total size of its values.
+
+Sizes are given by the caller when a value is added, so the same cache can be
+used for raw bytes (where the size is the length) and for parsed documents
+(where the size of the raw document is a reasonable estimate). Values may
+also be given an expiry time, after which they are treated as missing.
+"""
+
+import collections
+import threading
+import time
+
+
+class LRUCache:
+    """
+    A thread-safe cache that evicts the least recently used values once the
+    total size of the values exceeds a limit. Hits, misses and evictions are
+    counted.
+
+    >>> cache = LRUCache(10)
+    >>> cache.put("a", b"aaaaa", 5)
+    >>> cache.put("b", b"bbbbb", 5)
+    >>> cache.get("a")
+    b'aaaaa'
+    >>> cache.put("c", b"ccccc", 5)
+    >>> cache.get("b") is None
+    True
+    >>> cache.stats()  # doctest: +NORMALIZE_WHITESPACE
+    {'hits': 1, 'misses': 1, 'evictions': 1, 'expirations': 0, 'entries': 2,
+     'size': 10}
+
+    :param int max_size: The maximum total size of the values in the cache.
+    :param clock: A function returning the current time as a POSIX timestamp,
+                  used to check expiry times.
+    """
+
+    def __init__(self, max_size, clock=time.time):
+        self.max_size = max_size
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.size = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """
+        Retrieves a value from the cache, marking it as recently used. An
+        expired value is removed and counted as a miss.
+
+        :param key: The key for the value.
+        :param default: The value to return if the key is not in the cache.
+        """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            value, size, expires = self._entries[key]
+            if expires is not None and expires <= self.clock():
+                del self._entries[key]
+                self.size -= size
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, size, expires=None):
+        """
+        Adds a value to the cache, evicting the least recently used values if
+        required. Values larger than the cache, or that have already expired,
+        are not added.
+
+        :param key: The key for the value.
+        :param value: The value.
+        :param int size: The size of the value.
+        :param float expires: If set, the POSIX timestamp after which the
+                              value is treated as missing.
+        """
+        if size > self.max_size:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            if expires is not None and expires <= self.clock():
+                return
+            self._entries[key] = (value, size, expires)
+            self.size += size
+            self._evict()
+
+    def _evict(self):
+        while self.size > self.max_size:
+            _, (_, size, _) = self._entries.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+
+    def expire(self):
+        """
+        Removes all expired values, freeing their memory without waiting for
+        them to be requested or evicted.
+
+        :returns: The number of values removed as an :py:class:`int`.
+        """
+        with self._lock:
+            now = self.clock()
+            expired = [
+                key for key, (_, _, expires) in self._entries.items()
+                if expires is not None and expires <= now
+            ]
+            for key in expired:
+                self.size -= self._entries.pop(key)[1]
+            self.expirations += len(expired)
+            return len(expired)
+
+    def discard(self, key):
+        """
+        Removes a value from the cache if present. This does not count as an
+        eviction.
+
+        :param key: The key for the value.
+        """
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+
+    def stats(self):
+        """
+        Reports the hit, miss and eviction counters along with the current
+        number of entries and their total size.
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "entries": len(self._entries),
+                "size": self.size,
+            }
@@ -56,6 +56,26 @@ def utc_datetime_too_old(dts: typing.Dict[str, datetime.datetime],
                (oldest_sec, oldest_key, oldest_dt.isoformat(), )
 
 
+def catalog_latest_too_old(catalog,
+                           doctypes: typing.Iterable[str],
+                           warning_if_older: int,
+                           critical_if_older: int,
+                           utcnow: datetime.datetime = None) -> NagiosResponse:
+    """
+    Checks that the latest document of each type in an archive's
+    :py:class:`~bushel.catalog.ArchiveCatalog` is recent, without walking
+    the archive. A type with no documents is critical.
+    """
+    dts = {}
+    for doctype in doctypes:
+        latest = catalog.latest(doctype)
+        if latest is None:
+            return CRITICAL, "No documents archived: %s" % (doctype, )
+        dts[doctype] = latest
+    return utc_datetime_too_old(dts, warning_if_older, critical_if_older,
+                                utcnow=utcnow)
+
+
 def nagios_return(status: NagiosStatusCode, message: str) -> None:
     if status == OK:
         print("OK: %s" % message)
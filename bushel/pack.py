@@ -0,0 +1,641 @@
+"""
+Packed storage for descriptors that would otherwise be stored one per file.
+
+The CollecTor File Structure Protocol stores each server descriptor,
+extra-info descriptor and microdescriptor in its own file. Over a year this is
+tens of millions of inodes, which makes backups, directory listings and scrubs
+slow. The packed format instead appends descriptors for each type and month to
+a single pack file::
+
+    packs/server-descriptor/2018-11.pack   # Concatenated annotated descriptors
+    packs/server-descriptor/2018-11.idx    # Sorted (digest, offset, length)
+    packs/server-descriptor/2018-11.log    # Unsorted entries not yet merged
+
+New entries are appended to the log, which is merged into the sorted index
+once it grows beyond :py:data:`MERGE_THRESHOLD` entries. Lookups check the
+(small) log in memory and then perform a binary search of the sorted index.
+Both the index and the pack are read via :py:mod:`mmap`.
+
+The :py:class:`PackedDirectoryArchive` provides the same coroutine API as
+:py:class:`~bushel.archive.DirectoryArchive`, storing digest-addressed
+descriptors in packs and all other documents (such as consensuses and votes)
+in the usual layout.
+"""
+
+import asyncio
+import datetime
+import functools
+import logging
+import mmap
+import os
+import os.path
+import struct
+import threading
+from collections import defaultdict
+
+from bushel.archive import DESCRIPTOR_TYPES
+from bushel.archive import READ_AHEAD
+from bushel.archive import READ_CHUNK_SIZE
+from bushel.archive import STORE_BATCH_SIZE
+from bushel.archive import CollectorOutBridgeDescsMarker
+from bushel.archive import CollectorOutRelayDescsMarker
+from bushel.archive import CollectorOutSubdirectory
+from bushel.archive import DirectoryArchive
+from bushel.archive import collector_521_path
+from bushel.archive import collector_534_microdescriptor_path
+from bushel.archive import document_key
+from bushel.archive import microdescriptor_hex_digest
+from bushel.archive import prepare_annotated_content
+from bushel.archive import valid_after_now
+from bushel.bandwidth.history import month_name
+from bushel.compression import ArchiveCompression
+from bushel.index import BRIDGE_EXTRA_INFO
+from bushel.index import BRIDGE_SERVER_DESCRIPTOR
+from bushel.index import EXTRA_INFO
+from bushel.index import MICRODESCRIPTOR
+from bushel.index import SERVER_DESCRIPTOR
+from bushel.index import IndexedDocument
+from bushel.index import classify_path
+from bushel.index import scan_published
+from bushel.parsing import parse_raw
+
+LOG = logging.getLogger('bushel')
+
+MERGE_THRESHOLD = 4096
+
+DIGEST_SIZES = {
+    BRIDGE_EXTRA_INFO: 20,
+    BRIDGE_SERVER_DESCRIPTOR: 20,
+    EXTRA_INFO: 20,
+    MICRODESCRIPTOR: 32,
+    SERVER_DESCRIPTOR: 20,
+}
+
+PACKED_DOCTYPES = list(DIGEST_SIZES)
+
+
+def plain_path(doctype, month, digest):
+    """
+    The path, relative to the archive root, that a packed descriptor would be
+    stored at in the CollecTor File Structure Protocol layout. For example:
+
+    >>> month = datetime.datetime(2018, 11, 1)
+    >>> plain_path("server-descriptor", month,
+    ...            "a94a07b201598d847105ae5fcd5bc3ab10124389")  # doctest: +ELLIPSIS
+    'relay-descriptors/server-descriptor/2018/11/a/9/a94a...389'
+
+    :param str doctype: One of :py:data:`PACKED_DOCTYPES`.
+    :param ~datetime.datetime month: A time within the month of the pack.
+    :param str digest: The hex-encoded digest of the descriptor.
+
+    :returns: Path as a :py:class:`str`.
+    """
+    if doctype == MICRODESCRIPTOR:
+        return collector_534_microdescriptor_path(month, digest)
+    subdirectory, marker = {
+        SERVER_DESCRIPTOR: (CollectorOutSubdirectory.RELAY_DESCRIPTORS,
+                            CollectorOutRelayDescsMarker.SERVER_DESCRIPTOR),
+        EXTRA_INFO: (CollectorOutSubdirectory.RELAY_DESCRIPTORS,
+                     CollectorOutRelayDescsMarker.EXTRA_INFO),
+        BRIDGE_SERVER_DESCRIPTOR: (
+            CollectorOutSubdirectory.BRIDGE_DESCRIPTORS,
+            CollectorOutBridgeDescsMarker.SERVER_DESCRIPTOR),
+        BRIDGE_EXTRA_INFO: (CollectorOutSubdirectory.BRIDGE_DESCRIPTORS,
+                            CollectorOutBridgeDescsMarker.EXTRA_INFO),
+    }[doctype]
+    return collector_521_path(subdirectory, marker, month, digest)
+
+
+def plain_month_path(doctype, month):
+    """
+    The directory, relative to the archive root, containing all the
+    descriptors of a type for a month in the CollecTor File Structure Protocol
+    layout. For example:
+
+    >>> plain_month_path("microdescriptor", datetime.datetime(2018, 11, 1))
+    'relay-descriptors/microdesc/2018/11/micro'
+    """
+    digest = "00" * DIGEST_SIZES[doctype]
+    return os.path.dirname(
+        os.path.dirname(os.path.dirname(plain_path(doctype, month, digest))))
+
+
+class PackFile:
+    """
+    An append-only pack of descriptors with a sorted digest index.
+
+    All methods perform blocking I/O and are safe to call from multiple
+    threads.
+
+    :param str pack_path: Path to the pack file. The index and log are kept
+                          alongside, with the same name and ".idx" and ".log"
+                          extensions.
+    :param int digest_size: The size in bytes of the digests used as keys.
+    """
+
+    def __init__(self, pack_path, digest_size):
+        self.pack_path = pack_path
+        base_path = os.path.splitext(pack_path)[0]
+        self.index_path = base_path + ".idx"
+        self.log_path = base_path + ".log"
+        self.entry = struct.Struct(f">{digest_size}sQI")
+        self._lock = threading.Lock()
+        self._pending = None
+        self._index_file = None
+        self._index_map = None
+        self._data_file = None
+        self._data_map = None
+
+    def _load_pending(self):
+        if self._pending is None:
+            self._pending = {}
+            try:
+                with open(self.log_path, 'rb') as source:
+                    raw_log = source.read()
+            except FileNotFoundError:
+                raw_log = b""
+            # Ignore a partially written entry at the end of the log
+            end = len(raw_log) - len(raw_log) % self.entry.size
+            for key, offset, length in self.entry.iter_unpack(raw_log[:end]):
+                self._pending[key] = (offset, length)
+        return self._pending
+
+    def _sorted_index(self):
+        if self._index_map is None:
+            try:
+                self._index_file = open(self.index_path, 'rb')
+            except FileNotFoundError:
+                return None
+            if os.fstat(self._index_file.fileno()).st_size == 0:
+                self._index_file.close()
+                self._index_file = None
+                return None
+            self._index_map = mmap.mmap(self._index_file.fileno(), 0,
+                                        access=mmap.ACCESS_READ)
+        return self._index_map
+
+    def _find_sorted(self, key):
+        index = self._sorted_index()
+        if index is None:
+            return None
+        low, high = 0, len(index) // self.entry.size
+        while low < high:
+            middle = (low + high) // 2
+            entry_key, offset, length = self.entry.unpack_from(
+                index, middle * self.entry.size)
+            if entry_key < key:
+                low = middle + 1
+            elif entry_key > key:
+                high = middle
+            else:
+                return offset, length
+        return None
+
+    def _locate(self, key):
+        return self._load_pending().get(key) or self._find_sorted(key)
+
+    def _read(self, offset, length):
+        if self._data_map is None or offset + length > len(self._data_map):
+            if self._data_map is not None:
+                self._data_map.close()
+                self._data_file.close()
+            self._data_file = open(self.pack_path, 'rb')
+            self._data_map = mmap.mmap(self._data_file.fileno(), 0,
+                                       access=mmap.ACCESS_READ)
+        return self._data_map[offset:offset + length]
+
+    def __contains__(self, digest):
+        with self._lock:
+            return self._locate(bytes.fromhex(digest)) is not None
+
+    def get(self, digest):
+        """
+        Retrieves the raw (annotated) bytes of a descriptor from the pack.
+
+        :param str digest: The hex-encoded digest of the descriptor.
+
+        :returns: :py:class:`bytes`, or *None* if the descriptor is not in the
+                  pack.
+        """
+        with self._lock:
+            location = self._locate(bytes.fromhex(digest))
+            if location is None:
+                return None
+            return self._read(*location)
+
+    def append(self, digest, content):
+        """
+        Appends a descriptor to the pack, unless a descriptor with the same
+        digest is already present.
+
+        :param str digest: The hex-encoded digest of the descriptor.
+        :param bytes content: The raw (annotated) bytes of the descriptor.
+
+        :returns: *True* if the descriptor was appended, or *False* if it was
+                  already present.
+        """
+        key = bytes.fromhex(digest)
+        with self._lock:
+            if self._locate(key) is not None:
+                return False
+            with open(self.pack_path, 'ab') as output:
+                offset = output.seek(0, os.SEEK_END)
+                output.write(content)
+            with open(self.log_path, 'ab') as output:
+                output.write(self.entry.pack(key, offset, len(content)))
+            self._pending[key] = (offset, len(content))
+            if len(self._pending) >= MERGE_THRESHOLD:
+                self._merge_index()
+        return True
+
+    def _entries(self):
+        entries = dict(self._pending_and_sorted())
+        return sorted(entries.items())
+
+    def _pending_and_sorted(self):
+        index = self._sorted_index()
+        if index is not None:
+            for key, offset, length in self.entry.iter_unpack(index):
+                yield key, (offset, length)
+        yield from self._load_pending().items()
+
+    def _merge_index(self):
+        entries = self._entries()
+        temporary_path = self.index_path + ".tmp"
+        with open(temporary_path, 'wb') as output:
+            for key, (offset, length) in entries:
+                output.write(self.entry.pack(key, offset, length))
+            output.flush()
+            os.fsync(output.fileno())
+        if self._index_map is not None:
+            self._index_map.close()
+            self._index_file.close()
+            self._index_map = self._index_file = None
+        os.replace(temporary_path, self.index_path)
+        with open(self.log_path, 'wb'):
+            pass
+        self._pending = {}
+        LOG.debug("Merged index for %s with %d entries", self.pack_path,
+                  len(entries))
+
+    def merge_index(self):
+        """
+        Merges any entries in the log into the sorted index.
+        """
+        with self._lock:
+            if self._load_pending():
+                self._merge_index()
+
+    def digests(self):
+        """
+        Lists the digests of all descriptors in the pack.
+
+        :returns: A sorted :py:class:`list` of hex-encoded digests.
+        """
+        with self._lock:
+            return [key.hex() for key, _ in self._entries()]
+
+    def records(self):
+        """
+        Iterates over the descriptors in the pack in digest order.
+
+        :returns: iterator for (digest, :py:class:`bytes`) tuples
+        """
+        for digest in self.digests():
+            yield digest, self.get(digest)
+
+    def close(self):
+        """
+        Merges any pending entries into the index and closes open files.
+        """
+        self.merge_index()
+        with self._lock:
+            for mapped, opened in [(self._index_map, self._index_file),
+                                   (self._data_map, self._data_file)]:
+                if mapped is not None:
+                    mapped.close()
+                    opened.close()
+            self._index_map = self._index_file = None
+            self._data_map = self._data_file = None
+
+
+class PackStore:
+    """
+    A collection of :py:class:`PackFile` s, one for each type and month.
+
+    :param str pack_path: Path to the directory containing the packs.
+    """
+
+    def __init__(self, pack_path):
+        self.pack_path = pack_path
+        self._packs = {}
+        self._lock = threading.Lock()
+
+    def path_for(self, doctype, month):
+        """
+        The path to the pack file for a type and month. For example:
+
+        >>> store = PackStore("/srv/archive/packs")
+        >>> store.path_for("server-descriptor", datetime.datetime(2018, 11, 19))
+        '/srv/archive/packs/server-descriptor/2018-11.pack'
+        """
+        return os.path.join(self.pack_path, doctype,
+                            f"{month_name(month)}.pack")
+
+    def pack(self, doctype, month, create=False):
+        """
+        Opens the pack for a type and month.
+
+        :param str doctype: One of :py:data:`PACKED_DOCTYPES`.
+        :param ~datetime.datetime month: A time within the month.
+        :param bool create: Create the directory for the pack if it does not
+                            exist.
+
+        :returns: A :py:class:`PackFile`, or *None* if the pack does not exist
+                  and *create* is not set.
+        """
+        path = self.path_for(doctype, month)
+        with self._lock:
+            if path not in self._packs:
+                if not create and not os.path.exists(path):
+                    return None
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                self._packs[path] = PackFile(path, DIGEST_SIZES[doctype])
+            return self._packs[path]
+
+    def months(self, doctype):
+        """
+        Lists the months for which a pack exists for a type.
+
+        :returns: A sorted :py:class:`list` of :py:class:`~datetime.datetime`
+                  for the first day of each month.
+        """
+        try:
+            entries = os.listdir(os.path.join(self.pack_path, doctype))
+        except FileNotFoundError:
+            return []
+        return sorted(
+            datetime.datetime.strptime(entry[:-len(".pack")], "%Y-%m")
+            for entry in entries if entry.endswith(".pack"))
+
+    def close(self):
+        """
+        Closes all open packs.
+        """
+        with self._lock:
+            for pack in self._packs.values():
+                pack.close()
+            self._packs = {}
+
+
+class PackedDirectoryArchive(DirectoryArchive):
+    """
+    A :py:class:`~bushel.archive.DirectoryArchive` storing server
+    descriptors, extra-info descriptors and microdescriptors in packs instead
+    of one file per descriptor. Descriptors that are not found in a pack are
+    looked for in the plain layout, so an existing archive can be migrated a
+    month at a time using :py:meth:`import_plain`.
+
+    :param str archive_path: Either an absolute or relative path to the
+                             location of the directory to use for the archive.
+                             This location must exist, but may be an empty
+                             directory.
+    :param ~bushel.compression.ArchiveCompression compression: Compression to
+        use for network status documents and bandwidth files, which are not
+        packed.
+
+    Other keyword arguments are passed to
+    :py:class:`~bushel.archive.DirectoryArchive`. Packs are kept under the
+    first root, and packed descriptors are always appended to their pack
+    immediately, even when *write_behind* is set.
+    """
+
+    def __init__(self,
+                 archive_path,
+                 max_file_concurrency=100,
+                 compression=ArchiveCompression.UNCOMPRESSED,
+                 **kwargs):
+        super().__init__(archive_path, max_file_concurrency, compression,
+                         **kwargs)
+        self.packs = PackStore(os.path.join(self.archive_path, "packs"))
+
+    async def store(self, descriptor):
+        key = document_key(descriptor)
+        if key is None or key[0] not in PACKED_DOCTYPES:
+            return await super().store(descriptor)
+        doctype, digest, published = key
+        content = prepare_annotated_content(descriptor)
+        pack = self.packs.pack(doctype, published, create=True)
+        LOG.info("Saving: %s to %s", digest, pack.pack_path)
+        loop = asyncio.get_running_loop()
+        async with self._lock_for(pack.pack_path):
+            appended = await loop.run_in_executor(None, pack.append, digest,
+                                                  content)
+        self._count_appended([(appended, len(content))])
+        if not appended:
+            return
+        await loop.run_in_executor(None, self.catalog.add_many,
+                                   [(doctype, published, len(content))])
+        await loop.run_in_executor(
+            None, self._index_documents, [
+                IndexedDocument(doctype, digest,
+                                os.path.relpath(pack.pack_path,
+                                                self.archive_path),
+                                published, len(content))
+            ])
+
+    def _append_batch(self, pack, batch):
+        return [pack.append(digest, content) for digest, content in batch]
+
+    def _count_appended(self, appended):
+        for was_appended, size in appended:
+            outcome = "written" if was_appended else "skipped"
+            self.store_counters[outcome] += 1
+            self.store_counters[f"{outcome}_bytes"] += size
+
+    async def store_many(self, descriptors, batch_size=STORE_BATCH_SIZE):
+        by_pack = defaultdict(list)
+        plain = []
+        for descriptor in descriptors:
+            key = document_key(descriptor)
+            if key is None or key[0] not in PACKED_DOCTYPES:
+                plain.append(descriptor)
+                continue
+            doctype, digest, published = key
+            pack = self.packs.pack(doctype, published, create=True)
+            by_pack[pack].append(
+                (doctype, digest, published,
+                 prepare_annotated_content(descriptor)))
+        count = await super().store_many(plain, batch_size)
+        loop = asyncio.get_running_loop()
+        for pack, items in by_pack.items():
+            async with self._lock_for(pack.pack_path):
+                appended = await loop.run_in_executor(
+                    None, self._append_batch, pack,
+                    [(digest, content) for _, digest, _, content in items])
+            self._count_appended([
+                (was_appended, len(item[3]))
+                for was_appended, item in zip(appended, items)
+            ])
+            await loop.run_in_executor(None, self.catalog.add_many, [
+                (doctype, published, len(content))
+                for was_appended, (doctype, _, published, content) in zip(
+                    appended, items) if was_appended
+            ])
+            await loop.run_in_executor(None, self._index_documents, [
+                IndexedDocument(doctype, digest,
+                                os.path.relpath(pack.pack_path,
+                                                self.archive_path), published,
+                                len(content))
+                for was_appended, (doctype, digest, published, content) in zip(
+                    appended, items) if was_appended
+            ])
+            count += len(items)
+        return count
+
+    def _catalog_extra(self):
+        for doctype in PACKED_DOCTYPES:
+            for month in self.packs.months(doctype):
+                for _, content in self.packs.pack(doctype, month).records():
+                    published = None
+                    if doctype != MICRODESCRIPTOR:
+                        published = scan_published(content)
+                    yield doctype, published or month, len(content)
+
+    def _load_descriptor(self, doctype, digest, hint, parse):
+        if doctype == MICRODESCRIPTOR:
+            key = microdescriptor_hex_digest(digest)
+        else:
+            key = digest.lower()
+        document = self.index.lookup(doctype, key)
+        if document and document.path.endswith(".pack"):
+            month = document.published
+        else:
+            month = hint or valid_after_now()
+        pack = self.packs.pack(doctype, month)
+        raw_content = pack.get(key) if pack is not None else None
+        if raw_content is None:
+            return super()._load_descriptor(doctype, digest, hint, parse)
+        document = None
+        if parse:
+            document = parse_raw(raw_content, self.parser.parsers,
+                                 descriptor_type=DESCRIPTOR_TYPES[doctype])
+            if document is None:
+                return None
+        return None, raw_content, document
+
+    async def server_descriptors(self, month, read_ahead=READ_AHEAD,
+                                 chunk_size=READ_CHUNK_SIZE):
+        """
+        Iterates over the server descriptors in the archive that were
+        published in a month, first those in the pack for the month and then
+        any in the plain layout.
+
+        :param ~datetime.datetime month: A time within the month.
+        :param int read_ahead: The maximum number of chunks to read ahead.
+        :param int chunk_size: The number of descriptors in each chunk.
+
+        :returns: An asynchronous iterator of
+                  :py:class:`~stem.descriptor.server_descriptor.RelayDescriptor`.
+        """
+        pack = self.packs.pack(SERVER_DESCRIPTOR, month)
+        if pack is not None:
+            loop = asyncio.get_running_loop()
+            digests = await loop.run_in_executor(None, pack.digests)
+
+            async def digest_chunks():
+                for i in range(0, len(digests), chunk_size):
+                    yield digests[i:i + chunk_size]
+
+            async for descriptor in self._read_ahead(
+                    digest_chunks(),
+                    functools.partial(self._read_descriptors,
+                                      SERVER_DESCRIPTOR, hint=month),
+                    read_ahead):
+                yield descriptor
+        async for descriptor in super().server_descriptors(
+                month, read_ahead, chunk_size):
+            yield descriptor
+
+    def _plain_files(self, doctype, month):
+        """
+        Lists the files of the plain layout for a type and month, in every
+        root of the archive.
+
+        :returns: An iterator of (path, path relative to its root) tuples.
+        """
+        month_path = plain_month_path(doctype, month)
+        for root in self.shards.roots:
+            for dirpath, _, filenames in os.walk(os.path.join(root,
+                                                              month_path)):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    yield path, os.path.relpath(path, root)
+
+    def _import_plain(self, doctype, month, remove):
+        pack = self.packs.pack(doctype, month, create=True)
+        documents = []
+        for path, relpath in self._plain_files(doctype, month):
+            classified = classify_path(relpath)
+            if classified is None or classified[0] != doctype:
+                continue
+            with open(path, 'rb') as source:
+                content = source.read()
+            pack.append(classified[1], content)
+            documents.append(
+                IndexedDocument(doctype, classified[1],
+                                os.path.relpath(pack.pack_path,
+                                                self.archive_path),
+                                classified[2], len(content)))
+            if remove:
+                os.remove(path)
+        pack.merge_index()
+        self._index_documents(documents)
+        LOG.info("Imported %d %s documents into %s", len(documents), doctype,
+                 pack.pack_path)
+        return len(documents)
+
+    async def import_plain(self, doctype, month, remove=False):
+        """
+        Imports the descriptors of a type for a month from the plain
+        CollecTor File Structure Protocol layout into a pack.
+
+        :param str doctype: One of :py:data:`PACKED_DOCTYPES`.
+        :param ~datetime.datetime month: A time within the month.
+        :param bool remove: Remove the plain files once imported.
+
+        :returns: The number of descriptors imported as an :py:class:`int`.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._import_plain, doctype,
+                                          month, remove)
+
+    def _export_plain(self, doctype, month):
+        pack = self.packs.pack(doctype, month)
+        if pack is None:
+            return 0
+        count = 0
+        for digest, content in pack.records():
+            path = self.path_for(plain_path(doctype, month, digest))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as output:
+                output.write(content)
+            count += 1
+        LOG.info("Exported %d %s documents from %s", count, doctype,
+                 pack.pack_path)
+        return count
+
+    async def export_plain(self, doctype, month):
+        """
+        Exports the descriptors in a pack to the plain CollecTor File
+        Structure Protocol layout. The pack is left in place, and remains the
+        copy that is used by this archive.
+
+        :param str doctype: One of :py:data:`PACKED_DOCTYPES`.
+        :param ~datetime.datetime month: A time within the month.
+
+        :returns: The number of descriptors exported as an :py:class:`int`.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._export_plain, doctype,
+                                          month)
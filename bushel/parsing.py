@@ -0,0 +1,305 @@
+"""
+Executors for parsing archived documents.
+
+Parsing with stem is pure Python, and so parsing in the default thread pool
+is limited to a single core by the GIL. A :py:class:`DescriptorParser` allows
+the archive to choose where parsing happens:
+
+============ ================================================================
+Mode         Description
+============ ================================================================
+THREAD       Parse in the thread that read the document (the default)
+PROCESS      Send raw bytes in chunks to a pool of worker processes
+INLINE       Parse in the event loop thread, useful for debugging
+============ ================================================================
+
+In the process mode, stem's lazy loading is defeated by accessing every
+attribute of each descriptor in the worker, so that the parsing work is
+actually done there rather than on first use in the event loop. Raw content
+is sent in chunks to amortize the cost of pickling.
+
+Every archived document begins with a ``@type`` annotation. The annotation is
+read from the first line with :py:func:`sniff_type`, and is used to choose
+the parser without stem having to work out the type of the document itself.
+A mapping of type names to parsers, such as :py:data:`BUSHEL_PARSERS`, can be
+given to use bushel's own parsers for some types, with stem used for any
+other type. :py:func:`read_raw` gives the type and content without parsing at
+all.
+"""
+
+import asyncio
+import concurrent.futures
+import enum
+import functools
+import logging
+import typing
+
+from stem.descriptor import Descriptor
+from stem.descriptor import DocumentHandler
+from stem.descriptor import TypeAnnotation
+
+from bushel.bandwidth.file import BandwidthFile
+from bushel.directory.detached_signature import DetachedSignature
+from bushel.directory.network_status import NetworkStatusConsensus
+
+LOG = logging.getLogger('bushel')
+
+PARSE_CHUNK_SIZE = 128
+
+
+class ParseMode(enum.Enum):
+    """
+    Enumeration of the places that parsing can be performed. See the module
+    documentation for details.
+    """
+    THREAD = "thread"
+    PROCESS = "process"
+    INLINE = "inline"
+
+
+def sniff_type(raw_content):
+    """
+    Reads the ``@type`` annotation from the first line of a document. For
+    example:
+
+    >>> sniff_type(b"@type network-status-consensus-3 1.0\\nnetwork-status")
+    TypeAnnotation(name='network-status-consensus-3', major_version=1, minor_version=0)
+
+    :param bytes raw_content: The raw document, as :py:class:`bytes` or a
+                              :py:class:`memoryview`.
+
+    :returns: A :py:class:`~stem.descriptor.TypeAnnotation`, or *None* if the
+              document does not start with a valid annotation.
+    """
+    if bytes(raw_content[:6]) != b"@type ":
+        return None
+    first_line = bytes(raw_content[:256]).split(b"\n", 1)[0]
+    fields = first_line[6:].split()
+    if len(fields) != 2:
+        return None
+    try:
+        major, minor = (int(version) for version in fields[1].split(b"."))
+    except ValueError:
+        return None
+    return TypeAnnotation(fields[0].decode('utf-8', 'replace'), major, minor)
+
+
+def _strip_annotation(raw_content):
+    first_line = bytes(raw_content[:256]).find(b"\n")
+    return raw_content[first_line + 1:]
+
+
+class RawDocument(typing.NamedTuple):
+    """
+    An unparsed document and its type.
+    """
+    annotation: TypeAnnotation
+    """The ``@type`` annotation of the document."""
+    content: typing.Union[bytes, memoryview]
+    """
+    The document, without the annotation. Documents that the archive has
+    memory-mapped (see :py:mod:`bushel.archive`) are given as a
+    :py:class:`memoryview` of the mapping rather than copied into
+    :py:class:`bytes`, so use ``bytes(content)`` where :py:class:`bytes`
+    methods are needed.
+    """
+
+
+def read_raw(raw_content):
+    """
+    Splits the type annotation from a document without parsing it. For
+    example:
+
+    >>> read_raw(b"@type bandwidth-file 1.0\\n1542639600\\n").annotation.name
+    'bandwidth-file'
+
+    :param raw_content: The raw document, as :py:class:`bytes` or a
+                        :py:class:`memoryview`. The content of the
+                        :py:class:`RawDocument` is of the same type.
+
+    :returns: A :py:class:`RawDocument`, or *None* if the document does not
+              start with a type annotation.
+    """
+    annotation = sniff_type(raw_content)
+    if annotation is None:
+        return None
+    return RawDocument(annotation, _strip_annotation(raw_content))
+
+
+def _parse_directory_document(document):
+    document.parse()
+    return document
+
+
+def parse_network_status_consensus(raw_content):
+    """
+    Parses a consensus with :py:class:`~bushel.directory.network_status.NetworkStatusConsensus`.
+    """
+    return _parse_directory_document(NetworkStatusConsensus(raw_content))
+
+
+def parse_detached_signature(raw_content):
+    """
+    Parses a detached signature with
+    :py:class:`~bushel.directory.detached_signature.DetachedSignature`.
+    """
+    return _parse_directory_document(DetachedSignature(raw_content))
+
+
+BUSHEL_PARSERS = {
+    "network-status-consensus-3": parse_network_status_consensus,
+    "network-status-microdesc-consensus-3": parse_network_status_consensus,
+    "detached-signature-3": parse_detached_signature,
+    "bandwidth-file": BandwidthFile,
+}
+"""
+bushel's own parsers, keyed by the type name in the ``@type`` annotation.
+Each parser is given the document without its annotation. Parsers are
+module-level functions or classes so that they can be used in worker
+processes.
+"""
+
+
+def parse_raw(raw_content, parsers=None, **kwargs):
+    """
+    Parses a document from bytes. This is a blocking function.
+
+    If the document has a ``@type`` annotation and its type is in *parsers*,
+    that parser is used. Otherwise the document is parsed with stem, using
+    the type from the annotation unless a *descriptor_type* is given.
+
+    :param bytes raw_content: Bytes to construct the descriptor from.
+    :param dict parsers: Parsers to use instead of stem, keyed by type name,
+                         such as :py:data:`BUSHEL_PARSERS`.
+    :param kwargs dict: Additional arguments for
+                          :meth:`stem.descriptor.Descriptor.from_str`.
+
+    :returns: :class:`stem.descriptor.Descriptor` subclass for the given
+              content, or *None* if no descriptor could be parsed. A document
+              that one of *parsers* fails to parse is logged and *None* is
+              returned, so that a single malformed document does not stop
+              the caller.
+    """
+    if parsers or "descriptor_type" not in kwargs:
+        annotation = sniff_type(raw_content)
+        if annotation is not None:
+            if parsers and annotation.name in parsers:
+                try:
+                    return parsers[annotation.name](
+                        _strip_annotation(raw_content))
+                except Exception:  # pylint: disable=broad-except
+                    LOG.exception("Failed to parse %s document",
+                                  annotation.name)
+                    return None
+            kwargs.setdefault(
+                "descriptor_type", f"{annotation.name} "
+                f"{annotation.major_version}.{annotation.minor_version}")
+    try:
+        return Descriptor.from_str(
+            raw_content,
+            document_handler=DocumentHandler.DOCUMENT,  # pylint: disable=no-member
+            **kwargs)
+    except StopIteration:
+        # TODO: Move the file we tried to open into some area for later
+        # inspection so that we can download this again!
+        return None
+
+
+def _parse_chunk(raw_contents, kwargs, eager=False, parsers=None):
+    descriptors = []
+    for raw_content in raw_contents:
+        descriptor = parse_raw(raw_content, parsers, **kwargs)
+        if eager and descriptor is not None:
+            for attribute in getattr(descriptor, "ATTRIBUTES", ()):
+                getattr(descriptor, attribute)
+        descriptors.append(descriptor)
+    return descriptors
+
+
+class DescriptorParser:
+    """
+    Parses documents using the configured :py:class:`ParseMode`.
+
+    :param ParseMode mode: Where parsing is to be performed.
+    :param int max_workers: The maximum number of worker processes for the
+                            process mode, defaults to the number of CPUs.
+    :param int chunk_size: The maximum number of documents to send to a
+                           worker process at once.
+    :param dict parsers: Parsers to use instead of stem, keyed by type name,
+                         see :py:func:`parse_raw`.
+    """
+
+    def __init__(self, mode=ParseMode.THREAD, max_workers=None,
+                 chunk_size=PARSE_CHUNK_SIZE, parsers=None):
+        self.mode = ParseMode(mode)
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.parsers = parsers
+        self._pool = None
+
+    @property
+    def parses_in_reader(self):
+        """
+        *True* if documents should be parsed by the thread that read them.
+        """
+        return self.mode is ParseMode.THREAD
+
+    def _process_pool(self):
+        if self._pool is None:
+            self._pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.max_workers)
+        return self._pool
+
+    def close(self):
+        """
+        Shuts down any worker processes.
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    async def parse_many(self, raw_contents, **kwargs):
+        """
+        Parses multiple documents of the same type.
+
+        :param list(bytes) raw_contents: The raw content of each document.
+        :param kwargs dict: Additional arguments for
+                            :meth:`stem.descriptor.Descriptor.from_str`.
+
+        :returns: A :py:class:`list` with the parsed document, or *None*,
+                  for each of the raw contents in order.
+        """
+        raw_contents = list(raw_contents)
+        if self.mode is ParseMode.INLINE:
+            return _parse_chunk(raw_contents, kwargs, parsers=self.parsers)
+        loop = asyncio.get_running_loop()
+        if self.mode is ParseMode.THREAD:
+            return await loop.run_in_executor(None, _parse_chunk, raw_contents,
+                                              kwargs, False, self.parsers)
+        # Memory-mapped content cannot be pickled
+        raw_contents = [bytes(raw_content) for raw_content in raw_contents]
+        chunks = await asyncio.gather(*[
+            loop.run_in_executor(self._process_pool(), _parse_chunk,
+                                 raw_contents[i:i + self.chunk_size], kwargs,
+                                 True, self.parsers)
+            for i in range(0, len(raw_contents), self.chunk_size)
+        ])
+        return [descriptor for chunk in chunks for descriptor in chunk]
+
+    async def parse(self, raw_content, **kwargs):
+        """
+        Parses a single document.
+
+        :param bytes raw_content: Bytes to construct the descriptor from.
+        :param kwargs dict: Additional arguments for
+                            :meth:`stem.descriptor.Descriptor.from_str`.
+
+        :returns: :class:`stem.descriptor.Descriptor` subclass for the given
+                  content, or *None* if no descriptor could be parsed.
+        """
+        if self.mode is ParseMode.THREAD:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                None, functools.partial(parse_raw, raw_content, self.parsers,
+                                        **kwargs))
+        return (await self.parse_many([raw_content], **kwargs))[0]
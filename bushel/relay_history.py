@@ -0,0 +1,287 @@
+"""
+Persistent history of each relay's status in the consensus.
+
+Following a relay over time would otherwise require parsing every consensus
+in the range. The :py:class:`RelayHistory` instead records, for each relay
+fingerprint, runs of consecutive consensuses in which the relay's entry was
+unchanged::
+
+    fingerprint  start             end               digest  flags  bandwidth
+    9695DFC3...  2018-11-19 15:00  2018-11-20 03:00  a1b2... 0x1d0  8200
+
+Each run covers the half-open interval from the valid-after time of its first
+consensus to the fresh-until time of its last consensus. A consensus in which
+the relay's descriptor digest, flags and bandwidth weight are the same as in
+the previous consensus only extends the run, so a relay that does not change
+costs nothing per hour. Runs are merged whichever order consensuses are added
+in, and adding a consensus twice has no effect.
+
+Flags are stored as a bitmask using the positions in :py:data:`FLAGS`. Flags
+that are not known are not recorded.
+
+The history is kept in an SQLite database in the archive's state and is
+updated whenever a consensus is stored. For example::
+
+    fingerprint = "9695DFC35FFEB861329B9F1AB04C46397020CE31"
+    for run in archive.relay_history.runs(fingerprint):
+        print(run.start, run.end, run.flag_names)
+"""
+
+import datetime
+import logging
+import os
+import os.path
+import sqlite3
+import threading
+import typing
+
+LOG = logging.getLogger('bushel')
+
+FLAGS = [
+    "Authority", "BadExit", "Exit", "Fast", "Guard", "HSDir", "MiddleOnly",
+    "NoEdConsensus", "Running", "Stable", "StaleDesc", "Sybil", "V2Dir",
+    "Valid"
+]
+"""
+Known relay flags, in the order of their bits in a flags bitmask. New flags
+must only ever be appended, as the bitmasks are persisted.
+"""
+
+
+def flags_mask(flags):
+    """
+    Encodes relay flags as a bitmask. For example:
+
+    >>> flags_mask(["Fast", "Guard", "Running", "Unknown"])
+    280
+
+    :param flags: An iterable of flag names.
+
+    :returns: The bitmask as an :py:class:`int`.
+    """
+    mask = 0
+    for flag in flags:
+        if flag in FLAGS:
+            mask |= 1 << FLAGS.index(flag)
+    return mask
+
+
+def flag_names(mask):
+    """
+    Decodes a bitmask of relay flags. For example:
+
+    >>> flag_names(280)
+    ['Fast', 'Guard', 'Running']
+
+    :param int mask: The bitmask.
+
+    :returns: A :py:class:`list` of flag names.
+    """
+    return [flag for bit, flag in enumerate(FLAGS) if mask & (1 << bit)]
+
+
+def _timestamp(value):
+    return value.isoformat(" ")
+
+
+class RelayRun(typing.NamedTuple):
+    """
+    Consecutive consensuses in which a relay's entry was unchanged.
+    """
+    fingerprint: str
+    """The upper-case hex-encoded fingerprint of the relay."""
+    start: datetime.datetime
+    """The valid-after time of the first consensus."""
+    end: datetime.datetime
+    """The fresh-until time of the last consensus."""
+    digest: typing.Optional[str]
+    """The lower-case hex-encoded digest of the server descriptor."""
+    flags: int
+    """The flags assigned to the relay, as a bitmask."""
+    bandwidth: typing.Optional[int]
+    """The bandwidth weight of the relay."""
+
+    @property
+    def flag_names(self):
+        """The flags assigned to the relay, as a list of names."""
+        return flag_names(self.flags)
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row[0], datetime.datetime.fromisoformat(row[1]),
+                   datetime.datetime.fromisoformat(row[2]), row[3], row[4],
+                   row[5])
+
+
+class RelayHistory:
+    """
+    Run-length encoded history of relay statuses from consensuses.
+
+    All methods perform blocking I/O, although queries are fast enough to be
+    performed directly from an :py:mod:`asyncio` event loop. The database is
+    only created when the first consensus is added, so that read-only
+    archives are not modified.
+
+    :param str history_path: Path to the SQLite database file.
+    """
+
+    def __init__(self, history_path):
+        self.history_path = history_path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self, create):
+        if self._connection is None:
+            if not create and not os.path.exists(self.history_path):
+                return None
+            os.makedirs(os.path.dirname(self.history_path), exist_ok=True)
+            connection = sqlite3.connect(self.history_path,
+                                         check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS runs ("
+                               "fingerprint TEXT NOT NULL, "
+                               "start TIMESTAMP NOT NULL, "
+                               "end TIMESTAMP NOT NULL, "
+                               "digest TEXT, "
+                               "flags INTEGER NOT NULL, "
+                               "bandwidth INTEGER, "
+                               "PRIMARY KEY (fingerprint, start)) "
+                               "WITHOUT ROWID")
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS runs_end ON runs (end)")
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def close(self):
+        """
+        Closes the connection to the database, if open.
+        """
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def add_consensus(self, consensus):
+        """
+        Records the status of every relay in a consensus, in a single
+        transaction.
+
+        :param ~stem.descriptor.networkstatus.NetworkStatusDocumentV3 consensus:
+            An unflavored consensus.
+
+        :returns: The number of runs that were started, as an
+                  :py:class:`int`.
+        """
+        start = _timestamp(consensus.valid_after)
+        end = _timestamp(consensus.fresh_until)
+        started = 0
+        with self._lock:
+            connection = self._connect(create=True)
+            with connection:
+                # Only runs that are current at this consensus, or that
+                # begin as it ends, can be extended or merged.
+                touching = {}
+                for row in connection.execute(
+                        "SELECT * FROM runs WHERE end >= ? AND start <= ?",
+                        (start, end)):
+                    touching.setdefault(row[0], []).append(row)
+                for router in consensus.routers.values():
+                    state = (router.digest.lower() if router.digest else None,
+                             flags_mask(router.flags), router.bandwidth)
+                    runs = touching.get(router.fingerprint, [])
+                    if any(r[1] <= start < r[2] for r in runs):
+                        continue
+                    before = [r for r in runs if r[2] == start
+                              and tuple(r[3:]) == state]
+                    after = [r for r in runs if r[1] == end
+                             and tuple(r[3:]) == state]
+                    if before and after:
+                        connection.execute(
+                            "DELETE FROM runs WHERE fingerprint = ? AND "
+                            "start = ?", (router.fingerprint, after[0][1]))
+                        connection.execute(
+                            "UPDATE runs SET end = ? WHERE fingerprint = ? "
+                            "AND start = ?",
+                            (after[0][2], router.fingerprint, before[0][1]))
+                    elif before:
+                        connection.execute(
+                            "UPDATE runs SET end = ? WHERE fingerprint = ? "
+                            "AND start = ?",
+                            (end, router.fingerprint, before[0][1]))
+                    elif after:
+                        connection.execute(
+                            "UPDATE runs SET start = ? WHERE fingerprint = ? "
+                            "AND start = ?",
+                            (start, router.fingerprint, after[0][1]))
+                    else:
+                        connection.execute(
+                            "INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?)",
+                            (router.fingerprint, start, end) + state)
+                        started += 1
+        LOG.debug("Added consensus %s to relay history, %d new runs",
+                  consensus.valid_after, started)
+        return started
+
+    def runs(self, fingerprint, start=None, end=None):
+        """
+        Retrieves the history of a relay.
+
+        :param str fingerprint: The fingerprint of the relay.
+        :param ~datetime.datetime start: If set, only include runs that end
+                                         after this time.
+        :param ~datetime.datetime end: If set, only include runs that start
+                                       before this time.
+
+        :returns: A :py:class:`list` of :py:class:`RelayRun`, ordered by
+                  start time.
+        """
+        query = "SELECT * FROM runs WHERE fingerprint = ?"
+        parameters = [fingerprint.lstrip("$").upper()]
+        if start is not None:
+            query += " AND end > ?"
+            parameters.append(_timestamp(start))
+        if end is not None:
+            query += " AND start < ?"
+            parameters.append(_timestamp(end))
+        query += " ORDER BY start"
+        with self._lock:
+            connection = self._connect(create=False)
+            if connection is None:
+                return []
+            rows = connection.execute(query, parameters).fetchall()
+        return [RelayRun.from_row(row) for row in rows]
+
+    def relays_with_flag(self, flag, start, end):
+        """
+        Finds the relays that held a flag at any time between two times.
+
+        :param str flag: The name of the flag, one of :py:data:`FLAGS`.
+        :param ~datetime.datetime start: The start of the period.
+        :param ~datetime.datetime end: The end of the period.
+
+        :returns: A sorted :py:class:`list` of fingerprints.
+
+        :raises ValueError: If the flag is not known.
+        """
+        if flag not in FLAGS:
+            raise ValueError(f"Unknown relay flag {flag}")
+        with self._lock:
+            connection = self._connect(create=False)
+            if connection is None:
+                return []
+            rows = connection.execute(
+                "SELECT DISTINCT fingerprint FROM runs WHERE end > ? AND "
+                "start < ? AND flags & ? ORDER BY fingerprint",
+                (_timestamp(start), _timestamp(end), flags_mask([flag])))
+            return [row[0] for row in rows]
+
+    def clear(self):
+        """
+        Removes all runs, before rebuilding the history.
+        """
+        with self._lock:
+            connection = self._connect(create=True)
+            with connection:
+                connection.execute("DELETE FROM runs")
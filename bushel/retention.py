@@ -0,0 +1,498 @@
+"""
+Retention and compaction policies for a
+:py:class:`~bushel.archive.DirectoryArchive`.
+
+A long-running scraper adds documents to the archive forever. A
+:py:class:`RetentionPolicy` describes which documents are no longer worth
+keeping, and how old months should be stored more compactly:
+
+========================= ====================================================
+Action                    Description
+========================= ====================================================
+Expire                    Removes server descriptors, extra-info descriptors
+                          or microdescriptors that are not referenced by any
+                          archived consensus in the last N months
+Compact                   Compresses uncompressed statuses older than N months
+                          and, for a
+                          :py:class:`~bushel.pack.PackedDirectoryArchive`,
+                          moves descriptors older than N months into packs
+========================= ====================================================
+
+The references are found by scanning the archived consensuses, without
+parsing them, and collected into a :py:class:`SortedDigestSet`. Server
+descriptors are referenced by consensuses and microdescriptors by
+microdesc-flavored consensuses. Extra-info descriptors are referenced by the
+``extra-info-digest`` line of referenced server descriptors, so that expiring
+them follows the closure of the references.
+
+Only months that ended before the start of the window are expired or
+compacted. A scraper storing new documents only writes to the current months,
+so a policy can be applied while a scraper is running against the same
+archive. Expired documents are removed from the index and the catalog, so if
+a scraper does fetch one again it is stored as a new document.
+
+If no references are found for a type of document, for example because
+consensuses are not archived, nothing of that type is expired. Documents that
+are already in packs are not expired, as packs are append-only. For
+example::
+
+    policy = RetentionPolicy(expire={MICRODESCRIPTOR: 6}, compact_after=3)
+    report = await apply_retention(archive, policy, dry_run=True)
+    print(report["reclaimed_bytes"])
+"""
+
+import asyncio
+import base64
+import bisect
+import collections
+import datetime
+import logging
+import os
+import os.path
+import re
+
+from bushel.catalog import CONSENSUS
+from bushel.catalog import MICRODESC_CONSENSUS
+from bushel.catalog import classify_catalog_path
+from bushel.collector.filesystem import CollectorOutRelayDescsMarker
+from bushel.collector.filesystem import CollectorOutSubdirectory
+from bushel.compression import ArchiveCompression
+from bushel.compression import compression_for_path
+from bushel.index import BANDWIDTH_FILE
+from bushel.index import EXTRA_INFO
+from bushel.index import MICRODESCRIPTOR
+from bushel.index import SERVER_DESCRIPTOR
+from bushel.index import VOTE
+from bushel.index import IndexedDocument
+from bushel.index import classify_path
+from bushel.pack import PACKED_DOCTYPES
+from bushel.pack import PackedDirectoryArchive
+from bushel.pack import plain_month_path
+
+LOG = logging.getLogger('bushel')
+
+EXPIRABLE_DOCTYPES = [SERVER_DESCRIPTOR, EXTRA_INFO, MICRODESCRIPTOR]
+"""
+The types of document that can be expired when unreferenced.
+"""
+
+COMPACTED_DOCTYPES = [CONSENSUS, MICRODESC_CONSENSUS, VOTE, BANDWIDTH_FILE]
+"""
+The types of document that are compressed when compacting.
+"""
+
+_DIGEST_SIZES = {
+    SERVER_DESCRIPTOR: 20,
+    EXTRA_INFO: 20,
+    MICRODESCRIPTOR: 32,
+}
+
+_STATUS_DIRECTORIES = {
+    CONSENSUS: (CollectorOutRelayDescsMarker.CONSENSUS, None),
+    MICRODESC_CONSENSUS: (CollectorOutRelayDescsMarker.MICRODESC,
+                          "consensus-microdesc"),
+    VOTE: (CollectorOutRelayDescsMarker.VOTE, None),
+    BANDWIDTH_FILE: (CollectorOutRelayDescsMarker.BANDWIDTHS, None),
+}
+
+_DESCRIPTOR_REFERENCE = re.compile(rb"^r \S+ \S+ (\S+) ", re.MULTILINE)
+_MICRODESCRIPTOR_REFERENCE = re.compile(rb"^m (\S+)$", re.MULTILINE)
+_EXTRA_INFO_REFERENCE = re.compile(rb"^extra-info-digest ([0-9A-Fa-f]{40})",
+                                   re.MULTILINE)
+
+
+class SortedDigestSet:
+    """
+    A compact, immutable set of digests. The digests are held as a single
+    sorted :py:class:`bytes` object and membership is tested by binary
+    search, so that a set of millions of digests needs only the size of the
+    digests themselves.
+
+    >>> digests = SortedDigestSet(["ff" * 20, "00" * 20, "ff" * 20], 20)
+    >>> len(digests)
+    2
+    >>> "00" * 20 in digests, "01" * 20 in digests
+    (True, False)
+
+    :param digests: An iterable of hex-encoded digests.
+    :param int digest_size: The size of each digest in bytes.
+    """
+
+    def __init__(self, digests, digest_size):
+        self.digest_size = digest_size
+        self._digests = b"".join(
+            sorted({bytes.fromhex(digest)
+                    for digest in digests}))
+
+    def __len__(self):
+        return len(self._digests) // self.digest_size
+
+    def __getitem__(self, index):
+        start = index * self.digest_size
+        return self._digests[start:start + self.digest_size]
+
+    def __contains__(self, digest):
+        key = bytes.fromhex(digest)
+        index = bisect.bisect_left(self, key)
+        return index < len(self) and self[index] == key
+
+
+def _hex_digest(encoded):
+    encoded = encoded.rstrip(b"=")
+    return base64.b64decode(encoded + b"=" * (-len(encoded) % 4)).hex()
+
+
+def scan_references(doctype, content):
+    """
+    Finds the digests of the descriptors referenced by a consensus without
+    parsing it. For example:
+
+    >>> scan_references(CONSENSUS, b"r test AAAAAAAAAAAAAAAAAAAAAAAAAAA "
+    ...                 b"/////////////////////////// 2018-11-19 15:00:00 "
+    ...                 b"127.0.0.1 9001 0\\n")
+    ['ffffffffffffffffffffffffffffffffffffffff']
+
+    :param str doctype: Either :py:data:`~bushel.catalog.CONSENSUS` or
+                        :py:data:`~bushel.catalog.MICRODESC_CONSENSUS`.
+    :param bytes content: The uncompressed consensus.
+
+    :returns: A :py:class:`list` of lower-case hex-encoded digests of server
+              descriptors or microdescriptors.
+    """
+    pattern = _DESCRIPTOR_REFERENCE if doctype == CONSENSUS \
+        else _MICRODESCRIPTOR_REFERENCE
+    return [_hex_digest(encoded) for encoded in pattern.findall(content)]
+
+
+def months_before(now, months):
+    """
+    The start of the month a number of months before the month containing a
+    time. For example:
+
+    >>> months_before(datetime.datetime(2019, 2, 15), 3)
+    datetime.datetime(2018, 11, 1, 0, 0)
+
+    :param ~datetime.datetime now: The time.
+    :param int months: The number of months.
+
+    :rtype: ~datetime.datetime
+    """
+    index = now.year * 12 + now.month - 1 - months
+    return datetime.datetime(index // 12, index % 12 + 1, 1)
+
+
+def _months_between(start, end):
+    month = datetime.datetime(start.year, start.month, 1)
+    while month <= end:
+        yield month
+        month = months_before(month, -1)
+
+
+def status_month_path(doctype, month):
+    """
+    The directory, relative to the archive root, containing all the statuses
+    of a type for a month. For example:
+
+    >>> status_month_path(MICRODESC_CONSENSUS, datetime.datetime(2018, 11, 1))
+    'relay-descriptors/microdesc/2018/11/consensus-microdesc'
+
+    :param str doctype: One of :py:data:`COMPACTED_DOCTYPES`.
+    :param ~datetime.datetime month: A time within the month.
+
+    :returns: Path as a :py:class:`str`.
+    """
+    marker, leaf = _STATUS_DIRECTORIES[doctype]
+    path = os.path.join(CollectorOutSubdirectory.RELAY_DESCRIPTORS.value,
+                        marker.value, f"{month:%Y}", f"{month:%m}")
+    return os.path.join(path, leaf) if leaf else path
+
+
+def _month_path(doctype, month):
+    if doctype in _STATUS_DIRECTORIES:
+        return status_month_path(doctype, month)
+    return plain_month_path(doctype, month)
+
+
+def _archived_months(archive, doctype):
+    """
+    Lists the months for which any root holds documents of a type.
+    """
+    parts = _month_path(doctype, datetime.datetime(2000, 1, 1)).split(os.sep)
+    marker = os.path.join(*parts[:parts.index("2000")])
+    months = set()
+    for root in archive.shards.roots:
+        try:
+            years = os.listdir(os.path.join(root, marker))
+        except FileNotFoundError:
+            continue
+        for year in years:
+            try:
+                for month in os.listdir(os.path.join(root, marker, year)):
+                    months.add(datetime.datetime(int(year), int(month), 1))
+            except (NotADirectoryError, ValueError):
+                continue
+    return sorted(months)
+
+
+def _month_files(archive, doctype, month):
+    """
+    Lists the files of a type for a month, in every root of the archive.
+
+    :returns: An iterator of (path, path relative to its root) tuples.
+    """
+    relative = _month_path(doctype, month)
+    for root in archive.shards.roots:
+        for dirpath, _, filenames in os.walk(os.path.join(root, relative)):
+            for filename in filenames:
+                if filename.startswith("."):
+                    # Temporary files of an interrupted write
+                    continue
+                path = os.path.join(dirpath, filename)
+                yield path, os.path.relpath(path, root)
+
+
+def _read(path):
+    with open(path, 'rb') as document:
+        return compression_for_path(path).decompress(document.read())
+
+
+class RetentionPolicy:
+    """
+    Describes which documents to keep in an archive.
+
+    :param dict expire: Maps each of :py:data:`EXPIRABLE_DOCTYPES` to the
+                        number of months of consensuses to find references
+                        in. Documents that are not referenced, and are in a
+                        month before those months, are expired.
+    :param int compact_after: The number of months after which months are
+                              compacted, or *None* to not compact.
+
+    :raises ValueError: if a type of document cannot be expired.
+    """
+
+    def __init__(self, expire=None, compact_after=None):
+        self.expire = dict(expire or {})
+        for doctype in self.expire:
+            if doctype not in EXPIRABLE_DOCTYPES:
+                raise ValueError(f"Documents of type {doctype} cannot be "
+                                 "expired")
+        self.compact_after = compact_after
+
+
+class RetentionRun:
+    """
+    A single application of a :py:class:`RetentionPolicy` to an archive,
+    see :py:func:`apply_retention`.
+    """
+
+    def __init__(self, archive, policy, dry_run, now):
+        self.archive = archive
+        self.policy = policy
+        self.dry_run = dry_run
+        self.now = now
+        self.report = collections.Counter()
+        self._referenced = {}
+
+    def _scan_consensuses(self, doctype, start):
+        digests = []
+        for month in _months_between(start, self.now):
+            for path, relative in _month_files(self.archive, doctype,
+                                               month):
+                valid_after = classify_catalog_path(relative)
+                if valid_after is None or valid_after[1] < start:
+                    continue
+                digests.extend(scan_references(doctype, _read(path)))
+        return digests
+
+    def _scan_extra_info_references(self, servers, start):
+        digests = []
+
+        def scan(digest, content):
+            if digest in servers:
+                digests.extend(
+                    match.decode('ascii').lower()
+                    for match in _EXTRA_INFO_REFERENCE.findall(content))
+
+        # Descriptors referenced at the start of the window may have been
+        # published during the previous month
+        for month in _months_between(months_before(start, 1), self.now):
+            for path, relative in _month_files(self.archive,
+                                               SERVER_DESCRIPTOR, month):
+                classified = classify_path(relative)
+                if classified is not None:
+                    scan(classified[1], _read(path))
+            if isinstance(self.archive, PackedDirectoryArchive):
+                pack = self.archive.packs.pack(SERVER_DESCRIPTOR, month)
+                if pack is not None:
+                    for digest, content in pack.records():
+                        scan(digest, content)
+        return digests
+
+    def referenced(self, doctype, start):
+        """
+        Finds the documents of a type referenced since the start of a
+        window. This performs blocking I/O.
+
+        :rtype: SortedDigestSet
+        """
+        key = (doctype, start)
+        if key not in self._referenced:
+            if doctype == MICRODESCRIPTOR:
+                digests = self._scan_consensuses(MICRODESC_CONSENSUS, start)
+            elif doctype == SERVER_DESCRIPTOR:
+                digests = self._scan_consensuses(CONSENSUS, start)
+            else:
+                digests = self._scan_extra_info_references(
+                    self.referenced(SERVER_DESCRIPTOR, start), start)
+            self._referenced[key] = SortedDigestSet(digests,
+                                                    _DIGEST_SIZES[doctype])
+            LOG.info("Found %d %s documents referenced since %s",
+                     len(self._referenced[key]), doctype, start)
+        return self._referenced[key]
+
+    def expire_month(self, doctype, month, referenced):
+        """
+        Expires the unreferenced documents of a type in a month. This
+        performs blocking I/O.
+        """
+        expired = []
+        for path, relative in _month_files(self.archive, doctype, month):
+            classified = classify_path(relative)
+            if classified is None or classified[1] in referenced:
+                continue
+            size = os.path.getsize(path)
+            if not self.dry_run:
+                os.remove(path)
+            expired.append((classified[1], classified[2], size))
+        self.report["expired"] += len(expired)
+        self.report["expired_bytes"] += sum(size for _, _, size in expired)
+        if expired and not self.dry_run:
+            self.archive.index.remove_many(
+                [(doctype, digest) for digest, _, _ in expired])
+            self.archive.catalog.remove_many(
+                [(doctype, timestamp, size)
+                 for _, timestamp, size in expired])
+            LOG.info("Expired %d %s documents from %s", len(expired),
+                     doctype, f"{month:%Y-%m}")
+
+    def compact_month(self, doctype, month, compression):
+        """
+        Compresses the uncompressed statuses of a type in a month. Each
+        compressed file is written to a temporary file and renamed into
+        place before the uncompressed file is removed, so that readers always
+        find one or the other. This performs blocking I/O.
+        """
+        removed, added, indexed = [], [], []
+        for path, relative in _month_files(self.archive, doctype, month):
+            if compression_for_path(path) is not \
+                  ArchiveCompression.UNCOMPRESSED:
+                continue
+            with open(path, 'rb') as document:
+                content = document.read()
+            compressed = compression.compress(content)
+            if len(compressed) >= len(content):
+                continue
+            self.report["compacted"] += 1
+            self.report["compacted_bytes"] += len(content) - len(compressed)
+            if self.dry_run:
+                continue
+            directory, filename = os.path.split(path)
+            temporary_path = os.path.join(directory,
+                                          f".{filename}.compact.tmp")
+            with open(temporary_path, 'wb') as output:
+                output.write(compressed)
+            os.replace(temporary_path, path + compression.extension)
+            os.remove(path)
+            timestamp = classify_catalog_path(relative)[1]
+            removed.append((doctype, timestamp, len(content)))
+            added.append((doctype, timestamp, len(compressed)))
+            classified = classify_path(relative)
+            if classified is not None:
+                indexed.append(
+                    IndexedDocument(classified[0], classified[1],
+                                    relative + compression.extension,
+                                    classified[2], len(compressed)))
+        if removed:
+            self.archive.catalog.remove_many(removed)
+            self.archive.catalog.add_many(added)
+        if indexed:
+            self.archive.index.add_many(indexed)
+
+    async def _pack_month(self, doctype, month):
+        if self.dry_run:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                None, lambda: sum(
+                    1 for _ in _month_files(self.archive, doctype, month)))
+        return await self.archive.import_plain(doctype, month, remove=True)
+
+    async def run(self):
+        """
+        Applies the policy. See :py:func:`apply_retention`.
+        """
+        loop = asyncio.get_running_loop()
+        for doctype, months in self.policy.expire.items():
+            start = months_before(self.now, months)
+            referenced = await loop.run_in_executor(None, self.referenced,
+                                                    doctype, start)
+            if not referenced:
+                # Most likely the consensuses are not being archived, and
+                # expiring would remove every document
+                LOG.warning("No %s documents referenced since %s, not "
+                            "expiring", doctype, start)
+                continue
+            for month in await loop.run_in_executor(None, _archived_months,
+                                                    self.archive, doctype):
+                if month >= start:
+                    break
+                await loop.run_in_executor(None, self.expire_month, doctype,
+                                           month, referenced)
+        if self.policy.compact_after is not None:
+            start = months_before(self.now, self.policy.compact_after)
+            compression = self.archive.compression
+            if compression is ArchiveCompression.UNCOMPRESSED:
+                compression = ArchiveCompression.XZ
+            for doctype in COMPACTED_DOCTYPES:
+                for month in await loop.run_in_executor(
+                        None, _archived_months, self.archive, doctype):
+                    if month >= start:
+                        break
+                    await loop.run_in_executor(None, self.compact_month,
+                                               doctype, month, compression)
+            if isinstance(self.archive, PackedDirectoryArchive):
+                for doctype in PACKED_DOCTYPES:
+                    for month in await loop.run_in_executor(
+                            None, _archived_months, self.archive, doctype):
+                        if month >= start:
+                            break
+                        self.report["packed"] += await self._pack_month(
+                            doctype, month)
+        report = {name: self.report[name]
+                  for name in ("expired", "expired_bytes", "compacted",
+                               "compacted_bytes", "packed")}
+        report["reclaimed_bytes"] = (report["expired_bytes"] +
+                                     report["compacted_bytes"])
+        LOG.info("%s %d bytes", "Would reclaim" if self.dry_run
+                 else "Reclaimed", report["reclaimed_bytes"])
+        return report
+
+
+async def apply_retention(archive, policy, dry_run=False, now=None):
+    """
+    Applies a retention policy to an archive, first expiring unreferenced
+    documents and then compacting old months.
+
+    :param ~bushel.archive.DirectoryArchive archive: The archive.
+    :param RetentionPolicy policy: The policy.
+    :param bool dry_run: Only report what would be done.
+    :param ~datetime.datetime now: The current time, defaulting to the
+                                   current UTC time.
+
+    :returns: A :py:class:`dict` with the number and bytes of documents
+              "expired", the number "compacted" and the bytes saved by
+              compacting them ("compacted_bytes"), the number of descriptors
+              "packed", and the total "reclaimed_bytes".
+    """
+    run = RetentionRun(archive, policy, dry_run,
+                       now or datetime.datetime.utcnow())
+    return await run.run()
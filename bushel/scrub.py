@@ -61,6 +61,15 @@ class DirectoryArchiveScrubber:
                     for key in result:
                         stats[key] += result[key]
                 print_stats(stats)
+        for doctype, bloom_stats in self.archive.bloom_filter_stats().items():
+            LOG.info(f"Bloom filter for {doctype}: skipped "
+                     f"{bloom_stats['negatives']} lookups, false-positive "
+                     f"rate {bloom_stats['false_positive_rate']:.4f}")
+        store_stats = self.archive.store_stats()
+        LOG.info(f"Stored {store_stats['written']} documents "
+                 f"({store_stats['written_bytes']} bytes), skipped "
+                 f"{store_stats['skipped']} already archived "
+                 f"({store_stats['skipped_bytes']} bytes)")
 
     async def scrub_status_entry(self, valid_after, status, ignore_extra_info, max_concurrency_lock):
         stats = {
@@ -0,0 +1,232 @@
+"""
+Sharding of a :py:class:`~bushel.archive.DirectoryArchive` across multiple
+roots, such as one directory on each of several disks.
+
+Every document keeps the path it would have in the CollecTor File Structure
+Protocol layout, relative to whichever root it is stored under. The root is
+chosen deterministically from that relative path:
+
+===================================== =====================================
+Documents                             Sharded by
+===================================== =====================================
+Server, extra-info and                The first two hex digits of the digest,
+microdescriptors (relay and bridge)   which name the directories holding them
+Consensuses, votes, bandwidth files   The month of the valid-after or
+and bridge statuses                   published time
+Everything else (including bushel's   Always the first root
+own state and packs)
+===================================== =====================================
+
+Sharding descriptors by the leading digits of their digest keeps each
+directory of the layout on a single root, while spreading the descriptors
+referenced by any one consensus evenly across all roots. Sharding statuses by
+month keeps the documents needed for a time range together.
+
+Changing the number of roots changes where documents belong. After adding a
+root, :py:meth:`ArchiveShards.rebalance` moves documents to their new roots.
+Because the relative paths do not change, the
+:py:class:`~bushel.index.DigestIndex` remains valid.
+"""
+
+import logging
+import os
+import os.path
+import shutil
+
+from bushel.collector.filesystem import CollectorOutBridgeDescsMarker
+from bushel.collector.filesystem import CollectorOutRelayDescsMarker
+from bushel.collector.filesystem import CollectorOutSubdirectory
+
+LOG = logging.getLogger('bushel')
+
+_DIGEST_SHARDED = {
+    (CollectorOutSubdirectory.RELAY_DESCRIPTORS.value,
+     CollectorOutRelayDescsMarker.SERVER_DESCRIPTOR.value): 4,
+    (CollectorOutSubdirectory.RELAY_DESCRIPTORS.value,
+     CollectorOutRelayDescsMarker.EXTRA_INFO.value): 4,
+    (CollectorOutSubdirectory.BRIDGE_DESCRIPTORS.value,
+     CollectorOutBridgeDescsMarker.SERVER_DESCRIPTOR.value): 4,
+    (CollectorOutSubdirectory.BRIDGE_DESCRIPTORS.value,
+     CollectorOutBridgeDescsMarker.EXTRA_INFO.value): 4,
+}
+
+
+def shard_key(path):
+    """
+    Determines the value used to choose the shard for a path relative to the
+    archive root. For example:
+
+    >>> shard_key("relay-descriptors/server-descriptor/2018/11/a/9/"
+    ...           "a94a07b201598d847105ae5fcd5bc3ab10124389")
+    169
+    >>> shard_key("relay-descriptors/consensus/2018/11/19/"
+    ...           "2018-11-19-15-00-00-consensus")
+    24226
+    >>> shard_key(".bushel/index.sqlite") is None
+    True
+
+    Directories are also accepted, as long as they are deep enough in the
+    layout to determine the shard.
+
+    :param str path: The path relative to the archive root.
+
+    :returns: The key as an :py:class:`int`, or *None* if the path always
+              belongs to the first root.
+    """
+    parts = path.split(os.sep)
+    try:
+        if tuple(parts[0:2]) in _DIGEST_SHARDED:
+            if len(parts) < 6:
+                return None
+            return int(parts[4] + parts[5], 16)
+        if parts[0:2] == [CollectorOutSubdirectory.RELAY_DESCRIPTORS.value,
+                          CollectorOutRelayDescsMarker.MICRODESC.value] and \
+              len(parts) > 4 and parts[4] == "micro":
+            if len(parts) < 7:
+                return None
+            return int(parts[5] + parts[6], 16)
+        if parts[0] in [s.value for s in CollectorOutSubdirectory] and \
+              len(parts) >= 4:
+            return int(parts[2]) * 12 + int(parts[3]) - 1
+    except ValueError:
+        pass
+    return None
+
+
+class ArchiveShards:
+    """
+    The roots of a sharded archive, mapping relative paths to roots.
+
+    >>> shards = ArchiveShards(["/srv/disk0", "/srv/disk1"])
+    >>> shards.root_for("relay-descriptors/server-descriptor/2018/11/a/9/"
+    ...                 "a94a07b201598d847105ae5fcd5bc3ab10124389")
+    '/srv/disk1'
+    >>> shards.locate("/srv/disk1/relay-descriptors/consensus")
+    (1, 'relay-descriptors/consensus')
+
+    :param list(str) roots: The roots of the archive. The first root also
+                            holds bushel's own state. A single :py:class:`str`
+                            is treated as a single root.
+    """
+
+    def __init__(self, roots):
+        if isinstance(roots, str):
+            roots = [roots]
+        if not roots:
+            raise ValueError("An archive needs at least one root")
+        self.roots = list(roots)
+
+    def __len__(self):
+        return len(self.roots)
+
+    def shard_for_digest(self, digest):
+        """
+        The shard for a digest-addressed descriptor.
+
+        :param str digest: The hex-encoded digest.
+
+        :returns: The index of the root as an :py:class:`int`.
+        """
+        return int(digest[:2], 16) % len(self.roots)
+
+    def shard_for(self, path):
+        """
+        The shard for a path relative to the archive root.
+
+        :param str path: The relative path.
+
+        :returns: The index of the root as an :py:class:`int`.
+        """
+        if len(self.roots) == 1:
+            return 0
+        key = shard_key(path)
+        return 0 if key is None else key % len(self.roots)
+
+    def root_for(self, path):
+        """
+        The root that a path relative to the archive root belongs under.
+
+        :param str path: The relative path.
+
+        :returns: The root as a :py:class:`str`.
+        """
+        return self.roots[self.shard_for(path)]
+
+    def locate(self, path):
+        """
+        Finds the root that contains a path.
+
+        :param str path: A path under one of the roots.
+
+        :returns: A (shard, relative path) :py:class:`tuple`. Paths that are
+                  not under any root are treated as being under the first.
+        """
+        for shard, root in enumerate(self.roots):
+            relative = os.path.relpath(path, root)
+            if relative != os.pardir and \
+                  not relative.startswith(os.pardir + os.sep):
+                return shard, relative
+        return 0, os.path.relpath(path, self.roots[0])
+
+    def misplaced(self):
+        """
+        Finds the documents that are not stored under the root they belong
+        to, for example after a root has been added. This performs blocking
+        I/O.
+
+        :returns: An iterator of (source shard, target shard, relative path)
+                  tuples.
+        """
+        for shard, root in enumerate(self.roots):
+            for subdirectory in CollectorOutSubdirectory:
+                top = os.path.join(root, subdirectory.value)
+                for dirpath, _, filenames in os.walk(top):
+                    for filename in filenames:
+                        if filename.startswith("."):
+                            # Temporary files of an interrupted write
+                            continue
+                        relative = os.path.relpath(
+                            os.path.join(dirpath, filename), root)
+                        target = self.shard_for(relative)
+                        if target != shard:
+                            yield shard, target, relative
+
+    def _move(self, source, target):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.replace(source, target)
+            return
+        except OSError:
+            # Roots are usually on different filesystems
+            pass
+        directory, filename = os.path.split(target)
+        temporary_path = os.path.join(directory, f".{filename}.rebalance.tmp")
+        shutil.copy2(source, temporary_path)
+        os.replace(temporary_path, target)
+        os.remove(source)
+
+    def rebalance(self, dry_run=False):
+        """
+        Moves documents that are not stored under the root they belong to.
+        Each document is copied into place before being removed from its old
+        root, so readers will find it throughout. This performs blocking I/O.
+
+        :param bool dry_run: Only count the documents that would be moved.
+
+        :returns: A :py:class:`dict` with the number of documents and bytes
+                  "moved".
+        """
+        moved = 0
+        moved_bytes = 0
+        for shard, target, relative in self.misplaced():
+            source_path = os.path.join(self.roots[shard], relative)
+            moved_bytes += os.path.getsize(source_path)
+            moved += 1
+            if dry_run:
+                continue
+            LOG.debug("Moving %s from %s to %s", relative, self.roots[shard],
+                      self.roots[target])
+            self._move(source_path, os.path.join(self.roots[target], relative))
+        LOG.info("%s %d documents (%d bytes) to their shards",
+                 "Would move" if dry_run else "Moved", moved, moved_bytes)
+        return {"moved": moved, "bytes": moved_bytes}
@@ -0,0 +1,215 @@
+"""
+Materialized snapshots of the network at a point in time.
+
+A snapshot holds the consensuses that were valid at a time, together with
+every server descriptor, extra-info descriptor and microdescriptor that they
+reference, so that questions about what the network looked like at that time
+can be answered without further reads from the archive. Snapshots are created
+with :py:meth:`bushel.archive.DirectoryArchive.snapshot`, which resolves the
+whole reference closure in one batched pass. For example::
+
+    snapshot = await archive.snapshot(datetime.datetime(2018, 11, 19, 15, 30))
+    for router in snapshot.consensus().routers.values():
+        descriptor = snapshot.server_descriptor(router.digest)
+
+Documents are held as their raw annotated bytes and are only parsed when they
+are first accessed, so a snapshot takes little more memory than the documents
+themselves. A snapshot can be saved as a single file, from which it can be
+loaded again in milliseconds as no parsing is needed::
+
+    # Concatenated records, each a header line followed by the document
+    bushel-snapshot 1 2018-11-19T15:30:00
+    network-status-consensus-3 ns 1234
+    @type network-status-consensus-3 1.0
+    ...
+    server-descriptor 5d8f4d6ac4dd2d0e52d2e0b1e3a4f2c3b1a9e8f7 2345
+    @type server-descriptor 1.0
+    ...
+"""
+
+import datetime
+import os
+import os.path
+
+from bushel.catalog import CONSENSUS
+from bushel.catalog import MICRODESC_CONSENSUS
+from bushel.index import EXTRA_INFO
+from bushel.index import MICRODESCRIPTOR
+from bushel.index import SERVER_DESCRIPTOR
+from bushel.parsing import parse_raw
+
+SNAPSHOT_MAGIC = b"bushel-snapshot 1"
+
+SNAPSHOT_DOCTYPES = [
+    CONSENSUS, MICRODESC_CONSENSUS, SERVER_DESCRIPTOR, EXTRA_INFO,
+    MICRODESCRIPTOR
+]
+
+CONSENSUS_FLAVORS = {
+    "ns": CONSENSUS,
+    "microdesc": MICRODESC_CONSENSUS,
+}
+
+
+class NetworkSnapshot:
+    """
+    The consensuses valid at a time and the descriptors they reference.
+
+    Consensuses are keyed by their flavor ("ns" or "microdesc") and
+    descriptors by their lower-case hex-encoded digest, as in the
+    :py:mod:`~bushel.index`. Parsed documents are cached, so each is only
+    parsed once.
+
+    :param ~datetime.datetime when: The time of the snapshot.
+    :param dict documents: The raw annotated documents as a mapping of
+                           doctype to a mapping of key to :py:class:`bytes`.
+    """
+
+    def __init__(self, when, documents=None):
+        self.when = when
+        self.documents = {doctype: {} for doctype in SNAPSHOT_DOCTYPES}
+        for doctype, keyed in (documents or {}).items():
+            self.documents[doctype].update(keyed)
+        self._parsed = {}
+
+    def add(self, doctype, key, raw_content, parsed=None):
+        """
+        Adds a document to the snapshot.
+
+        :param str doctype: The type of the document.
+        :param str key: The consensus flavor or descriptor digest.
+        :param bytes raw_content: The annotated document.
+        :param parsed: The parsed document, if it has already been parsed.
+        """
+        self.documents[doctype][key] = raw_content
+        if parsed is not None:
+            self._parsed[(doctype, key)] = parsed
+
+    def _get(self, doctype, key):
+        parsed = self._parsed.get((doctype, key))
+        if parsed is None:
+            raw_content = self.documents[doctype].get(key)
+            if raw_content is None:
+                return None
+            parsed = parse_raw(bytes(raw_content))
+            self._parsed[(doctype, key)] = parsed
+        return parsed
+
+    def consensus(self, flavor="ns"):
+        """
+        The consensus of a flavor that was valid at the time of the snapshot.
+
+        :param str flavor: Either "ns" or "microdesc".
+
+        :returns: A :py:class:`~stem.descriptor.networkstatus.NetworkStatusDocumentV3`,
+                  or *None* if no consensus of that flavor was archived.
+        """
+        return self._get(CONSENSUS_FLAVORS[flavor], flavor)
+
+    def server_descriptor(self, digest):
+        """
+        :param str digest: A hex-encoded digest of the descriptor.
+
+        :returns: A :py:class:`~stem.descriptor.server_descriptor.RelayDescriptor`,
+                  or *None* if it is not in the snapshot.
+        """
+        return self._get(SERVER_DESCRIPTOR, digest.lower())
+
+    def extra_info_descriptor(self, digest):
+        """
+        :param str digest: A hex-encoded digest of the descriptor.
+
+        :returns: A :py:class:`~stem.descriptor.extrainfo_descriptor.RelayExtraInfoDescriptor`,
+                  or *None* if it is not in the snapshot.
+        """
+        return self._get(EXTRA_INFO, digest.lower())
+
+    def microdescriptor(self, digest):
+        """
+        :param str digest: A hex-encoded SHA-256 digest of the descriptor, see
+                           :py:func:`~bushel.archive.microdescriptor_hex_digest`.
+
+        :returns: A :py:class:`~stem.descriptor.microdescriptor.Microdescriptor`,
+                  or *None* if it is not in the snapshot.
+        """
+        return self._get(MICRODESCRIPTOR, digest.lower())
+
+    def descriptors(self, doctype):
+        """
+        Parses all of the descriptors of a type in the snapshot.
+
+        :param str doctype: One of :py:data:`~bushel.index.SERVER_DESCRIPTOR`,
+                            :py:data:`~bushel.index.EXTRA_INFO` or
+                            :py:data:`~bushel.index.MICRODESCRIPTOR`.
+
+        :returns: An iterator of :py:class:`~stem.descriptor.Descriptor`.
+        """
+        for key in self.documents[doctype]:
+            parsed = self._get(doctype, key)
+            if parsed is not None:
+                yield parsed
+
+    def counts(self):
+        """
+        :returns: A :py:class:`dict` of the number of documents of each type.
+        """
+        return {
+            doctype: len(keyed)
+            for doctype, keyed in self.documents.items()
+        }
+
+    def save(self, path):
+        """
+        Saves the snapshot to a single file. The file is written to a
+        temporary file that is then renamed into place.
+
+        :param str path: The path of the file.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "wb") as snapshot_file:
+            snapshot_file.write(SNAPSHOT_MAGIC + b" " +
+                                self.when.isoformat().encode('ascii') + b"\n")
+            for doctype, keyed in self.documents.items():
+                for key, raw_content in keyed.items():
+                    header = f"{doctype} {key} {len(raw_content)}\n"
+                    snapshot_file.write(header.encode('ascii'))
+                    snapshot_file.write(raw_content)
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a snapshot saved with :py:meth:`save`. Documents are not parsed
+        until they are accessed.
+
+        :param str path: The path of the file.
+
+        :returns: A :py:class:`NetworkSnapshot`, or *None* if the file does
+                  not exist.
+
+        :raises ValueError: If the file is not a snapshot.
+        """
+        try:
+            with open(path, "rb") as snapshot_file:
+                content = memoryview(snapshot_file.read())
+        except FileNotFoundError:
+            return None
+        end = bytes(content[:64]).find(b"\n")
+        header = bytes(content[:end]).split(b" ")
+        if end < 0 or b" ".join(header[:2]) != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a bushel snapshot")
+        snapshot = cls(datetime.datetime.fromisoformat(header[2].decode()))
+        offset = end + 1
+        while offset < len(content):
+            end = bytes(content[offset:offset + 256]).find(b"\n")
+            if end < 0:
+                raise ValueError(f"Truncated record in snapshot {path}")
+            doctype, key, length = bytes(
+                content[offset:offset + end]).decode('ascii').split(" ")
+            offset += end + 1
+            if offset + int(length) > len(content):
+                raise ValueError(f"Truncated record in snapshot {path}")
+            snapshot.add(doctype, key, content[offset:offset + int(length)])
+            offset += int(length)
+        return snapshot
@@ -0,0 +1,143 @@
+import asyncio
+import datetime
+import os.path
+import tempfile
+from unittest import mock
+
+from nose.tools import assert_equal
+
+from bushel.address_index import ENTRY
+from bushel.address_index import AddressIndex
+from bushel.archive import DirectoryArchive
+from bushel.fixtures import OTHER
+from bushel.fixtures import RELAY
+from bushel.fixtures import START
+from bushel.fixtures import consensus
+from bushel.fixtures import router
+
+PERIOD = (START, START + datetime.timedelta(hours=3))
+
+
+def _consensuses():
+    return [
+        consensus(0, [router(RELAY, "198.51.100.7", ipv6="2001:db8::7"),
+                      router(OTHER, "198.51.100.8")]),
+        consensus(1, [router(RELAY, "198.51.100.7", ipv6="2001:db8::7")]),
+        consensus(2, [router(RELAY, "198.51.100.9"),
+                      router(OTHER, "198.51.100.7")]),
+    ]
+
+
+def _summary(intervals):
+    return [(i.address, i.fingerprint, i.start.hour, i.end.hour)
+            for i in intervals]
+
+
+def _index(directory, order):
+    index = AddressIndex(os.path.join(directory, "address-index"))
+    consensuses = _consensuses()
+    for i in order:
+        index.add_consensus(consensuses[i])
+    return index
+
+
+def test_address_lookup():
+    with tempfile.TemporaryDirectory() as directory:
+        index = _index(directory, [0, 1, 2])
+        assert_equal(
+            _summary(index.lookup("198.51.100.7",
+                                  START + datetime.timedelta(minutes=30))),
+            [("198.51.100.7", RELAY, 15, 17)])
+        assert_equal(_summary(index.lookup("198.51.100.7", *PERIOD)),
+                     [("198.51.100.7", RELAY, 15, 17),
+                      ("198.51.100.7", OTHER, 17, 18)])
+        assert_equal(
+            _summary(index.lookup("2001:db8::7",
+                                  START + datetime.timedelta(hours=1))),
+            [("2001:db8::7", RELAY, 15, 17)])
+        # Intervals end when the last consensus listing the address does
+        assert_equal(
+            index.lookup("198.51.100.8", START + datetime.timedelta(hours=1)),
+            [])
+        assert_equal(_summary(index.lookup_network("198.51.100.0/24",
+                                                   *PERIOD)),
+                     [("198.51.100.7", RELAY, 15, 17),
+                      ("198.51.100.7", OTHER, 17, 18),
+                      ("198.51.100.8", OTHER, 15, 16),
+                      ("198.51.100.9", RELAY, 17, 18)])
+        assert_equal(index.lookup_network("203.0.113.0/24", *PERIOD), [])
+        index.close()
+
+
+def test_address_index_out_of_order_and_duplicates():
+    with tempfile.TemporaryDirectory() as directory:
+        expected = _summary(_index(directory, [0, 1, 2]).lookup_network(
+            "198.51.100.0/24", *PERIOD))
+    for order in ([2, 0, 1], [1, 0, 2, 0, 1]):
+        with tempfile.TemporaryDirectory() as directory:
+            index = _index(directory, order)
+            assert_equal(
+                _summary(index.lookup_network("198.51.100.0/24", *PERIOD)),
+                expected)
+            # Duplicates are coalesced when the log is merged
+            index.merge()
+            assert_equal(os.path.getsize(index.sorted_path),
+                         ENTRY.size * 5)
+            assert_equal(
+                _summary(index.lookup_network("198.51.100.0/24", *PERIOD)),
+                expected)
+            index.close()
+
+
+def test_address_index_merge_threshold():
+    with tempfile.TemporaryDirectory() as directory, \
+            mock.patch("bushel.address_index.MERGE_THRESHOLD", 3):
+        index = _index(directory, [0])
+        # The first consensus has three addresses, reaching the threshold
+        assert_equal(os.path.getsize(index.log_path), 0)
+        assert_equal(os.path.getsize(index.sorted_path), ENTRY.size * 3)
+        index.add_consensus(_consensuses()[1])
+        assert_equal(os.path.getsize(index.log_path), ENTRY.size * 2)
+        # An interval is returned whole when split between index and log
+        assert_equal(_summary(index.lookup("198.51.100.7", START)),
+                     [("198.51.100.7", RELAY, 15, 17)])
+        index.add_consensus(_consensuses()[2])
+        assert_equal(os.path.getsize(index.log_path), 0)
+        assert_equal(os.path.getsize(index.sorted_path), ENTRY.size * 5)
+        index.close()
+
+
+def test_address_index_log_replay():
+    with tempfile.TemporaryDirectory() as directory:
+        _index(directory, [0, 1])
+        # A crash while appending leaves a partial entry at the end of the log
+        index_path = os.path.join(directory, "address-index")
+        with open(os.path.join(index_path, "intervals.log"), "ab") as log:
+            log.write(b"\0" * (ENTRY.size // 2))
+        index = AddressIndex(index_path)
+        assert not os.path.exists(index.sorted_path)
+        assert_equal(_summary(index.lookup("2001:db8::7", START)),
+                     [("2001:db8::7", RELAY, 15, 17)])
+        index.close()
+        assert_equal(os.path.getsize(index.log_path), 0)
+        assert_equal(os.path.getsize(index.sorted_path), ENTRY.size * 3)
+
+
+def test_archive_address_index():
+    consensuses = _consensuses()
+
+    async def store_and_rebuild(archive):
+        for document in consensuses:
+            await archive.store(document)
+        index = archive.address_index
+        assert_equal(_summary(index.lookup("198.51.100.7", *PERIOD)),
+                     [("198.51.100.7", RELAY, 15, 17),
+                      ("198.51.100.7", OTHER, 17, 18)])
+        assert_equal(await archive.rebuild_address_index(
+            START + datetime.timedelta(hours=1), PERIOD[1]), 2)
+        assert_equal(_summary(index.lookup("198.51.100.7", *PERIOD)),
+                     [("198.51.100.7", RELAY, 16, 17),
+                      ("198.51.100.7", OTHER, 17, 18)])
+
+    with tempfile.TemporaryDirectory() as archive_path:
+        asyncio.run(store_and_rebuild(DirectoryArchive(archive_path)))
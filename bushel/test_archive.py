@@ -1,10 +1,21 @@
+import asyncio
+import contextlib
 import datetime
+import os
+import tempfile
+from unittest import mock
+
 from nose import SkipTest
 from nose.tools import assert_equal
+from nose.tools import assert_raises
 
 from stem.descriptor import Descriptor
+from stem.descriptor.microdescriptor import Microdescriptor
+from stem.descriptor.networkstatus import DirectoryAuthority
+from stem.descriptor.networkstatus import NetworkStatusDocumentV3
 
 from bushel.archive import CollectorOutSubdirectory
+from bushel.archive import DirectoryArchive
 from bushel.archive import CollectorOutBridgeDescsMarker
 from bushel.archive import CollectorOutRelayDescsMarker
 from bushel.archive import collector_422_filename
@@ -19,6 +30,10 @@ from bushel.archive import collector_533_substructure
 from bushel.archive import collector_534_consensus_path
 from bushel.archive import collector_534_microdescriptor_path
 from bushel.archive import prepare_annotated_content
+from bushel.bandwidth.file import BandwidthFile
+from bushel.bandwidth.test_file import example_sbws_103
+from bushel.fixtures import relay_descriptors
+from bushel.index import SERVER_DESCRIPTOR
 
 
 def test_collector_422_filename():
@@ -337,3 +352,317 @@ AfMLKycSiGaVvjyKTzxjeKWf8wBGm2xvsYiPHAmdMbU=
     descriptor = Descriptor.from_str(descriptor_str)
     assert_equal(
         prepare_annotated_content(descriptor), descriptor_str.encode('utf-8'))
+
+
+def _run_with_archive(test, roots=1, **options):
+    """
+    Runs an asynchronous test against a new archive, with a temporary
+    directory for each root.
+    """
+    with contextlib.ExitStack() as stack:
+        paths = [
+            stack.enter_context(tempfile.TemporaryDirectory())
+            for _ in range(roots)
+        ]
+        asyncio.run(test(
+            DirectoryArchive(paths[0] if roots == 1 else paths, **options)))
+
+
+def _roots_containing(archive, descriptor):
+    _, relative = archive.shards.locate(archive.path_for(descriptor))
+    return [
+        root for root in archive.shards.roots
+        if os.path.exists(os.path.join(root, relative))
+    ]
+
+
+def test_store_many():
+    descriptors = relay_descriptors(5)
+
+    async def store_and_retrieve(archive):
+        with mock.patch.object(archive, "_write_batch",
+                               wraps=archive._write_batch) as write_batch:
+            assert_equal(await archive.store_many(descriptors, batch_size=2),
+                         5)
+        # Each batch is written by a single call, grouped by directory
+        batches = [call.args[0] for call in write_batch.call_args_list]
+        assert all(len(batch) <= 2 for batch in batches)
+        assert_equal(
+            sorted(path for batch in batches for _, _, path, _ in batch),
+            sorted(archive.path_for(d) for d in descriptors))
+        assert_equal(archive.store_stats()["written"], 5)
+        assert_equal(await archive.store_many([]), 0)
+        for descriptor in descriptors:
+            archived = await archive.relay_server_descriptor(
+                descriptor.digest(), descriptor.published)
+            assert_equal(archived.get_bytes(), descriptor.get_bytes())
+
+    _run_with_archive(store_and_retrieve)
+
+
+def test_iter_descriptors():
+    descriptors = relay_descriptors(5)
+    digests = [descriptor.digest() for descriptor in descriptors]
+
+    async def store_and_iterate(archive):
+        await archive.store_many(descriptors)
+        with mock.patch.object(archive, "_read_chunk",
+                               wraps=archive._read_chunk) as read_chunk:
+            retrieved = [
+                descriptor.digest() async for descriptor in
+                archive.iter_descriptors(SERVER_DESCRIPTOR,
+                                         digests + ["0" * 40],
+                                         descriptors[0].published,
+                                         chunk_size=2)
+            ]
+        # Missing descriptors are skipped, and each chunk is one read
+        assert_equal(sorted(retrieved), sorted(digests))
+        assert_equal(sorted(len(call.args[1])
+                            for call in read_chunk.call_args_list),
+                     [2, 2, 2])
+
+    _run_with_archive(store_and_iterate)
+
+
+def test_consensuses():
+    consensuses = [
+        NetworkStatusDocumentV3.create({
+            "valid-after": f"2018-11-19 {hour:02d}:00:00",
+            "fresh-until": f"2018-11-19 {hour:02d}:00:00",
+            "valid-until": f"2018-11-19 {hour:02d}:00:00",
+        }) for hour in range(20, 24)
+    ]
+
+    async def store_and_iterate(archive):
+        for consensus in consensuses:
+            await archive.store(consensus)
+        start = datetime.datetime(2018, 11, 19, 21)
+        end = datetime.datetime(2018, 11, 20, 12)
+        retrieved = [
+            consensus.valid_after async for consensus in
+            archive.consensuses(start, end, read_ahead=2)
+        ]
+        assert_equal(retrieved, [
+            datetime.datetime(2018, 11, 19, hour) for hour in range(21, 24)
+        ])
+
+    _run_with_archive(store_and_iterate)
+
+
+def test_server_descriptors():
+    descriptors = relay_descriptors(5, published="2018-11-19 15:00:00")
+
+    async def store_and_iterate(archive):
+        await archive.store_many(descriptors)
+        retrieved = [
+            descriptor.digest() async for descriptor in
+            archive.server_descriptors(descriptors[0].published,
+                                       read_ahead=1, chunk_size=2)
+        ]
+        assert_equal(retrieved,
+                     sorted(descriptor.digest() for descriptor in descriptors))
+
+    _run_with_archive(store_and_iterate)
+
+
+def test_read_through_caches():
+    consensus = NetworkStatusDocumentV3.create()
+
+    async def store_and_read(archive):
+        await archive.store(consensus)
+        for _ in range(3):
+            await archive.relay_consensus("ns", consensus.valid_after)
+        stats = archive.cache_stats()
+        assert_equal(stats["parsed"]["hits"], 2)
+        assert_equal(stats["parsed"]["misses"], 1)
+        assert_equal(stats["bytes"]["misses"], 1)
+        # A document replaced in the archive is not served from the cache
+        path = archive.relay_consensus_path(consensus.valid_after)
+        os.utime(path, ns=(0, 0))
+        await archive.relay_consensus("ns", consensus.valid_after)
+        assert_equal(archive.cache_stats()["parsed"]["misses"], 2)
+
+    _run_with_archive(store_and_read, byte_cache_size=1024 * 1024,
+                      parsed_cache_size=1024 * 1024)
+
+
+def test_write_behind():
+    descriptors = relay_descriptors(5)
+
+    async def store_and_flush(archive):
+        await archive.store(descriptors[0])
+        await archive.store_many(descriptors[1:])
+        # Nothing is written until the background task runs
+        assert_equal(archive.store_stats()["written"], 0)
+        assert not any(os.path.exists(archive.path_for(d))
+                       for d in descriptors)
+        await archive.flush()
+        assert_equal(archive.store_stats()["written"], 5)
+        for descriptor in descriptors:
+            archived = await archive.relay_server_descriptor(
+                descriptor.digest(), descriptor.published)
+            assert_equal(archived.get_bytes(), descriptor.get_bytes())
+        for _, _, filenames in os.walk(archive.shards.roots[0]):
+            assert not [f for f in filenames if f.endswith(".tmp")]
+
+    _run_with_archive(store_and_flush, write_behind=True, fsync_interval=0)
+
+
+def test_write_behind_failure():
+    descriptors = relay_descriptors(2)
+
+    async def fail_and_flush(archive):
+        with mock.patch.object(archive, "_write_batch",
+                               side_effect=OSError("No space left")):
+            await archive.store(descriptors[0])
+            with assert_raises(OSError):
+                await archive.flush()
+        assert not os.path.exists(archive.path_for(descriptors[0]))
+        # The error is only reported once
+        await archive.store(descriptors[1])
+        await archive.flush()
+        assert os.path.exists(archive.path_for(descriptors[1]))
+
+    _run_with_archive(fail_and_flush, write_behind=True)
+
+
+def test_skip_existing():
+    descriptors = relay_descriptors(3)
+    consensus = NetworkStatusDocumentV3.create()
+
+    async def store_twice(archive):
+        await archive.store_many(descriptors)
+        await archive.store(consensus)
+        paths = [archive.path_for(d) for d in descriptors + [consensus]]
+        for path in paths:
+            os.utime(path, ns=(0, 0))
+        await archive.store_many(descriptors)
+        await archive.store(consensus)
+        # Archived documents are left untouched
+        assert_equal([os.stat(path).st_mtime_ns for path in paths],
+                     [0] * len(paths))
+        stats = archive.store_stats()
+        assert_equal(stats["written"], 4)
+        assert_equal(stats["skipped"], 4)
+        assert_equal(stats["skipped_bytes"], sum(
+            len(prepare_annotated_content(d))
+            for d in descriptors + [consensus]))
+
+    _run_with_archive(store_twice)
+
+
+def test_hardlink_duplicates():
+    microdescriptor = Microdescriptor.create()
+
+    async def store_in_two_months(archive):
+        for month in (10, 11):
+            with mock.patch("bushel.archive.valid_after_now",
+                            return_value=datetime.datetime(2018, month, 19)):
+                await archive.store(microdescriptor)
+        assert_equal(archive.store_stats()["linked"], 1)
+        paths = [
+            archive.relay_microdescriptor_path(
+                datetime.datetime(2018, month, 19),
+                microdescriptor.digest())
+            for month in (10, 11)
+        ]
+        assert os.path.samefile(*paths)
+
+    _run_with_archive(store_in_two_months, hardlink_duplicates=True)
+
+
+def test_sharded_archive():
+    descriptors = relay_descriptors(8)
+    consensus = NetworkStatusDocumentV3.create()
+
+    async def store_and_read(archive):
+        await archive.store_many(descriptors)
+        await archive.store(consensus)
+        for descriptor in descriptors:
+            shard = archive.shards.shard_for_digest(descriptor.digest())
+            # Each descriptor is in the root of its shard and no other
+            assert_equal(_roots_containing(archive, descriptor),
+                         [archive.shards.roots[shard]])
+            # The index records paths relative to the root
+            indexed = archive.index.lookup(SERVER_DESCRIPTOR,
+                                           descriptor.digest().lower())
+            assert not os.path.isabs(indexed.path)
+        assert_equal(
+            sorted({archive.shards.shard_for_digest(d.digest())
+                    for d in descriptors}), [0, 1])
+        archived = [
+            d async for d in archive.iter_descriptors(
+                SERVER_DESCRIPTOR, [d.digest() for d in descriptors],
+                descriptors[0].published)
+        ]
+        assert_equal(len(archived), len(descriptors))
+        assert await archive.relay_consensus("ns", consensus.valid_after)
+        assert_equal(await archive.rebuild_index(), len(descriptors))
+
+    _run_with_archive(store_and_read, roots=2)
+
+
+def test_rebalance():
+    descriptors = relay_descriptors(8)
+
+    async def rebalance_and_read(archive):
+        # Stored before the second root was added
+        await DirectoryArchive(archive.shards.roots[0]).store_many(descriptors)
+        first = archive.shards.roots[0]
+        dry_run = await archive.rebalance(dry_run=True)
+        assert all(_roots_containing(archive, d) == [first]
+                   for d in descriptors)
+        moved = await archive.rebalance()
+        assert_equal(dry_run, moved)
+        assert_equal(moved["moved"], sum(
+            archive.shards.shard_for_digest(d.digest()) for d in descriptors))
+        for descriptor in descriptors:
+            shard = archive.shards.shard_for_digest(descriptor.digest())
+            assert_equal(_roots_containing(archive, descriptor),
+                         [archive.shards.roots[shard]])
+        assert_equal((await archive.rebalance())["moved"], 0)
+        for descriptor in descriptors:
+            assert await archive.relay_server_descriptor(
+                descriptor.digest(), descriptor.published)
+
+    _run_with_archive(rebalance_and_read, roots=2)
+
+
+def test_relay_vote_now():
+    valid_after = datetime.datetime(2018, 11, 19, 15)
+    vote = NetworkStatusDocumentV3.create(
+        {"vote-status": "vote",
+         "valid-after": f"{valid_after:%Y-%m-%d %H:%M:%S}"},
+        authorities=[DirectoryAuthority.create(is_vote=True)])
+    v3ident = vote.directory_authorities[0].v3ident
+
+    async def store_and_retrieve(archive):
+        await archive.store(vote)
+        # valid_after_now() keeps the microseconds of the current time
+        with mock.patch("bushel.archive.valid_after_now",
+                        return_value=valid_after.replace(microsecond=1234)):
+            archived = await archive.relay_vote(v3ident)
+        assert_equal(archived.get_bytes(), vote.get_bytes())
+
+    _run_with_archive(store_and_retrieve)
+
+
+def test_bandwidth_files():
+    bandwidth_file = BandwidthFile(example_sbws_103)
+    fingerprint = "68A483E05A2ABDCA6DA5A3EF8DB5177638A27F80"
+
+    async def store_and_read(archive):
+        # Storing the same file again does not duplicate its measurements
+        for _ in range(2):
+            await archive.store(bandwidth_file)
+        archived = await archive.relay_bandwidth_file(
+            bandwidth_file.published, bandwidth_file.digest())
+        assert_equal(archived.get_bytes(), bandwidth_file.raw_content)
+        assert await archive.relay_bandwidth_file(bandwidth_file.published)
+        assert_equal(
+            await archive.relay_bandwidth_history(
+                fingerprint, datetime.datetime(2018, 4, 1),
+                datetime.datetime(2018, 5, 1)),
+            [(bandwidth_file.timestamp, 38000)])
+
+    _run_with_archive(store_and_read, skip_existing=False)
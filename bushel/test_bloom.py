@@ -0,0 +1,54 @@
+import asyncio
+import os.path
+import tempfile
+
+from nose.tools import assert_equal
+from nose.tools import assert_false
+from nose.tools import assert_true
+
+from stem.descriptor.server_descriptor import RelayDescriptor
+
+from bushel.archive import DirectoryArchive
+from bushel.bloom import DigestBloomFilter
+from bushel.index import SERVER_DESCRIPTOR
+
+DIGESTS = [f"{i:040x}" for i in range(100)]
+
+
+def test_bloom_filter():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "filter")
+        bloom_filter = DigestBloomFilter(path, capacity=1000)
+        bloom_filter.add_many(DIGESTS)
+        # Negative answers are not trusted until the filter is complete
+        assert_true(bloom_filter.might_contain("f" * 40))
+        bloom_filter.rebuild(DIGESTS)
+        bloom_filter.close()
+        reopened = DigestBloomFilter(path)
+        assert_true(reopened.complete)
+        assert_equal(reopened.count, len(DIGESTS))
+        for digest in DIGESTS:
+            assert_true(reopened.might_contain(digest.upper()))
+        misses = sum(reopened.might_contain(f"{i:040x}")
+                     for i in range(1000, 2000))
+        assert misses < 50
+
+
+def test_archive_bloom_filter():
+    descriptor = RelayDescriptor.create()
+
+    async def store_and_check(archive):
+        await archive.rebuild_index()
+        await archive.store(descriptor)
+        archived = await archive.relay_server_descriptor(
+            descriptor.digest(), descriptor.published)
+        assert_equal(archived.get_bytes(), descriptor.get_bytes())
+        for i in range(100):
+            assert_false(await archive.relay_server_descriptor(
+                f"{i:040x}", descriptor.published))
+        stats = archive.bloom_filter_stats()[SERVER_DESCRIPTOR]
+        assert_equal(stats["count"], 1)
+        assert_equal(stats["negatives"] + stats["false_positives"], 100)
+
+    with tempfile.TemporaryDirectory() as archive_path:
+        asyncio.run(store_and_check(DirectoryArchive(archive_path)))
@@ -0,0 +1,72 @@
+import asyncio
+import datetime
+import tempfile
+
+from nose.tools import assert_equal
+
+from stem.descriptor.server_descriptor import RelayDescriptor
+
+from bushel import SERVER_DESCRIPTOR
+from bushel.cache import DescriptorCache
+from bushel.cache import DirectoryCache
+
+NOW = datetime.datetime(2018, 11, 19, 15)
+
+
+def _descriptors(count, published="2018-11-19 14:00:00"):
+    return [
+        RelayDescriptor.create({
+            "router": f"test{i} 127.0.0.1 9001 0 0",
+            "published": published,
+        }) for i in range(count)
+    ]
+
+
+def test_descriptor_cache():
+    descriptors = _descriptors(4)
+    size = len(descriptors[0].get_bytes())
+    clock = [NOW.replace(tzinfo=datetime.timezone.utc).timestamp()]
+    cache = DescriptorCache({SERVER_DESCRIPTOR: size * 3},
+                            clock=lambda: clock[0])
+    for descriptor in descriptors:
+        cache.put(SERVER_DESCRIPTOR, descriptor)
+    assert_equal(cache.get(SERVER_DESCRIPTOR, descriptors[0].digest()), None)
+    for descriptor in descriptors[1:]:
+        assert_equal(
+            cache.get(SERVER_DESCRIPTOR, descriptor.digest().lower()),
+            descriptor)
+
+    stale = _descriptors(1, published="2018-11-10 14:00:00")[0]
+    cache.put(SERVER_DESCRIPTOR, stale)
+    assert_equal(cache.get(SERVER_DESCRIPTOR, stale.digest()), None)
+
+    clock[0] += 3 * 24 * 60 * 60
+    assert_equal(cache.expire(), 3)
+    stats = cache.stats()[SERVER_DESCRIPTOR]
+    assert_equal((stats["hits"], stats["misses"], stats["evictions"],
+                  stats["expirations"], stats["entries"], stats["size"]),
+                 (3, 2, 1, 3, 0, 0))
+
+
+def test_directory_cache():
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    descriptors = _descriptors(3, published=f"{now:%Y-%m-%d %H:%M:%S}")
+    digests = [descriptor.digest() for descriptor in descriptors]
+
+    async def retrieve(cache):
+        await cache.archive.store_many(descriptors)
+        requested = list(digests)
+        retrieved = await cache.relay_server_descriptors(requested, now)
+        assert_equal(requested, digests)
+        assert_equal(sorted(d.digest() for d in retrieved), sorted(digests))
+        for descriptor in descriptors:
+            assert_equal(
+                cache._cached_descriptor(SERVER_DESCRIPTOR,
+                                         descriptor.digest()).nickname,
+                descriptor.nickname)
+        retrieved = await cache.relay_server_descriptors(digests, now)
+        assert_equal(len(retrieved), 3)
+        assert_equal(cache.descriptors.stats()[SERVER_DESCRIPTOR]["hits"], 6)
+
+    with tempfile.TemporaryDirectory() as archive_path:
+        asyncio.run(retrieve(DirectoryCache(archive_path)))
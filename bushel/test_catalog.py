@@ -0,0 +1,60 @@
+import asyncio
+import datetime
+import tempfile
+
+from nose.tools import assert_equal
+
+from stem.descriptor.networkstatus import NetworkStatusDocumentV3
+from stem.descriptor.server_descriptor import RelayDescriptor
+
+from bushel.archive import DirectoryArchive
+from bushel.catalog import CONSENSUS
+from bushel.compression import ArchiveCompression
+from bushel.index import SERVER_DESCRIPTOR
+
+
+def test_catalog():
+    descriptors = [
+        RelayDescriptor.create({
+            "router": f"test{i} 127.0.0.1 9001 0 0",
+            "published": f"2018-{month:02d}-19 15:{i:02d}:00",
+        }) for i in range(5) for month in (10, 11)
+    ]
+    consensuses = [
+        NetworkStatusDocumentV3.create({
+            "valid-after": f"2018-11-19 {hour:02d}:00:00",
+            "fresh-until": f"2018-11-19 {hour:02d}:00:00",
+            "valid-until": f"2018-11-19 {hour:02d}:00:00",
+        }) for hour in range(20, 24)
+    ]
+
+    async def store_and_rebuild(archive):
+        await archive.store_many(descriptors)
+        for consensus in consensuses:
+            await archive.store(consensus)
+        entries = archive.catalog.entries()
+        assert_equal([(e.doctype, e.month, e.count) for e in entries], [
+            (CONSENSUS, datetime.datetime(2018, 11, 1), 4),
+            (SERVER_DESCRIPTOR, datetime.datetime(2018, 10, 1), 5),
+            (SERVER_DESCRIPTOR, datetime.datetime(2018, 11, 1), 5),
+        ])
+        november = archive.catalog.entries(SERVER_DESCRIPTOR,
+                                           datetime.datetime(2018, 11, 19))
+        assert_equal(len(november), 1)
+        assert_equal(november[0].first, datetime.datetime(2018, 11, 19, 15))
+        assert_equal(november[0].last, datetime.datetime(2018, 11, 19, 15, 4))
+        assert_equal(archive.catalog.latest(CONSENSUS),
+                     datetime.datetime(2018, 11, 19, 23))
+
+        # Storing again does not count documents twice
+        await archive.store_many(descriptors)
+        assert_equal(archive.catalog.entries(), entries)
+
+        assert_equal(await archive.rebuild_catalog(),
+                     len(descriptors) + len(consensuses))
+        assert_equal(archive.catalog.entries(), entries)
+
+    with tempfile.TemporaryDirectory() as archive_path:
+        asyncio.run(store_and_rebuild(
+            DirectoryArchive(archive_path,
+                             compression=ArchiveCompression.XZ)))
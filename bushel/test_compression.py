@@ -0,0 +1,53 @@
+import asyncio
+import os.path
+import tempfile
+
+from nose.tools import assert_equal
+from nose.tools import assert_is_none
+
+from stem.descriptor.networkstatus import NetworkStatusDocumentV3
+
+from bushel.archive import DirectoryArchive
+from bushel.compression import ArchiveCompression
+from bushel.compression import read_archived
+from bushel.directory.document import DirectoryDocument
+
+
+def test_read_archived():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "document")
+        assert_is_none(read_archived(path))
+        with open(path + ".gz", 'wb') as output:
+            output.write(ArchiveCompression.GZ.compress(b"document"))
+        assert_equal(read_archived(path), b"document")
+        assert_equal(read_archived(path + ".gz"), b"document")
+
+
+def test_store_compressed_consensus():
+    consensus = NetworkStatusDocumentV3.create()
+
+    async def store_and_retrieve(archive):
+        await archive.store(consensus)
+        path = archive.relay_consensus_path(consensus.valid_after)
+        assert os.path.exists(path + ".xz")
+        archived = await archive.relay_consensus("ns", consensus.valid_after)
+        assert_equal(archived.get_bytes(), consensus.get_bytes())
+
+    with tempfile.TemporaryDirectory() as archive_path:
+        asyncio.run(store_and_retrieve(
+            DirectoryArchive(archive_path,
+                             compression=ArchiveCompression.XZ)))
+
+
+def test_read_archived_mmap():
+    document_bytes = b"super-keyword 3\nonion-magic\n"
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "document")
+        with open(path, 'wb') as output:
+            output.write(document_bytes)
+        assert_equal(type(read_archived(path)), bytes)
+        mapped = read_archived(path, mmap_threshold=1)
+        assert_equal(type(mapped), memoryview)
+        assert_equal(
+            list(DirectoryDocument(mapped).tokenize()),
+            list(DirectoryDocument(document_bytes).tokenize()))
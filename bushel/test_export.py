@@ -0,0 +1,126 @@
+import asyncio
+import datetime
+import os.path
+import tarfile
+import tempfile
+from unittest import mock
+
+from nose.tools import assert_equal
+from nose.tools import assert_raises
+
+from stem.descriptor.networkstatus import NetworkStatusDocumentV3
+from stem.descriptor.server_descriptor import RelayDescriptor
+
+from bushel.archive import DirectoryArchive
+from bushel.archive import prepare_annotated_content
+from bushel.compression import ArchiveCompression
+from bushel.export import export_month
+from bushel.ingest import import_tarball
+
+MONTH = datetime.datetime(2018, 11, 1)
+
+
+def test_export_month():
+    descriptors = [
+        RelayDescriptor.create({
+            "router": f"test{i} 127.0.0.1 9001 0 0",
+            "published": "2018-11-19 15:00:00",
+        }) for i in range(20)
+    ]
+
+    async def store_and_export(archive, output_path):
+        await archive.store_many(descriptors)
+        first, second = [
+            await export_month(archive, "server-descriptors", MONTH,
+                               output_path + suffix, block_size=4096)
+            for suffix in ("", ".again")
+        ]
+        assert_equal(first["documents"], len(descriptors))
+        assert_equal(first, second)
+
+    async def import_exported(archive, output_path):
+        stats = await import_tarball(archive, output_path)
+        assert_equal(stats["documents"], len(descriptors))
+
+    with tempfile.TemporaryDirectory() as archive_path, \
+          tempfile.TemporaryDirectory() as output_directory:
+        output_path = os.path.join(output_directory,
+                                   "server-descriptors-2018-11.tar.xz")
+        asyncio.run(store_and_export(DirectoryArchive(archive_path),
+                                     output_path))
+        with open(output_path, 'rb') as first, \
+              open(output_path + ".again", 'rb') as second:
+            assert_equal(first.read(), second.read())
+        with tarfile.open(output_path) as tarball:
+            names = tarball.getnames()
+            assert_equal(names, sorted(names))
+            digest = descriptors[0].digest().lower()
+            member = tarball.extractfile(
+                f"server-descriptors-2018-11/{digest[0]}/{digest[1]}/{digest}")
+            assert_equal(member.read(),
+                         prepare_annotated_content(descriptors[0]))
+        with tempfile.TemporaryDirectory() as import_path:
+            asyncio.run(import_exported(DirectoryArchive(import_path),
+                                        output_path))
+
+
+def test_export_compressed_consensus():
+    consensus = NetworkStatusDocumentV3.create()
+
+    async def store_and_export(archive, output_path):
+        await archive.store(consensus)
+        stats = await export_month(archive, "consensuses",
+                                   consensus.valid_after, output_path,
+                                   compression=ArchiveCompression.UNCOMPRESSED)
+        assert_equal(stats["documents"], 1)
+
+    with tempfile.TemporaryDirectory() as archive_path:
+        output_path = os.path.join(archive_path, "consensuses.tar")
+        asyncio.run(store_and_export(
+            DirectoryArchive(archive_path,
+                             compression=ArchiveCompression.XZ), output_path))
+        with tarfile.open(output_path) as tarball:
+            member = tarball.next()
+            assert not member.name.endswith(".xz")
+            assert_equal(tarball.extractfile(member).read(),
+                         prepare_annotated_content(consensus))
+
+
+def test_export_duplicate_copies():
+    consensus = NetworkStatusDocumentV3.create()
+
+    async def store_and_export(archive, output_path):
+        await archive.store(consensus)
+        # A copy compressed part way through compaction
+        path = archive.relay_consensus_path(consensus.valid_after)
+        with open(path, 'rb') as plain, open(path + ".xz", 'wb') as compressed:
+            compressed.write(ArchiveCompression.XZ.compress(plain.read()))
+        stats = await export_month(archive, "consensuses",
+                                   consensus.valid_after, output_path)
+        assert_equal(stats["documents"], 1)
+
+    with tempfile.TemporaryDirectory() as archive_path:
+        output_path = os.path.join(archive_path, "consensuses.tar.xz")
+        asyncio.run(store_and_export(DirectoryArchive(archive_path),
+                                     output_path))
+        with tarfile.open(output_path) as tarball:
+            assert_equal(len(tarball.getnames()), 1)
+
+
+def test_export_failure():
+    consensus = NetworkStatusDocumentV3.create()
+
+    async def store_and_export(archive, output_path):
+        await archive.store(consensus)
+        with mock.patch("bushel.export.compression_for_path",
+                        side_effect=OSError("Unreadable")):
+            with assert_raises(OSError):
+                await export_month(archive, "consensuses",
+                                   consensus.valid_after, output_path)
+
+    with tempfile.TemporaryDirectory() as archive_path, \
+          tempfile.TemporaryDirectory() as output_directory:
+        output_path = os.path.join(output_directory, "consensuses.tar.xz")
+        asyncio.run(store_and_export(DirectoryArchive(archive_path),
+                                     output_path))
+        assert_equal(os.listdir(output_directory), [])
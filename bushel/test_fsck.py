@@ -0,0 +1,71 @@
+import asyncio
+import datetime
+import os
+import os.path
+import tempfile
+from unittest import mock
+
+from nose.tools import assert_equal
+
+from stem.descriptor.extrainfo_descriptor import RelayExtraInfoDescriptor
+from stem.descriptor.microdescriptor import Microdescriptor
+from stem.descriptor.networkstatus import DirectoryAuthority
+from stem.descriptor.networkstatus import NetworkStatusDocumentV3
+from stem.descriptor.server_descriptor import RelayDescriptor
+
+from bushel.archive import DirectoryArchive
+from bushel.fsck import check_archive
+from bushel.index import SERVER_DESCRIPTOR
+
+
+def test_check_archive():
+    descriptors = [
+        RelayDescriptor.create({
+            "router": f"test{i} 127.0.0.1 9001 0 0",
+            "published": "2018-11-19 15:00:00",
+        }) for i in range(20)
+    ]
+    documents = descriptors + [
+        RelayExtraInfoDescriptor.create({
+            "published": "2018-11-19 15:00:00",
+        }),
+        Microdescriptor.create(),
+        NetworkStatusDocumentV3.create(
+            {"vote-status": "vote"},
+            authorities=[DirectoryAuthority.create(is_vote=True)]),
+    ]
+
+    async def check(archive):
+        with mock.patch("bushel.archive.valid_after_now",
+                        return_value=datetime.datetime(2018, 11, 19)):
+            await archive.store_many(documents)
+        stats = await check_archive(archive)
+        assert_equal(stats["checked"], len(documents))
+        assert_equal(stats["bad"], 0)
+
+        damaged = archive.relay_server_descriptor_path(
+            descriptors[0].published, descriptors[0].digest())
+        with open(damaged, 'rb') as document:
+            content = document.read()
+        with open(damaged, 'wb') as document:
+            document.write(content.replace(b"router test0", b"router test9"))
+        partial = await check_archive(archive, max_units=1)
+        assert partial["remaining_units"] > 0
+        assert os.path.exists(archive.state_path("fsck-checkpoint"))
+
+        resumed = await check_archive(archive)
+        assert_equal(resumed["checked"], len(documents))
+        assert_equal(resumed["bad"], 1)
+        assert_equal(resumed["quarantined"], 1)
+        assert_equal(resumed["remaining_units"], 0)
+        assert not os.path.exists(archive.state_path("fsck-checkpoint"))
+        assert not os.path.exists(damaged)
+        assert os.path.exists(os.path.join(
+            archive.state_path("quarantine"),
+            os.path.relpath(damaged, archive.archive_path)))
+        assert_equal(
+            archive.index.lookup(SERVER_DESCRIPTOR,
+                                 descriptors[0].digest().lower()), None)
+
+    with tempfile.TemporaryDirectory() as archive_path:
+        asyncio.run(check(DirectoryArchive(archive_path)))
@@ -0,0 +1,99 @@
+import datetime
+import os
+import os.path
+import tempfile
+
+from nose.tools import assert_equal
+
+from bushel.index import DigestIndex
+from bushel.index import IndexedDocument
+from bushel.index import VoteIndex
+from bushel.index import classify_path
+
+SERVER_DESCRIPTOR_PATH = ("relay-descriptors/server-descriptor/2018/11/a/9/"
+                          "a94a07b201598d847105ae5fcd5bc3ab10124389")
+MICRODESCRIPTOR_PATH = ("relay-descriptors/microdesc/2018/11/micro/0/0/"
+                        "00d91cf96321fbd536dd07e297a5e1b7e6961ddd10facdd719716e351453168f")
+VOTE_PATH = ("relay-descriptors/vote/2018/11/19/2018-11-19-15-00-00-vote-"
+             "D586D18309DED4CD6D57C18FDB97EFA96D330566-"
+             "663B503182575D242B9D8A67334365FF8ECB53BB")
+
+
+def test_classify_path():
+    expected = [
+        (SERVER_DESCRIPTOR_PATH,
+         ("server-descriptor", "a94a07b201598d847105ae5fcd5bc3ab10124389",
+          datetime.datetime(2018, 11, 1))),
+        (MICRODESCRIPTOR_PATH,
+         ("microdescriptor",
+          "00d91cf96321fbd536dd07e297a5e1b7e6961ddd10facdd719716e351453168f",
+          datetime.datetime(2018, 11, 1))),
+        (VOTE_PATH,
+         ("network-status-vote-3", "663b503182575d242b9d8a67334365ff8ecb53bb",
+          datetime.datetime(2018, 11, 19, 15))),
+        (VOTE_PATH + ".xz",
+         ("network-status-vote-3", "663b503182575d242b9d8a67334365ff8ecb53bb",
+          datetime.datetime(2018, 11, 19, 15))),
+        ("relay-descriptors/server-descriptor/2018/11/a/9/README", None),
+        ("relay-descriptors/consensus/2018/11/19/"
+         "2018-11-19-15-00-00-consensus", None),
+    ]
+    for case in expected:
+        assert_equal(classify_path(case[0]), case[1])
+
+
+def _write(archive_path, path, content):
+    fullpath = os.path.join(archive_path, path)
+    os.makedirs(os.path.dirname(fullpath), exist_ok=True)
+    with open(fullpath, 'wb') as output:
+        output.write(content)
+
+
+def test_digest_index_rebuild():
+    with tempfile.TemporaryDirectory() as archive_path:
+        _write(archive_path, SERVER_DESCRIPTOR_PATH,
+               b"@type server-descriptor 1.0\nrouter test 127.0.0.1 9001 0 0"
+               b"\npublished 2018-11-23 15:01:02\n")
+        _write(archive_path, MICRODESCRIPTOR_PATH, b"onion-key\n")
+        _write(archive_path, VOTE_PATH, b"network-status-version 3\n")
+        index = DigestIndex(os.path.join(archive_path, ".bushel/index.sqlite"))
+        assert_equal(index.authoritative, False)
+        assert_equal(index.rebuild(archive_path), 3)
+        assert_equal(index.authoritative, True)
+        assert_equal(
+            index.lookup("server-descriptor",
+                         "A94A07B201598D847105AE5FCD5BC3AB10124389"),
+            IndexedDocument("server-descriptor",
+                            "a94a07b201598d847105ae5fcd5bc3ab10124389",
+                            SERVER_DESCRIPTOR_PATH,
+                            datetime.datetime(2018, 11, 23, 15, 1, 2), 89))
+        assert_equal(
+            index.lookup("extra-info",
+                         "a94a07b201598d847105ae5fcd5bc3ab10124389"), None)
+        index.remove("network-status-vote-3",
+                     "663b503182575d242b9d8a67334365ff8ecb53bb")
+        assert_equal(len(list(index.documents())), 2)
+        index.close()
+
+
+def test_digest_index_not_created_by_lookup():
+    with tempfile.TemporaryDirectory() as archive_path:
+        index_path = os.path.join(archive_path, ".bushel/index.sqlite")
+        index = DigestIndex(index_path)
+        assert_equal(index.lookup("server-descriptor", "00"), None)
+        assert_equal(os.path.exists(index_path), False)
+
+
+def test_vote_index():
+    valid_after = datetime.datetime(2018, 11, 19, 15)
+    v3ident = "D586D18309DED4CD6D57C18FDB97EFA96D330566"
+    with tempfile.TemporaryDirectory() as directory:
+        open(os.path.join(directory, os.path.basename(VOTE_PATH)), 'w').close()
+        open(os.path.join(directory, "README"), 'w').close()
+        index = VoteIndex(lambda day: directory)
+        assert_equal(index.lookup(valid_after, v3ident.lower()),
+                     ["663B503182575D242B9D8A67334365FF8ECB53BB"])
+        assert_equal(index.lookup(valid_after, "0" * 40), [])
+        index.add(valid_after, v3ident, "0" * 40)
+        assert_equal(index.lookup(valid_after, v3ident),
+                     ["0" * 40, "663B503182575D242B9D8A67334365FF8ECB53BB"])
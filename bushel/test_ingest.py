@@ -0,0 +1,226 @@
+import asyncio
+import datetime
+import io
+import os.path
+import tarfile
+import tempfile
+from unittest import mock
+
+from nose.tools import assert_equal
+from nose.tools import assert_raises
+
+from stem.descriptor.networkstatus import DirectoryAuthority
+from stem.descriptor.networkstatus import NetworkStatusDocumentV3
+
+from bushel.archive import DirectoryArchive
+from bushel.archive import bandwidth_file_digest
+from bushel.archive import collector_431_filename
+from bushel.archive import collector_433_filename
+from bushel.archive import collector_bandwidth_filename
+from bushel.archive import prepare_annotated_content
+from bushel.archive import vote_digest
+from bushel.bandwidth.file import BandwidthFile
+from bushel.bandwidth.test_file import example_sbws_103
+from bushel.fixtures import OTHER
+from bushel.fixtures import RELAY
+from bushel.fixtures import START
+from bushel.fixtures import consensus
+from bushel.fixtures import relay_descriptors
+from bushel.fixtures import router
+from bushel.fixtures import timestamp
+from bushel.ingest import classify_member
+from bushel.ingest import import_tarball
+
+
+def _add_member(tarball, name, content):
+    info = tarfile.TarInfo(name)
+    info.size = len(content)
+    tarball.addfile(info, io.BytesIO(content))
+
+
+def _descriptor_member(descriptor):
+    digest = descriptor.digest().lower()
+    return (f"server-descriptors-2018-11/{digest[0]}/{digest[1]}/{digest}",
+            prepare_annotated_content(descriptor))
+
+
+def _consensus_member(document):
+    return ("consensuses-2018-11/19/" +
+            collector_431_filename(document.valid_after),
+            prepare_annotated_content(document))
+
+
+def _bandwidth_member(bandwidth_file):
+    return ("bandwidths-2018-04/16/" + collector_bandwidth_filename(
+        bandwidth_file.published, bandwidth_file_digest(bandwidth_file)),
+            prepare_annotated_content(bandwidth_file))
+
+
+def _write_tarball(tarball_path, members):
+    with tarfile.open(tarball_path, "w:xz") as tarball:
+        for name, content in members:
+            _add_member(tarball, name, content)
+
+
+def _measurements(archive, fingerprint):
+    return archive.relay_bandwidth_history(fingerprint,
+                                           datetime.datetime(2018, 4, 1),
+                                           datetime.datetime(2018, 5, 1))
+
+
+def test_import_tarball():
+    descriptors = relay_descriptors(5, published="2018-11-19 15:00:00")
+    status = consensus(0)
+
+    with tempfile.TemporaryDirectory() as archive_path:
+        tarball_path = os.path.join(archive_path, "collector.tar.xz")
+        _write_tarball(tarball_path,
+                       [_descriptor_member(d) for d in descriptors] +
+                       [_consensus_member(status)])
+
+        async def import_and_read(archive):
+            stats = await import_tarball(archive, tarball_path, chunk_size=2)
+            assert_equal((stats["documents"], stats["unrecognized"]), (6, 0))
+            for descriptor in descriptors:
+                archived = await archive.relay_server_descriptor(
+                    descriptor.digest(), None)
+                assert_equal(archived.get_bytes(), descriptor.get_bytes())
+            archived = await archive.relay_consensus("ns", status.valid_after)
+            assert_equal(archived.valid_after, status.valid_after)
+
+        asyncio.run(import_and_read(DirectoryArchive(archive_path)))
+
+
+def test_unclassifiable_members():
+    descriptor = relay_descriptors(1)[0]
+    content = prepare_annotated_content(descriptor)
+    unpublished = b"\n".join(line for line in content.split(b"\n")
+                             if not line.startswith(b"published "))
+    members = [
+        ("README", b"Not a document\n"),
+        ("server-descriptors-2018-11/unknown", b"@type unknown 1.0\n"),
+        ("server-descriptors-2018-11/a/b/not-a-digest", content),
+        (_descriptor_member(descriptor)[0], unpublished),
+        ("consensuses-2018-11/19/not-a-time",
+         _consensus_member(consensus(0))[1]),
+    ]
+    archive = DirectoryArchive("/srv/archive")
+    for name, member in members:
+        assert_equal(classify_member(archive, name, member), None)
+
+    with tempfile.TemporaryDirectory() as archive_path:
+        tarball_path = os.path.join(archive_path, "collector.tar.xz")
+        _write_tarball(tarball_path,
+                       members + [_descriptor_member(descriptor)])
+        stats = asyncio.run(import_tarball(DirectoryArchive(archive_path),
+                                           tarball_path))
+        assert_equal((stats["documents"], stats["unrecognized"]),
+                     (1, len(members)))
+
+
+def test_import_votes_and_bandwidth_files():
+    valid_after = START
+    vote = NetworkStatusDocumentV3.create(
+        {"vote-status": "vote", "valid-after": timestamp(0)},
+        authorities=[DirectoryAuthority.create(is_vote=True)])
+    v3ident = vote.directory_authorities[0].v3ident
+    digest = vote_digest(vote).upper()
+    bandwidth_file = BandwidthFile(example_sbws_103)
+
+    with tempfile.TemporaryDirectory() as archive_path:
+        tarball_path = os.path.join(archive_path, "collector.tar.xz")
+        _write_tarball(tarball_path, [
+            ("votes-2018-11/19/" +
+             collector_433_filename(valid_after, v3ident, digest),
+             prepare_annotated_content(vote)),
+            _bandwidth_member(bandwidth_file),
+        ])
+
+        async def import_and_read(archive):
+            # Load the day's votes so that the index has to be updated
+            assert_equal(archive.vote_index.lookup(valid_after, v3ident), [])
+            stats = await import_tarball(archive, tarball_path)
+            assert_equal(stats["documents"], 2)
+            assert_equal(archive.vote_index.lookup(valid_after, v3ident),
+                         [digest])
+            archived = await archive.relay_vote(v3ident,
+                                                valid_after=valid_after)
+            assert_equal(archived.get_bytes(), vote.get_bytes())
+            assert_equal(
+                await _measurements(
+                    archive, "68A483E05A2ABDCA6DA5A3EF8DB5177638A27F80"),
+                [(bandwidth_file.timestamp, 38000)])
+            assert await archive.relay_bandwidth_file(
+                bandwidth_file.published)
+
+        asyncio.run(import_and_read(DirectoryArchive(archive_path)))
+
+
+def test_interrupted_import():
+    descriptors = relay_descriptors(6, published="2018-11-19 15:00:00")
+    bandwidth_file = BandwidthFile(example_sbws_103)
+
+    with tempfile.TemporaryDirectory() as archive_path:
+        tarball_path = os.path.join(archive_path, "collector.tar.xz")
+        _write_tarball(tarball_path,
+                       [_bandwidth_member(bandwidth_file)] +
+                       [_descriptor_member(d) for d in descriptors])
+
+        async def interrupt_and_resume(archive):
+            store_documents = archive.store_documents
+            written = []
+
+            async def fail_after_first(stored, batch_size):
+                if written:
+                    raise OSError("Interrupted")
+                written.extend(stored)
+                return await store_documents(stored, batch_size)
+
+            with mock.patch.object(archive, "store_documents",
+                                   fail_after_first):
+                with assert_raises(OSError):
+                    await import_tarball(archive, tarball_path, chunk_size=3)
+            assert_equal(len(written), 3)
+
+            # Running the import again only writes what was missed
+            stats = await import_tarball(archive, tarball_path, chunk_size=3)
+            assert_equal(stats["documents"], 7)
+            assert_equal(archive.store_stats()["written"], 7)
+            assert_equal(archive.store_stats()["skipped"], 3)
+            for descriptor in descriptors:
+                assert await archive.relay_server_descriptor(
+                    descriptor.digest(), None)
+            assert_equal(
+                len(await _measurements(
+                    archive, "68A483E05A2ABDCA6DA5A3EF8DB5177638A27F80")), 1)
+
+        asyncio.run(interrupt_and_resume(DirectoryArchive(archive_path)))
+
+
+def test_import_consensus_indexes():
+    consensuses = [
+        consensus(hour, [router(RELAY, "198.51.100.7", flags="Fast Running"),
+                         router(OTHER, "198.51.100.8", flags="Running")])
+        for hour in range(3)
+    ]
+    end = START + datetime.timedelta(hours=3)
+
+    with tempfile.TemporaryDirectory() as archive_path:
+        tarball_path = os.path.join(archive_path, "consensuses.tar.xz")
+        _write_tarball(tarball_path, [_consensus_member(document)
+                                      for document in consensuses])
+
+        async def import_and_query(archive):
+            await import_tarball(archive, tarball_path, chunk_size=2)
+            runs = await archive.relay_status_history(RELAY)
+            assert_equal([(run.start, run.end, run.flag_names)
+                          for run in runs],
+                         [(START, end, ["Fast", "Running"])])
+            intervals = archive.address_index.lookup_network(
+                "198.51.100.0/24", START + datetime.timedelta(hours=1))
+            assert_equal([(i.address, i.fingerprint, i.start, i.end)
+                          for i in intervals],
+                         [("198.51.100.7", RELAY, START, end),
+                          ("198.51.100.8", OTHER, START, end)])
+
+        asyncio.run(import_and_query(DirectoryArchive(archive_path)))
@@ -4,6 +4,7 @@ import datetime
 from nose.tools import assert_equal
 
 from bushel.monitoring import OK, WARNING, CRITICAL, UNKNOWN
+from bushel.monitoring import catalog_latest_too_old
 from bushel.monitoring import oldest_datetime
 from bushel.monitoring import utc_datetime_too_old
 
@@ -51,3 +52,24 @@ def test_utc_datetime_too_old_critical():
     assert_equal(status, CRITICAL)
     assert_equal(message, "Timestamp is too old (30 sec): "
                           "ts2=2019-05-03T17:20:20")
+
+class FakeCatalog:
+    def __init__(self, latest):
+        self._latest = latest
+
+    def latest(self, doctype):
+        return self._latest.get(doctype)
+
+def test_catalog_latest_too_old():
+    utcnow = datetime.datetime(2019, 5, 3, 17, 20, 50)
+    catalog = FakeCatalog({
+        "consensus": datetime.datetime(2019, 5, 3, 17, 0, 0),
+    })
+    status, message = catalog_latest_too_old(catalog, ["consensus"],
+                                              80 * 60, 90 * 60, utcnow=utcnow)
+    assert_equal(status, OK)
+    status, message = catalog_latest_too_old(catalog,
+                                              ["consensus", "vote"],
+                                              80 * 60, 90 * 60, utcnow=utcnow)
+    assert_equal(status, CRITICAL)
+    assert_equal(message, "No documents archived: vote")
@@ -0,0 +1,98 @@
+import asyncio
+import hashlib
+import os.path
+import tempfile
+
+from nose.tools import assert_equal
+
+from stem.descriptor.server_descriptor import RelayDescriptor
+
+from bushel import pack
+from bushel.pack import PackFile
+from bushel.fixtures import relay_descriptors
+from bushel.pack import PackedDirectoryArchive
+
+
+def _digest(content):
+    return hashlib.sha1(content).hexdigest()
+
+
+def test_pack_file_append_and_get():
+    contents = [f"descriptor {i}\n".encode('utf-8') for i in range(10)]
+    with tempfile.TemporaryDirectory() as pack_path:
+        pack_file = PackFile(os.path.join(pack_path, "2018-11.pack"), 20)
+        for content in contents:
+            assert_equal(pack_file.append(_digest(content), content), True)
+        assert_equal(pack_file.append(_digest(contents[0]), contents[0]),
+                     False)
+        for content in contents:
+            assert_equal(pack_file.get(_digest(content)), content)
+        assert_equal(pack_file.get(_digest(b"missing")), None)
+        pack_file.close()
+        # Reopen and read back using only the sorted index
+        pack_file = PackFile(os.path.join(pack_path, "2018-11.pack"), 20)
+        assert_equal(pack_file.digests(),
+                     sorted(_digest(content) for content in contents))
+        for content in contents:
+            assert_equal(pack_file.get(_digest(content)), content)
+        pack_file.close()
+
+
+def test_pack_file_merge_threshold():
+    original_threshold = pack.MERGE_THRESHOLD
+    pack.MERGE_THRESHOLD = 3
+    try:
+        contents = [f"descriptor {i}\n".encode('utf-8') for i in range(7)]
+        with tempfile.TemporaryDirectory() as pack_path:
+            pack_file = PackFile(os.path.join(pack_path, "2018-11.pack"), 20)
+            for content in contents:
+                pack_file.append(_digest(content), content)
+            assert_equal(os.path.getsize(pack_file.log_path),
+                         pack_file.entry.size)
+            assert_equal(os.path.getsize(pack_file.index_path),
+                         pack_file.entry.size * 6)
+            for content in contents:
+                assert_equal(pack_file.get(_digest(content)), content)
+            pack_file.close()
+    finally:
+        pack.MERGE_THRESHOLD = original_threshold
+
+
+def test_packed_archive_batched_reads():
+    descriptors = relay_descriptors(5)
+
+    async def store_and_retrieve(archive):
+        await archive.store_many(descriptors)
+        retrieved = await archive.relay_server_descriptors(
+            [descriptor.digest() for descriptor in descriptors],
+            descriptors[0].published)
+        assert_equal(sorted(d.get_bytes() for d in retrieved),
+                     sorted(d.get_bytes() for d in descriptors))
+
+    with tempfile.TemporaryDirectory() as archive_path:
+        asyncio.run(store_and_retrieve(PackedDirectoryArchive(archive_path)))
+
+
+def _parse_nickname(raw_content):
+    return RelayDescriptor(raw_content).nickname
+
+
+def test_packed_archive_options():
+    descriptors = relay_descriptors(3)
+
+    async def store_and_retrieve(archive):
+        await archive.store_many(descriptors)
+        await archive.store_many(descriptors)
+        # Packs never hold a descriptor twice, whatever skip_existing is
+        assert_equal(archive.store_stats()["skipped"], 3)
+        retrieved = await archive.relay_server_descriptors(
+            [descriptor.digest() for descriptor in descriptors],
+            descriptors[0].published)
+        assert_equal(sorted(retrieved), [f"test{i}" for i in range(3)])
+
+    with tempfile.TemporaryDirectory() as archive_path:
+        asyncio.run(store_and_retrieve(
+            PackedDirectoryArchive(
+                archive_path,
+                parsers={"server-descriptor": _parse_nickname},
+                skip_existing=False)))
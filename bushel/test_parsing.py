@@ -0,0 +1,97 @@
+import asyncio
+import datetime
+import tempfile
+
+from nose.tools import assert_equal
+
+from stem.descriptor.networkstatus import NetworkStatusDocumentV3
+
+from bushel.archive import DirectoryArchive
+from bushel.archive import prepare_annotated_content
+from bushel.directory.network_status import NetworkStatusConsensus
+from bushel.fixtures import relay_descriptors
+from bushel.parsing import BUSHEL_PARSERS
+from bushel.parsing import ParseMode
+from bushel.parsing import parse_raw
+from bushel.parsing import sniff_type
+
+
+def test_parse_modes():
+    descriptors = relay_descriptors(5)
+    digests = [descriptor.digest() for descriptor in descriptors]
+
+    async def retrieve(archive):
+        retrieved = await archive.relay_server_descriptors(
+            digests, descriptors[0].published)
+        assert_equal(sorted(d.nickname for d in retrieved),
+                     sorted(d.nickname for d in descriptors))
+
+    with tempfile.TemporaryDirectory() as archive_path:
+        asyncio.run(DirectoryArchive(archive_path).store_many(descriptors))
+        for mode in ParseMode:
+            archive = DirectoryArchive(archive_path, parse_mode=mode,
+                                       parse_workers=2)
+            asyncio.run(retrieve(archive))
+            archive.parser.close()
+
+
+def test_parsers():
+    consensus = NetworkStatusDocumentV3.create({
+        "valid-after": "2018-11-19 15:00:00",
+        "fresh-until": "2018-11-19 16:00:00",
+        "valid-until": "2018-11-19 18:00:00",
+    })
+    valid_after = datetime.datetime(2018, 11, 19, 15)
+    raw_content = (b"@type network-status-consensus-3 1.0\n" +
+                   consensus.get_bytes() + b"\n")
+
+    assert isinstance(parse_raw(raw_content), NetworkStatusDocumentV3)
+    parsed = parse_raw(raw_content, BUSHEL_PARSERS)
+    assert isinstance(parsed, NetworkStatusConsensus)
+    assert_equal(parsed.valid_after, valid_after)
+
+    async def retrieve(archive):
+        raw = await archive.relay_consensus(valid_after=valid_after, raw=True)
+        assert_equal(raw.annotation.name, "network-status-consensus-3")
+        assert_equal(sniff_type(raw.content), None)
+        assert isinstance(await archive.relay_consensus(valid_after=valid_after),
+                          NetworkStatusDocumentV3)
+
+    with tempfile.TemporaryDirectory() as archive_path:
+        archive = DirectoryArchive(archive_path)
+        asyncio.run(archive.store(consensus))
+        asyncio.run(retrieve(archive))
+
+
+def test_parser_failure():
+    # bushel's parser requires the consensus to end with a newline, which
+    # stem does not add
+    consensus = NetworkStatusDocumentV3.create()
+    raw_content = prepare_annotated_content(consensus)
+    assert_equal(parse_raw(raw_content, BUSHEL_PARSERS), None)
+    assert isinstance(parse_raw(raw_content), NetworkStatusDocumentV3)
+
+    async def retrieve(archive):
+        await archive.store(consensus)
+        assert_equal(
+            await archive.relay_consensus(valid_after=consensus.valid_after),
+            None)
+
+    with tempfile.TemporaryDirectory() as archive_path:
+        asyncio.run(retrieve(DirectoryArchive(archive_path,
+                                              parsers=BUSHEL_PARSERS)))
+
+
+def test_raw_memory_mapped():
+    consensus = NetworkStatusDocumentV3.create()
+
+    async def retrieve(archive):
+        await archive.store(consensus)
+        raw = await archive.relay_consensus(valid_after=consensus.valid_after,
+                                            raw=True)
+        assert_equal(raw.annotation.name, "network-status-consensus-3")
+        assert isinstance(raw.content, memoryview)
+        assert_equal(bytes(raw.content), consensus.get_bytes())
+
+    with tempfile.TemporaryDirectory() as archive_path:
+        asyncio.run(retrieve(DirectoryArchive(archive_path, mmap_threshold=1)))
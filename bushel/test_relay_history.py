@@ -0,0 +1,118 @@
+import asyncio
+import datetime
+import os.path
+import tempfile
+
+from nose.tools import assert_equal
+from nose.tools import assert_raises
+
+from bushel.archive import DirectoryArchive
+from bushel.fixtures import OTHER
+from bushel.fixtures import RELAY
+from bushel.fixtures import START
+from bushel.fixtures import consensus
+from bushel.fixtures import router
+from bushel.relay_history import RelayHistory
+
+GUARD_FLAGS = ["Fast", "Guard", "Running"]
+
+
+def _consensuses():
+    return [
+        consensus(0, [router(RELAY, flags="Fast Guard Running"),
+                      router(OTHER, flags="Fast Running")]),
+        consensus(1, [router(RELAY, flags="Fast Guard Running")]),
+        consensus(2, [router(RELAY, flags="Fast Guard Running"),
+                      router(OTHER, flags="Fast Running")]),
+        consensus(3, [router(RELAY, flags="Fast Running")]),
+    ]
+
+
+def _summary(runs):
+    return [(run.start.hour, run.end.hour, run.flag_names) for run in runs]
+
+
+def _history(directory, order):
+    history = RelayHistory(os.path.join(directory, "relay-history.sqlite"))
+    consensuses = _consensuses()
+    started = [history.add_consensus(consensuses[i]) for i in order]
+    return history, started
+
+
+def test_relay_history_runs():
+    with tempfile.TemporaryDirectory() as directory:
+        history, started = _history(directory, [0, 1, 2, 3])
+        assert_equal(started, [2, 0, 1, 1])
+        assert_equal(_summary(history.runs(RELAY)),
+                     [(15, 18, GUARD_FLAGS), (18, 19, ["Fast", "Running"])])
+        assert_equal(_summary(history.runs(OTHER)),
+                     [(15, 16, ["Fast", "Running"]),
+                      (17, 18, ["Fast", "Running"])])
+        assert_equal(history.runs(RELAY)[0].bandwidth, 100)
+        assert_equal(
+            _summary(history.runs(RELAY, START + datetime.timedelta(hours=3))),
+            [(18, 19, ["Fast", "Running"])])
+        assert_equal(history.runs("0" * 40), [])
+
+
+def test_relay_history_out_of_order():
+    with tempfile.TemporaryDirectory() as directory:
+        # The middle consensus joins the runs on either side of it
+        history, started = _history(directory, [2, 0, 3, 1])
+        assert_equal(started, [2, 2, 1, 0])
+        assert_equal(_summary(history.runs(RELAY)),
+                     [(15, 18, GUARD_FLAGS), (18, 19, ["Fast", "Running"])])
+        # A consensus added before the run it extends
+        history.clear()
+        assert_equal(history.add_consensus(_consensuses()[1]), 1)
+        assert_equal(history.add_consensus(_consensuses()[0]), 1)
+        assert_equal(_summary(history.runs(RELAY)), [(15, 17, GUARD_FLAGS)])
+
+
+def test_relay_history_duplicates():
+    with tempfile.TemporaryDirectory() as directory:
+        history, started = _history(directory, [0, 1, 0, 1, 1])
+        assert_equal(started, [2, 0, 0, 0, 0])
+        assert_equal(_summary(history.runs(RELAY)), [(15, 17, GUARD_FLAGS)])
+        assert_equal(_summary(history.runs(OTHER)),
+                     [(15, 16, ["Fast", "Running"])])
+
+
+def test_relays_with_flag():
+    with tempfile.TemporaryDirectory() as directory:
+        history, _ = _history(directory, [0, 1, 2, 3])
+        assert_equal(
+            history.relays_with_flag("Guard", datetime.datetime(2018, 1, 1),
+                                     datetime.datetime(2019, 1, 1)), [RELAY])
+        assert_equal(
+            history.relays_with_flag("Fast", START,
+                                     START + datetime.timedelta(hours=1)),
+            [RELAY, OTHER])
+        assert_equal(
+            history.relays_with_flag("Guard",
+                                     START + datetime.timedelta(hours=3),
+                                     START + datetime.timedelta(hours=4)),
+            [])
+        with assert_raises(ValueError):
+            history.relays_with_flag("Unknown", START, START)
+
+
+def test_archive_relay_history():
+    consensuses = _consensuses()
+
+    async def store_and_rebuild(archive):
+        # Reading an empty history does not create the database
+        assert_equal(await archive.relay_status_history(RELAY), [])
+        assert not os.path.exists(archive.relay_history.history_path)
+        for document in consensuses:
+            await archive.store(document)
+        assert_equal(_summary(await archive.relay_status_history(RELAY)),
+                     [(15, 18, GUARD_FLAGS), (18, 19, ["Fast", "Running"])])
+        assert_equal(await archive.rebuild_relay_history(
+            START + datetime.timedelta(hours=1),
+            START + datetime.timedelta(hours=3)), 3)
+        assert_equal(_summary(archive.relay_history.runs(RELAY)),
+                     [(16, 18, GUARD_FLAGS), (18, 19, ["Fast", "Running"])])
+
+    with tempfile.TemporaryDirectory() as archive_path:
+        asyncio.run(store_and_rebuild(DirectoryArchive(archive_path)))
@@ -0,0 +1,76 @@
+import asyncio
+import base64
+import datetime
+import os.path
+import tempfile
+
+from nose.tools import assert_equal
+
+from stem.descriptor.networkstatus import NetworkStatusDocumentV3
+from stem.descriptor.router_status_entry import RouterStatusEntryV3
+from stem.descriptor.server_descriptor import RelayDescriptor
+
+from bushel.archive import DirectoryArchive
+from bushel.catalog import CONSENSUS
+from bushel.index import SERVER_DESCRIPTOR
+from bushel.retention import RetentionPolicy
+from bushel.retention import apply_retention
+
+NOW = datetime.datetime(2019, 3, 15)
+
+
+def test_apply_retention():
+    descriptors = [
+        RelayDescriptor.create({
+            "router": f"test{i} 127.0.0.1 9001 0 0",
+            "published": "2018-10-19 15:00:00",
+        }) for i in range(4)
+    ]
+    referenced = base64.b64encode(bytes.fromhex(
+        descriptors[0].digest())).rstrip(b"=").decode('ascii')
+    consensus = NetworkStatusDocumentV3.create({
+        "valid-after": "2019-02-19 15:00:00",
+        "fresh-until": "2019-02-19 16:00:00",
+        "valid-until": "2019-02-19 18:00:00",
+    }, routers=[
+        RouterStatusEntryV3.create({
+            "r": (f"test0 p1aag7VwarGxqctS7/fS0y5FU+s {referenced} "
+                  "2018-10-19 15:00:00 127.0.0.1 9001 0"),
+        })
+    ])
+    policy = RetentionPolicy(expire={SERVER_DESCRIPTOR: 3}, compact_after=0)
+
+    async def expire_and_compact(archive):
+        await archive.store_many(descriptors)
+        await archive.store(consensus)
+        paths = [
+            archive.relay_server_descriptor_path(d.published, d.digest())
+            for d in descriptors
+        ]
+
+        report = await apply_retention(archive, policy, dry_run=True,
+                                       now=NOW)
+        assert_equal(report["expired"], 3)
+        assert_equal(report["compacted"], 1)
+        assert_equal(report["reclaimed_bytes"],
+                     report["expired_bytes"] + report["compacted_bytes"])
+        assert all(os.path.exists(path) for path in paths)
+
+        assert_equal(await apply_retention(archive, policy, now=NOW), report)
+        assert_equal([os.path.exists(path) for path in paths],
+                     [True, False, False, False])
+        assert_equal(
+            archive.index.lookup(SERVER_DESCRIPTOR,
+                                 descriptors[1].digest().lower()), None)
+        assert_equal(archive.catalog.entries(SERVER_DESCRIPTOR)[0].count, 1)
+        consensus_path = archive.relay_consensus_path(consensus.valid_after)
+        assert not os.path.exists(consensus_path)
+        assert os.path.exists(consensus_path + ".xz")
+        assert_equal(archive.catalog.entries(CONSENSUS)[0].count, 1)
+
+        # Everything left is referenced or already compacted
+        report = await apply_retention(archive, policy, now=NOW)
+        assert_equal(report["reclaimed_bytes"], 0)
+
+    with tempfile.TemporaryDirectory() as archive_path:
+        asyncio.run(expire_and_compact(DirectoryArchive(archive_path)))
@@ -0,0 +1,138 @@
+import asyncio
+import datetime
+import os.path
+import tempfile
+from unittest import mock
+
+from nose.tools import assert_equal
+
+from stem.descriptor.extrainfo_descriptor import RelayExtraInfoDescriptor
+from stem.descriptor.microdescriptor import Microdescriptor
+from stem.descriptor.router_status_entry import RouterStatusEntryMicroV3
+
+from bushel.archive import DirectoryArchive
+from bushel.archive import microdescriptor_hex_digest
+from bushel.fixtures import consensus
+from bushel.fixtures import relay_descriptors
+from bushel.fixtures import router
+from bushel.index import SERVER_DESCRIPTOR
+from bushel.snapshot import NetworkSnapshot
+
+WHEN = datetime.datetime(2018, 11, 19, 15, 30)
+
+
+def _routers(descriptors):
+    return [
+        router(bytes([i]).hex() * 20, digest=descriptor.digest(),
+               nickname=descriptor.nickname)
+        for i, descriptor in enumerate(descriptors)
+    ]
+
+
+def _with_consensus(descriptors):
+    return descriptors + [consensus(0, _routers(descriptors))]
+
+
+async def _store(archive, documents):
+    with mock.patch("bushel.archive.valid_after_now",
+                    return_value=datetime.datetime(2018, 11, 19)):
+        await archive.store_many(documents)
+
+
+def test_snapshot():
+    extra_info = RelayExtraInfoDescriptor.create({
+        "published": "2018-11-19 14:00:00",
+    })
+    descriptors = relay_descriptors(
+        1, published="2018-11-19 14:00:00",
+        extra_info_digest=extra_info.digest()) + relay_descriptors(
+            2, published="2018-11-19 14:00:00")[1:]
+    microdescriptor = Microdescriptor.create()
+    documents = _with_consensus(descriptors) + [
+        extra_info, microdescriptor,
+        consensus(0, [
+            RouterStatusEntryMicroV3.create({"m": microdescriptor.digest()})
+        ], flavor="microdesc"),
+    ]
+
+    async def materialize(archive):
+        await _store(archive, documents)
+        snapshot = await archive.snapshot(WHEN)
+        assert_equal(snapshot.consensus().valid_after,
+                     datetime.datetime(2018, 11, 19, 15))
+        assert_equal(snapshot.consensus("microdesc").valid_after,
+                     datetime.datetime(2018, 11, 19, 15))
+        assert_equal(
+            sorted(d.nickname
+                   for d in snapshot.descriptors(SERVER_DESCRIPTOR)),
+            ["test0", "test1"])
+        assert_equal(
+            snapshot.extra_info_descriptor(extra_info.digest()).digest(),
+            extra_info.digest())
+        md_digest = microdescriptor_hex_digest(microdescriptor.digest())
+        assert_equal(snapshot.microdescriptor(md_digest).get_bytes(),
+                     microdescriptor.get_bytes())
+        assert_equal(snapshot.server_descriptor("0" * 40), None)
+
+    with tempfile.TemporaryDirectory() as archive_path:
+        asyncio.run(materialize(DirectoryArchive(archive_path)))
+
+
+def test_snapshot_previous_month():
+    descriptors = [
+        relay_descriptors(1, published=published)[0]
+        for published in ("2018-11-19 14:00:00", "2018-10-31 15:00:00",
+                          "2018-09-30 15:00:00")
+    ]
+
+    async def materialize(archive):
+        await _store(archive, _with_consensus(descriptors))
+        # Without the index, descriptors are only found from the hint
+        archive.index.remove_many([(SERVER_DESCRIPTOR, d.digest().lower())
+                                   for d in descriptors])
+        snapshot = await archive.snapshot(WHEN)
+        # Descriptors published last month are found by retrying the
+        # previous month, but no further back
+        assert_equal(
+            [snapshot.server_descriptor(d.digest()) is not None
+             for d in descriptors], [True, True, False])
+
+    with tempfile.TemporaryDirectory() as archive_path:
+        asyncio.run(materialize(DirectoryArchive(archive_path)))
+
+
+def test_snapshot_persist():
+    descriptors = relay_descriptors(2, published="2018-11-19 14:00:00")
+
+    async def materialize(archive):
+        await _store(archive, _with_consensus(descriptors))
+        snapshot = await archive.snapshot(WHEN, persist=True)
+        path = archive.snapshot_path(WHEN)
+        assert os.path.exists(path)
+
+        loaded = NetworkSnapshot.load(path)
+        assert_equal(loaded.when, WHEN)
+        assert_equal(loaded.counts(), snapshot.counts())
+        assert_equal(
+            loaded.server_descriptor(descriptors[1].digest()).nickname,
+            "test1")
+        # A persisted snapshot is loaded instead of reading the archive
+        with mock.patch.object(archive, "iter_descriptors") as read:
+            reloaded = await archive.snapshot(WHEN, persist=True)
+        read.assert_not_called()
+        assert_equal(reloaded.counts(), snapshot.counts())
+        assert_equal(NetworkSnapshot.load(path + ".missing"), None)
+
+    with tempfile.TemporaryDirectory() as archive_path:
+        asyncio.run(materialize(DirectoryArchive(archive_path)))
+
+
+def test_snapshot_without_consensus():
+    async def materialize(archive):
+        await archive.store(consensus(0))
+        expired = await archive.snapshot(WHEN + datetime.timedelta(hours=3))
+        assert_equal(expired.consensus(), None)
+        assert_equal(set(expired.counts().values()), {0})
+
+    with tempfile.TemporaryDirectory() as archive_path:
+        asyncio.run(materialize(DirectoryArchive(archive_path)))
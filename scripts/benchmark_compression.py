@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Benchmark the read-latency tradeoff of at-rest compression for archived
+network status documents.
+
+Each available compression algorithm is used to store the same consensus in a
+temporary archive, which is then read back a number of times. The size on
+disk and the mean latency for reading and for reading and parsing are
+reported for each algorithm.
+
+Usage: benchmark_compression.py [CONSENSUS_PATH] [--reads N]
+
+If no consensus is given, a synthetic consensus with 6500 router status
+entries is generated.
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from stem.descriptor import DocumentHandler
+from stem.descriptor import parse_file
+from stem.descriptor.networkstatus import NetworkStatusDocumentV3
+from stem.descriptor.router_status_entry import RouterStatusEntryV3
+
+from bushel.archive import DirectoryArchive
+from bushel.compression import ArchiveCompression
+from bushel.compression import read_archived
+
+
+def synthetic_consensus(relays):
+    routers = [
+        RouterStatusEntryV3.create({
+            "r": (f"relay{i} {os.urandom(20).hex()[:27]} "
+                  f"{os.urandom(20).hex()[:27]} 2018-11-19 14:00:00 "
+                  f"10.0.{i // 256}.{i % 256} 9001 0"),
+            "s": "Fast Running Stable Valid",
+            "w": f"Bandwidth={i * 10}",
+        }) for i in range(relays)
+    ]
+    return NetworkStatusDocumentV3.create(routers=routers)
+
+
+async def benchmark(consensus, reads):
+    print(f"{'compression':<14}{'bytes':>12}{'read ms':>10}{'parse ms':>10}")
+    for compression in ArchiveCompression:
+        if not compression.available:
+            print(f"{compression.name:<14}{'unavailable':>12}")
+            continue
+        with tempfile.TemporaryDirectory() as archive_path:
+            archive = DirectoryArchive(archive_path, compression=compression)
+            await archive.store(consensus)
+            path = archive.stored_path(consensus, archive.path_for(consensus))
+            size = os.path.getsize(path)
+            start = time.perf_counter()
+            for _ in range(reads):
+                read_archived(path)
+            read_ms = (time.perf_counter() - start) * 1000 / reads
+            start = time.perf_counter()
+            for _ in range(reads):
+                await archive.relay_consensus("ns", consensus.valid_after)
+            parse_ms = (time.perf_counter() - start) * 1000 / reads
+        print(f"{compression.name:<14}{size:>12}{read_ms:>10.2f}"
+              f"{parse_ms:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("consensus", nargs="?",
+                        help="Path to a consensus to benchmark with")
+    parser.add_argument("--reads", type=int, default=20,
+                        help="Number of reads for each compression")
+    args = parser.parse_args()
+    if args.consensus:
+        consensus = next(parse_file(args.consensus,
+                                    document_handler=DocumentHandler.DOCUMENT))
+    else:
+        consensus = synthetic_consensus(6500)
+    asyncio.run(benchmark(consensus, args.reads))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Benchmark the parse executors available to a DirectoryArchive.
+
+A temporary archive is filled with synthetic server descriptors, which are
+then read back as a batch using each parse mode. For the process mode, the
+number of worker processes is varied up to the number of CPUs to show how
+parsing scales with the number of cores.
+
+Usage: benchmark_parsing.py [--descriptors N]
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from stem.descriptor.server_descriptor import RelayDescriptor
+
+from bushel.archive import DirectoryArchive
+from bushel.parsing import ParseMode
+
+
+async def read_all(archive, digests, published):
+    started = time.perf_counter()
+    descriptors = await archive.relay_server_descriptors(digests, published)
+    # Touch an attribute to include any lazy parsing in the measurement
+    for descriptor in descriptors:
+        descriptor.exit_policy  # pylint: disable=pointless-statement
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--descriptors", type=int, default=7000,
+                        help="Number of server descriptors to read")
+    args = parser.parse_args()
+    descriptors = [
+        RelayDescriptor.create({"router": f"test{i} 127.0.0.1 9001 0 0"})
+        for i in range(args.descriptors)
+    ]
+    digests = [descriptor.digest() for descriptor in descriptors]
+    published = descriptors[0].published
+    configurations = [(ParseMode.INLINE, None), (ParseMode.THREAD, None)]
+    workers = 1
+    while workers <= os.cpu_count():
+        configurations.append((ParseMode.PROCESS, workers))
+        workers *= 2
+    print(f"{'mode':<10}{'workers':>8}{'seconds':>10}{'descriptors/s':>15}")
+    with tempfile.TemporaryDirectory() as archive_path:
+        asyncio.run(DirectoryArchive(archive_path).store_many(descriptors))
+        for mode, workers in configurations:
+            archive = DirectoryArchive(archive_path, parse_mode=mode,
+                                       parse_workers=workers)
+            elapsed = asyncio.run(read_all(archive, digests, published))
+            archive.parser.close()
+            print(f"{mode.value:<10}{workers or '-':>8}{elapsed:>10.2f}"
+                  f"{len(digests) / elapsed:>15.0f}")
+
+
+if __name__ == "__main__":
+    main()